@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Ingredient, Recipe
+
+
+@admin.register(Recipe)
+class RecipeAdmin(admin.ModelAdmin):
+    list_display = ("name", "time_min", "difficulty", "pivot", "ingredient_count", "hits", "created_at")
+    search_fields = ("name", "pivot")
+
+
+@admin.register(Ingredient)
+class IngredientAdmin(admin.ModelAdmin):
+    list_display = ("name", "recipe_count")
+    search_fields = ("name",)
@@ -0,0 +1,71 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.utils import imagestore
+
+
+def human(nbytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+class Command(BaseCommand):
+    help = "Report on the dish image store, compact it and evict least recently used images over the cap."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--compact", action="store_true",
+                            help="Migrate flat-layout files into shards and drop temp files, stale markers "
+                                 "and orphaned previews/variants.")
+        parser.add_argument("--evict", action="store_true",
+                            help="Evict least recently used images until the store is under its caps.")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be removed without removing it.")
+        parser.add_argument("--max-bytes", type=int, help="Override IMAGE_STORE_MAX_BYTES for this run.")
+        parser.add_argument("--max-files", type=int, help="Override IMAGE_STORE_MAX_FILES for this run.")
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        with imagestore.maintenance_lock(blocking=True):
+            groups, legacy = imagestore.scan()
+            self.print_report(imagestore.report(groups, legacy), "Before" if options["compact"] or options["evict"] else "Store")
+
+            if options["compact"]:
+                result = imagestore.compact(groups, legacy, dry_run)
+                self.stdout.write(
+                    f"Compaction: migrated {result['migrated']} flat files, removed {result['removed_files']} files "
+                    f"({human(result['removed_bytes'])}) and {result['removed_dirs']} empty directories"
+                )
+                if result["migrated"] and not dry_run:
+                    groups, legacy = imagestore.scan()
+
+            if options["evict"]:
+                max_bytes = settings.IMAGE_STORE_MAX_BYTES if options["max_bytes"] is None else options["max_bytes"]
+                max_files = settings.IMAGE_STORE_MAX_FILES if options["max_files"] is None else options["max_files"]
+                result = imagestore.evict(groups, max_bytes, max_files, settings.IMAGE_STORE_LOW_WATER, dry_run)
+                self.stdout.write(
+                    f"Eviction: removed {result['evicted_images']} images, {result['evicted_files']} files "
+                    f"({human(result['freed_bytes'])})"
+                )
+
+            if (options["compact"] or options["evict"]) and not dry_run:
+                self.print_report(imagestore.report(*imagestore.scan()), "After")
+        if dry_run:
+            self.stdout.write("Dry run: nothing was removed.")
+
+    def print_report(self, report, title):
+        self.stdout.write(f"{title}: {report['images']} images, {report['files']} files, {human(report['bytes'])}")
+        if report["max_bytes"]:
+            self.stdout.write(f"  byte cap   {human(report['max_bytes'])} ({report['bytes'] / report['max_bytes']:.0%} used)")
+        if report["max_files"]:
+            self.stdout.write(f"  file cap   {report['max_files']} ({report['files'] / report['max_files']:.0%} used)")
+        for kind, (count, nbytes) in sorted(report["kinds"].items()):
+            self.stdout.write(f"  {kind:<10} {count:>8} files  {human(nbytes)}")
+        if report["legacy_files"]:
+            self.stdout.write(f"  {report['legacy_files']} files still in the flat layout; run with --compact")
+        if report["oldest_use"]:
+            age = (time.time() - report["oldest_use"]) / 86400
+            self.stdout.write(f"  least recently used image last served {age:.1f} days ago")
@@ -0,0 +1,100 @@
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils import warm
+from api.utils.gpt import recipes_format
+
+
+class Command(BaseCommand):
+    help = ("Pre-generate recipes and photos for frequent (products, preferences) inputs so get_dishes and "
+            "serve_image answer them from local data.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="File with one input per line: a get-dishes request as JSON, a JSON "
+                                          "list of products or comma-separated products; - for stdin.")
+        parser.add_argument("--preferences", help="JSON file with a list of preference presets (null for none) "
+                                                  "to cross with inputs that have no preferences.")
+        parser.add_argument("--top", type=int, help="Only the N most frequent inputs.")
+        parser.add_argument("--concurrency", type=int, default=4, help="Inputs generated at once.")
+        parser.add_argument("--dishes", type=int, help="Dishes per input, as a deadline plan would ask for.")
+        parser.add_argument("--format", dest="fmt", help="Recipes format (default RECIPES_FORMAT).")
+        parser.add_argument("--quality", default="medium", help="Photo quality.")
+        parser.add_argument("--no-photos", action="store_true", help="Only warm the recipes.")
+        parser.add_argument("--checkpoint", help="Progress file (default <input>.warm.json).")
+        parser.add_argument("--resume", action="store_true", help="Skip inputs finished by the interrupted run.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the current coverage.")
+
+    def handle(self, *args, **options):
+        try:
+            fmt = recipes_format(options["fmt"])
+        except ValueError as exc:
+            raise CommandError(exc)
+        presets = [None]
+        if options["preferences"]:
+            with open(options["preferences"]) as f:
+                presets = json.load(f)
+            if not isinstance(presets, list) or not presets:
+                raise CommandError("--preferences must be a non-empty JSON list.")
+        if options["input"] == "-":
+            pantries = warm.read_pantries(sys.stdin, presets, options["dishes"], fmt)
+        else:
+            with open(options["input"]) as f:
+                pantries = warm.read_pantries(f, presets, options["dishes"], fmt)
+        if options["top"]:
+            pantries = pantries[:options["top"]]
+
+        photos = not options["no_photos"]
+        variant = {"dishes": options["dishes"], "fmt": fmt}
+        path = options["checkpoint"] or (None if options["input"] == "-" else options["input"] + ".warm.json")
+        checkpoint = warm.Checkpoint(path if not options["dry_run"] else None)
+        if not options["resume"]:
+            checkpoint.done = set()
+
+        resumed = [p for p in pantries if p.key in checkpoint.done]
+        todo = [p for p in pantries if p.key not in checkpoint.done]
+        already = [p for p in todo if warm.is_warm(p, photos=photos, **variant)]
+        skip = {p.key for p in already}
+        cold = [p for p in todo if p.key not in skip]
+        self.stdout.write(f"Inputs: {len(pantries)} distinct, {sum(p.count for p in pantries)} requests; "
+                          f"{len(resumed)} done in the interrupted run, {len(already)} already warm, "
+                          f"{len(cold)} to generate")
+
+        warmed, failed, calls, rendered = [], [], 0, 0
+        started = time.monotonic()
+        if cold and not options["dry_run"]:
+            pool = ThreadPoolExecutor(max_workers=options["concurrency"], thread_name_prefix="warm")
+            futures = {pool.submit(warm.warm, p, quality=options["quality"], photos=photos, **variant): p
+                       for p in cold}
+            try:
+                for fut in as_completed(futures):
+                    pantry = futures[fut]
+                    try:
+                        c, r = fut.result()
+                    except Exception as exc:
+                        failed.append(pantry)
+                        self.stderr.write(f"  failed: {', '.join(map(str, pantry.products))}: {exc}")
+                        continue
+                    calls, rendered = calls + c, rendered + r
+                    warmed.append(pantry)
+                    checkpoint.add(pantry.key)
+                    if len(warmed) % 10 == 0:
+                        self.stdout.write(f"  {len(warmed)}/{len(cold)} warmed")
+            except KeyboardInterrupt:
+                self.stdout.write(f"Interrupted; rerun with --resume to continue from {path}")
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            pool.shutdown()
+
+        elapsed = time.monotonic() - started
+        covered = resumed + already + warmed
+        total = sum(p.count for p in pantries) or 1
+        self.stdout.write(f"Warmed {len(warmed)} inputs in {elapsed:.1f}s ({calls} recipe calls, {rendered} photos), "
+                          f"skipped {len(already)} already warm, {len(failed)} failed")
+        self.stdout.write(f"Coverage: {len(covered)}/{len(pantries)} inputs, "
+                          f"{sum(p.count for p in covered) / total:.1%} of requests")
+        if not failed and not options["dry_run"]:
+            checkpoint.clear()
@@ -0,0 +1,133 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from .utils import timing
+from .utils.metrics import REQUEST_SECONDS
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it responses are only gzipped
+    brotli = None
+
+COMPRESSIBLE = ("application/json", "text/")
+
+
+class ServerTimingMiddleware:
+    """Collects per-stage timings for each request (see utils/timing.py).
+
+    The stages go into the ``Server-Timing`` header and, with the total,
+    into the histograms served at /metrics. DRF responses are rendered
+    after the view returns; that is timed as the ``serialize`` stage. For
+    streamed responses the header only covers the work before the first
+    byte.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with timing.use(timing.Timings()) as timings:
+            response = self.get_response(request)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        with timing.use(timing.Timings()) as timings:
+            response = await self.get_response(request)
+        return self.finish(request, response, timings)
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+        timings = timing.current()
+        response.add_post_render_callback(
+            lambda r: timing.record("serialize", time.perf_counter() - started, timings))
+        return response
+
+    def finish(self, request, response, timings):
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match else "unmatched"
+        REQUEST_SECONDS.observe(timings.elapsed(), route=route, method=request.method, status=response.status_code)
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = timings.server_timing()
+        return response
+
+
+def accepted_encoding(header):
+    """'br' or 'gzip', whichever the Accept-Encoding header allows first (br only with brotli installed)."""
+    offered = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    for coding in ("br", "gzip") if brotli else ("gzip",):
+        if offered.get(coding, offered.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+class CompressionMiddleware:
+    """Brotli or gzip for JSON and text responses, as the client's Accept-Encoding allows.
+
+    Streamed responses are left alone: compressing NDJSON would hold back
+    events, and the images are compressed already. The bodies carry no
+    secrets, so unlike GZipMiddleware there is no BREACH padding.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if (not settings.RESPONSE_COMPRESSION or response.streaming or response.has_header("Content-Encoding")
+                or not response.get("Content-Type", "").startswith(COMPRESSIBLE)
+                or len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        coding = accepted_encoding(request.headers.get("Accept-Encoding", ""))
+        if coding is None:
+            return response
+
+        with timing.stage("compress"):
+            if coding == "br":
+                body = brotli.compress(response.content, quality=settings.RESPONSE_BROTLI_QUALITY)
+            else:
+                body = compress_string(response.content)
+        if len(body) >= len(response.content):
+            return response
+        response.content = body
+        response["Content-Length"] = str(len(body))
+        response["Content-Encoding"] = coding
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
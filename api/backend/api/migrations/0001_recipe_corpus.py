@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('recipe_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Recipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_id', models.CharField(max_length=32, unique=True)),
+                ('name', models.CharField(max_length=200)),
+                ('products', models.JSONField()),
+                ('recipe', models.TextField()),
+                ('time_min', models.PositiveIntegerField(db_index=True, null=True)),
+                ('difficulty', models.PositiveSmallIntegerField(db_index=True, null=True)),
+                ('energy_kcal', models.FloatField(db_index=True, null=True)),
+                ('proteins_g', models.FloatField(db_index=True, null=True)),
+                ('fats_g', models.FloatField(db_index=True, null=True)),
+                ('carbs_g', models.FloatField(db_index=True, null=True)),
+                ('pivot', models.CharField(db_index=True, max_length=100)),
+                ('ingredient_count', models.PositiveSmallIntegerField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ingredient', models.CharField(max_length=100)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredients', to='api.recipe')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recipe', 'ingredient'], name='recipe_ingredient_by_recipe')],
+                'constraints': [models.UniqueConstraint(fields=('ingredient', 'recipe'), name='recipe_ingredient_unique')],
+            },
+        ),
+    ]
@@ -1,3 +1,54 @@
 from django.db import models
 
-# Create your models here.
+
+class Recipe(models.Model):
+    """A generated recipe kept so later requests can be answered without the LLM (see utils/corpus.py)."""
+
+    # Content address of the dish, also the name of its photo (storage.dish_image_id)
+    image_id = models.CharField(max_length=32, unique=True)
+    name = models.CharField(max_length=200)
+    products = models.JSONField()
+    recipe = models.TextField()
+    time_min = models.PositiveIntegerField(null=True, db_index=True)
+    difficulty = models.PositiveSmallIntegerField(null=True, db_index=True)
+    energy_kcal = models.FloatField(null=True, db_index=True)
+    proteins_g = models.FloatField(null=True, db_index=True)
+    fats_g = models.FloatField(null=True, db_index=True)
+    carbs_g = models.FloatField(null=True, db_index=True)
+    # Rarest ingredient when the recipe was stored; a recipe can only be
+    # covered by a pantry that contains it, so lookups start from here.
+    pivot = models.CharField(max_length=100)
+    ingredient_count = models.PositiveSmallIntegerField()
+    # Times the recipe was generated again or served from the corpus
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # match() reads each pivot's most served recipes first
+        indexes = [models.Index(fields=["pivot", "-hits"], name="recipe_pivot_hits")]
+
+    def __str__(self):
+        return self.name
+
+
+class RecipeIngredient(models.Model):
+    """Inverted index: one row per (normalized ingredient, recipe)."""
+
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name="ingredients")
+    ingredient = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["ingredient", "recipe"], name="recipe_ingredient_unique"),
+        ]
+        indexes = [models.Index(fields=["recipe", "ingredient"], name="recipe_ingredient_by_recipe")]
+
+
+class Ingredient(models.Model):
+    """How many stored recipes use an ingredient; picks each new recipe's pivot."""
+
+    name = models.CharField(max_length=100, unique=True)
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
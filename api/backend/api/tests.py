@@ -1,3 +1,1241 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+
+from . import middleware, renderers
+from .renderers import FastJSONRenderer
+from .utils import corpus, gpt, imagestore, metrics, storage, tokens, variants
+from .utils.cache import RecipeCache, recipe_cache_key
+from .utils.deadline import plan_for
+from .utils.jobs import PhotoQueue, photo_queue
+from .utils.logs import SampleFilter
+from .utils.metrics import Histogram
+from .utils.gpt import get_recipes, recipes_request
+from .utils.parser import JsonRecipeParser, RecipeParser, parse_recipes
+from .utils.prompts import TEXT_INSTRUCTIONS, build_prompt, canonical_preferences
+from .utils.phash import NearDuplicateIndex, dhash, hamming
+from .utils.scheduler import Lane, UpstreamScheduler
+from .utils.singleflight import SingleFlight
+from .utils.tokens import count_tokens
+from .utils.uploads import prepare_upload
+from .views import get_dishes_async, parsed_batches, stream_dishes
+
+RECIPE = """Burger
+Bread (2 slices), Meat (100g)
+Step 1.
+Grill the meat.
+10
+2
+422
+15
+32
+18.5
+Bread (2 slices), Meat (100g)"""
+
+RECIPE_JSON = json.dumps({"r": [{
+    "n": "Burger", "p": ["Bread (2 slices)", "Meat (100g)"], "s": ["Grill the meat."], "t": 10, "d": 2,
+    "e": 422, "pr": 15, "f": 32, "c": 18.5, "x": ["Bread (2 slices)", "Meat (100g)"],
+}]})
+
+# Several steps, separated by blank lines as the text prompt asks for.
+STEPS_RECIPE = """Toast
+Bread (2 slices), Butter (10g)
+Step 1.
+Toast the bread.
+
+Step 2.
+Spread the butter.
+
+Step 3.
+Serve warm.
+5
+1
+250
+6
+11
+30
+Bread (2 slices)"""
+
+STEPS_RECIPE_JSON = json.dumps({"r": [{
+    "n": "Toast", "p": ["Bread (2 slices)", "Butter (10g)"],
+    "s": ["Toast the bread.", "Spread the butter.", "Serve warm."], "t": 5, "d": 1,
+    "e": 250, "pr": 6, "f": 11, "c": 30, "x": ["Bread (2 slices)"],
+}]})
+
+
+class RecipeParserTests(SimpleTestCase):
+    def test_recipes_are_split_across_chunk_boundaries(self):
+        text = RECIPE + "\n----------\n" + RECIPE.replace("Burger", "Toast")
+        parser = RecipeParser()
+        names = []
+        for i in range(0, len(text), 7):
+            names += [r["name"] for r in parser.feed(text[i:i + 7])]
+        self.assertEqual(names, ["Burger"])
+        self.assertEqual([r["name"] for r in parser.close()], ["Toast"])
+
+    def test_chunked_and_whole_text_agree(self):
+        text = RECIPE + "\n----------\nShort\nEggs (2)\n----------\n" + RECIPE
+        chunked = []
+        parser = RecipeParser()
+        for ch in text:
+            chunked += parser.feed(ch)
+        chunked += parser.close()
+        self.assertEqual(chunked, parse_recipes(text))
+        self.assertIsNone(chunked[1]["time_min"])
+        self.assertNotIn("products_exist", chunked[1])
+
+    def test_trailing_separator_parses_the_same_streamed_and_whole(self):
+        for end in ("\n----------\n", "\n----------", "\n----------\n\n", "\n"):
+            text = RECIPE + "\n----------\n" + RECIPE.replace("Burger", "Toast") + end
+            streamed = []
+            parser = RecipeParser()
+            for ch in text:
+                streamed += parser.feed(ch)
+            streamed += parser.close()
+            whole = parse_recipes(text)
+            self.assertEqual(streamed, whole)
+            self.assertEqual(whole[1]["products_exist"], ["Bread (2 slices)", "Meat (100g)"])
+            self.assertEqual(whole[1]["carbs_g"], 18.5)
+
+    def test_numbers_come_from_the_lines_before_the_products_on_the_photo(self):
+        burger = parse_recipes(RECIPE)[0]
+        self.assertEqual((burger["time_min"], burger["difficulty"], burger["carbs_g"]), (10, 2, 18.5))
+        self.assertEqual(burger["recipe"], "Step 1.\nGrill the meat.")
+        self.assertEqual(burger["products_exist"], ["Bread (2 slices)", "Meat (100g)"])
+
+        without_photo = parse_recipes(RECIPE.rsplit("\n", 1)[0])[0]
+        self.assertEqual((without_photo["time_min"], without_photo["carbs_g"]), (10, 18.5))
+        self.assertEqual(without_photo["products_exist"], [])
+
+    def test_products_on_the_photo_are_not_read_as_a_number(self):
+        # Regression: the numbers were taken from the last six lines, so with
+        # the products-on-photo line every field shifted by one.
+        block = "Omelette\nEggs (2), Milk (50ml)\nStep 1.\nWhisk 2 eggs.\n7\n1\n300\n20\n22\n3.5\nEggs (2)"
+        fields = ("time_min", "difficulty", "energy_kcal", "proteins_g", "fats_g", "carbs_g")
+        for text, exist in ((block, ["Eggs (2)"]), (block.rsplit("\n", 1)[0], [])):
+            omelette = parse_recipes(text)[0]
+            self.assertEqual(tuple(omelette[f] for f in fields), (7, 1, 300.0, 20.0, 22.0, 3.5))
+            self.assertEqual(omelette["recipe"], "Step 1.\nWhisk 2 eggs.")
+            self.assertEqual(omelette["products_exist"], exist)
+
+    def test_structured_output_maps_to_the_same_dict(self):
+        burger = parse_recipes(RECIPE_JSON, "json")[0]
+        self.assertEqual(burger, parse_recipes(RECIPE)[0])
+
+    def test_both_formats_join_several_steps_the_same_way(self):
+        toast = parse_recipes(STEPS_RECIPE_JSON, "json")[0]
+        self.assertEqual(toast, parse_recipes(STEPS_RECIPE)[0])
+        self.assertEqual(toast["recipe"], "Step 1.\nToast the bread.\nStep 2.\nSpread the butter.\nStep 3.\nServe warm.")
+
+    def test_structured_output_streams_dish_by_dish(self):
+        toast = json.loads(RECIPE_JSON)["r"][0] | {"n": 'Toast "}]{', "s": ["Toast \\ butter.", "Serve."]}
+        text = json.dumps({"r": [json.loads(RECIPE_JSON)["r"][0], toast]})
+        parser = JsonRecipeParser()
+        batches = [[r["name"] for r in parser.feed(ch)] for ch in text]
+        self.assertEqual([names for names in batches if names], [["Burger"], ['Toast "}]{']])
+        self.assertEqual(parse_recipes(text, "json")[1]["recipe"], "Step 1.\nToast \\ butter.\nStep 2.\nServe.")
+        self.assertEqual(parse_recipes(text[:-20], "json")[0]["name"], "Burger")
+
+
+@override_settings(IMAGE_EAGER_VARIANTS=[], IMAGE_STORE_SWEEP_EVERY=0, CORPUS_ENABLED=False)
+class ImageDirTestCase(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(storage, "IMAGES_DIR", tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Photos queued by a test (previews, late full renders) finish before its dir goes.
+        self.addCleanup(lambda: photo_queue()._queue.join())
+
+
+def fake_photo(name, products, recipe, download_path, timeout=None, quality="medium"):
+    if name == "Broken":
+        raise RuntimeError("upstream error")
+    storage.write_atomic(download_path, quality.encode())
+    return download_path
+
+
+class StreamDishesTests(ImageDirTestCase):
+    def test_each_image_event_follows_its_dish(self):
+        text = RECIPE + "\n----------\n" + RECIPE.replace("Burger", "Toast")
+        with mock.patch("api.views.get_photo", fake_photo):
+            events = [json.loads(line) for line in stream_dishes(parsed_batches(iter([text])))]
+
+        dish_ids = [e["dish"]["image_id"] for e in events if e["type"] == "dish"]
+        ready_ids = [e["image_id"] for e in events if e["type"] == "image_ready"]
+        self.assertEqual(len(dish_ids), 2)
+        self.assertCountEqual(ready_ids, dish_ids)
+        for image_id in ready_ids:
+            dish_at = next(i for i, e in enumerate(events) if e.get("dish", {}).get("image_id") == image_id)
+            ready_at = next(i for i, e in enumerate(events) if e.get("image_id") == image_id)
+            self.assertLess(dish_at, ready_at)
+        self.assertEqual(events[-1]["type"], "done")
+
+
+class PhotoQueueTests(ImageDirTestCase):
+    def test_first_success_settles_once_when_both_finish_together(self):
+        from concurrent.futures import Future
+        from .utils.jobs import first_success
+
+        class SlowCheck(Future):
+            # Widens the gap between checking and resolving the result.
+            def done(self):
+                finished = super().done()
+                time.sleep(0.05)
+                return finished
+
+        preview, full = Future(), Future()
+        out = first_success(SlowCheck(), [preview, full])
+        threads = [threading.Thread(target=f.set_result, args=(v,)) for f, v in ((preview, "p"), (full, "f"))]
+        with self.assertNoLogs("concurrent.futures", "ERROR"):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertIn(out.result(), ("p", "f"))
+
+    def test_failing_job_does_not_stop_the_queue(self):
+        q = PhotoQueue(workers=1, max_depth=4, job_timeout=1)
+        bad = q.submit("bad", fake_photo, "Broken", [], "")
+        good = q.submit("good", fake_photo, "Burger", [], "")
+
+        with self.assertRaises(RuntimeError):
+            bad.result(timeout=5)
+        self.assertEqual(good.result(timeout=5), storage.image_path("good"))
+        self.assertEqual(storage.image_state("bad"), storage.FAILED)
+        self.assertEqual(storage.image_state("good"), storage.READY)
+
+    def test_same_dish_is_generated_once(self):
+        q = PhotoQueue(workers=0, max_depth=4, job_timeout=1)
+        image_id = storage.dish_image_id("Burger ", ["Meat (100g)", "Bread (2 slices)"])
+        self.assertEqual(image_id, storage.dish_image_id("burger", ["bread (2 slices)", "meat (100g)"]))
+
+        first = q.submit(image_id, fake_photo, "Burger", [], "")
+        second = q.submit(image_id, fake_photo, "Burger", [], "")
+        self.assertIs(first, second)
+        self.assertEqual(q.depth(), 1)
+
+    def test_existing_image_is_reused(self):
+        q = PhotoQueue(workers=0, max_depth=4, job_timeout=1)
+        fake_photo("Burger", [], "", download_path=storage.image_path("done"))
+        photo = mock.Mock()
+        fut = q.submit("done", photo)
+        self.assertEqual(fut.result(timeout=0), storage.image_path("done"))
+        photo.assert_not_called()
+        self.assertEqual(q.depth(), 0)
+
+    def test_full_queue_fails_the_job_instead_of_blocking(self):
+        q = PhotoQueue(workers=0, max_depth=1, job_timeout=1)
+        q.submit("a", fake_photo, "Burger", [], "")
+        overflow = q.submit("b", fake_photo, "Burger", [], "")
+        self.assertIsNotNone(overflow.exception(timeout=0))
+        self.assertEqual(storage.image_state("b"), storage.FAILED)
+
+    def test_preview_is_rendered_first_and_replaced_by_the_full_image(self):
+        q = PhotoQueue(workers=0, max_depth=4, job_timeout=1)
+        first, full = q.submit_progressive("p", fake_photo, "Burger", [], "", quality="medium")
+        self.assertIsNot(first, full)
+        self.assertEqual(q.depth(), 2)
+
+        # A single worker drains the queue in priority order: preview, then full.
+        q.workers, q._pid = 1, None
+        q._ensure_started()
+        self.assertEqual(first.result(timeout=5), storage.image_path("p", storage.PREVIEW))
+        self.assertEqual(full.result(timeout=5), storage.image_path("p"))
+        self.assertFalse(os.path.exists(storage.image_path("p", storage.PREVIEW)))
+        self.assertEqual(storage.best_tier("p"), storage.FULL)
+
+    def test_failed_preview_falls_through_to_the_full_image(self):
+        q = PhotoQueue(workers=1, max_depth=4, job_timeout=1)
+        def photo(*args, quality="medium", **kwargs):
+            if quality == "low":
+                raise RuntimeError("preview failed")
+            return fake_photo(*args, quality=quality, **kwargs)
+
+        first, full = q.submit_progressive("f", photo, "Burger", [], "", quality="medium")
+        self.assertEqual(first.result(timeout=5), storage.image_path("f"))
+        self.assertEqual(storage.image_state("f"), storage.READY)
+
+    def test_budget_render_is_only_a_preview_of_the_full_image(self):
+        q = PhotoQueue(workers=0, max_depth=4, job_timeout=1)
+        first, full = q.submit_progressive("c", fake_photo, "Burger", [], "", quality="low")
+        self.assertIsNot(first, full)
+        q.workers, q._pid = 1, None
+        q._ensure_started()
+        self.assertEqual(first.result(timeout=5), storage.image_path("c", storage.PREVIEW))
+        self.assertEqual(full.result(timeout=5), storage.image_path("c"))
+
+        # A later request without a deadline finds the full render, made at full quality.
+        first, full = q.submit_progressive("c", fake_photo, "Burger", [], "", quality="medium")
+        self.assertIs(first, full)
+        with open(full.result(timeout=0), "rb") as f:
+            self.assertEqual(f.read(), b"medium")
+
+
+class ServeImageTests(ImageDirTestCase):
+    def test_image_left_in_the_flat_layout_is_served_and_moved_to_its_shard(self):
+        os.makedirs(storage.IMAGES_DIR, exist_ok=True)
+        storage.write_atomic(storage.legacy_path("old"), b"png")
+        response = self.client.get("/api/images/old.png/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"png")
+        self.assertTrue(os.path.exists(storage.image_path("old")))
+        self.assertFalse(os.path.exists(storage.legacy_path("old")))
+        self.assertEqual(self.client.get("/api/images/missing.png/").status_code, 404)
+        self.assertFalse(os.path.exists(storage.shard_dir("missing")))
+
+    def test_status_follows_generation_state(self):
+        self.assertEqual(self.client.get("/api/images/x.png/").status_code, 404)
+
+        storage.set_state("x", storage.PENDING)
+        response = self.client.get("/api/images/x.png/")
+        self.assertEqual(response.status_code, 202)
+        self.assertIn("Retry-After", response)
+
+        storage.set_state("x", storage.FAILED)
+        self.assertEqual(self.client.get("/api/images/x.png/").status_code, 502)
+
+        fake_photo("Burger", [], "", download_path=storage.image_path("x"))
+        storage.set_state("x", storage.READY)
+        response = self.client.get("/api/images/x.png/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"medium")
+
+    def test_preview_is_served_until_the_full_image_exists(self):
+        storage.set_state("y", storage.PENDING)
+        fake_photo("Burger", [], "", download_path=storage.image_path("y", storage.PREVIEW), quality="low")
+
+        response = self.client.get("/api/images/y.png/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Image-Tier"], storage.PREVIEW)
+        self.assertEqual(b"".join(response.streaming_content), b"low")
+        self.assertEqual(self.client.get("/api/images/y.png/?tier=full").status_code, 202)
+        self.assertEqual(self.client.get("/api/images/y.png/?tier=huge").status_code, 400)
+
+        fake_photo("Burger", [], "", download_path=storage.image_path("y"))
+        storage.set_state("y", storage.READY)
+        response = self.client.get("/api/images/y.png/?tier=full")
+        self.assertEqual(response["X-Image-Tier"], storage.FULL)
+
+    def test_validators_and_conditional_requests(self):
+        fake_photo("Burger", [], "", download_path=storage.image_path("z"))
+        response = self.client.get("/api/images/z.png/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        etag = response["ETag"]
+
+        self.assertEqual(self.client.get("/api/images/z.png/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        since = response["Last-Modified"]
+        self.assertEqual(self.client.get("/api/images/z.png/", HTTP_IF_MODIFIED_SINCE=since).status_code, 304)
+
+        # Replacing the bytes changes the tag.
+        fake_photo("Burger", [], "", download_path=storage.image_path("z"), quality="high")
+        self.assertEqual(self.client.get("/api/images/z.png/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_byte_ranges(self):
+        fake_photo("Burger", [], "", download_path=storage.image_path("r"))
+        response = self.client.get("/api/images/r.png/", HTTP_RANGE="bytes=1-3")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 1-3/6")
+        self.assertEqual(b"".join(response.streaming_content), b"edi")
+
+        response = self.client.get("/api/images/r.png/", HTTP_RANGE="bytes=-2")
+        self.assertEqual(b"".join(response.streaming_content), b"um")
+        self.assertEqual(self.client.get("/api/images/r.png/", HTTP_RANGE="bytes=9-").status_code, 416)
+        response = self.client.get("/api/images/r.png/", HTTP_RANGE="bytes=1-3", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    @skipUnless(variants.Image, "Pillow is not installed")
+    def test_resized_webp_variant_is_encoded_and_cached(self):
+        buf = io.BytesIO()
+        variants.Image.new("RGB", (1024, 1024), "orange").save(buf, format="PNG")
+        storage.write_atomic(storage.image_path("v"), buf.getvalue())
+        response = self.client.get("/api/images/v.png/?w=200&fmt=webp")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        with variants.Image.open(io.BytesIO(b"".join(response.streaming_content))) as im:
+            self.assertEqual(im.size, (256, 256))
+        self.assertTrue(os.path.exists(storage.variant_path("v", storage.FULL, 256, "webp")))
+
+        response = self.client.get("/api/images/v.png/", HTTP_ACCEPT="image/webp,*/*")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("Accept", response["Vary"])
+        self.assertEqual(self.client.get("/api/images/v.png/")["Content-Type"], "image/png")
+        self.assertEqual(self.client.get("/api/images/v.png/?w=big").status_code, 400)
+
+    @override_settings(IMAGE_SENDFILE="nginx", IMAGE_ACCEL_PREFIX="/protected-images/")
+    def test_nginx_offload_sends_no_body(self):
+        fake_photo("Burger", [], "", download_path=storage.image_path("n"))
+        response = self.client.get("/api/images/n.png/")
+        relative = os.path.relpath(storage.image_path("n"), storage.IMAGES_DIR)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-images/" + relative)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response.content, b"")
+
+
+class ImageStoreTests(ImageDirTestCase):
+    def write(self, image_id, size, used, tier=storage.FULL):
+        path = storage.image_path(image_id, tier)
+        storage.write_atomic(path, b"x" * size)
+        os.utime(path, (used, used))
+        return path
+
+    def test_images_are_sharded_two_levels_deep(self):
+        path = storage.image_path("abc")
+        self.assertEqual(os.path.dirname(os.path.dirname(os.path.dirname(path))), storage.IMAGES_DIR)
+        self.assertEqual(os.path.dirname(storage.marker_path("abc", storage.PENDING)), os.path.dirname(path))
+
+    def test_least_recently_used_images_are_evicted_first(self):
+        now = time.time()
+        old = self.write("old", 400, now - 300)
+        self.write("old", 100, now - 300, storage.PREVIEW)
+        self.write("mid", 400, now - 200)
+        new = self.write("new", 400, now - 100)
+        # Serving "old" makes it the most recently used.
+        storage.touch(old, os.stat(old), interval=0)
+
+        groups, _ = imagestore.scan()
+        result = imagestore.evict(groups, max_bytes=1000, max_files=0, low_water=0.9)
+        self.assertEqual(result["evicted_images"], 1)
+        self.assertFalse(os.path.exists(storage.image_path("mid")))
+        self.assertTrue(os.path.exists(old) and os.path.exists(new))
+
+    def test_pending_images_are_not_evicted(self):
+        storage.set_state("busy", storage.PENDING)
+        groups, _ = imagestore.scan()
+        self.assertEqual(imagestore.evict(groups, max_bytes=0, max_files=1, low_water=0)["evicted_images"], 0)
+
+    def test_compaction_migrates_flat_files_and_drops_orphans(self):
+        os.makedirs(storage.IMAGES_DIR, exist_ok=True)
+        with open(os.path.join(storage.IMAGES_DIR, "flat.png"), "wb") as f:
+            f.write(b"png")
+        self.write("done", 10, time.time())
+        self.write("done", 5, time.time(), storage.PREVIEW)
+        storage.write_atomic(storage.variant_path("gone", storage.FULL, 256, "webp"), b"webp")
+
+        out = io.StringIO()
+        call_command("imagestore", "--compact", stdout=out)
+        self.assertIn("migrated 1 flat files, removed 2 files", out.getvalue())
+        self.assertTrue(os.path.exists(storage.image_path("flat")))
+        self.assertFalse(os.path.exists(storage.image_path("done", storage.PREVIEW)))
+        self.assertFalse(os.path.exists(os.path.dirname(storage.variant_path("gone", storage.FULL, 256, "webp"))))
+
+
+@skipUnless(variants.Image, "Pillow is not installed")
+class UploadPreprocessTests(SimpleTestCase):
+    def test_large_photo_is_rotated_and_downscaled(self):
+        im = variants.Image.effect_noise((2400, 1800), 64).convert("RGB")
+        exif = im.getexif()
+        exif[0x0112] = 6  # rotate 90 degrees clockwise for display
+        upload = io.BytesIO()
+        im.save(upload, format="JPEG", quality=95, exif=exif)
+        size_in = upload.tell()
+
+        with override_settings(UPLOAD_MAX_EDGE=1000, UPLOAD_FORMAT="jpeg"):
+            data, mime = prepare_upload(upload)
+        self.assertEqual(mime, "image/jpeg")
+        self.assertLess(len(data), size_in)
+        self.assertEqual(upload.tell(), 0)
+        with variants.Image.open(io.BytesIO(data)) as out:
+            self.assertEqual(out.size, (750, 1000))
+
+    def test_small_or_unreadable_uploads_are_sent_as_is(self):
+        with open(os.path.join(settings.BASE_DIR.parent, "test.jpg"), "rb") as f:
+            original = f.read()
+        data, _ = prepare_upload(io.BytesIO(original))
+        self.assertLessEqual(len(data), len(original))
+
+        self.assertEqual(prepare_upload(io.BytesIO(b"not an image")), (b"not an image", "image/png"))
+
+
+class RecipeCacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "recipes.sqlite3")
+
+    def test_key_ignores_order_and_case(self):
+        a = recipe_cache_key(None, '{"diets": ["Vegan", "keto"]}', '["Eggs", "milk"]', "m")
+        b = recipe_cache_key(None, {"diets": ["keto", "vegan"]}, ["MILK", " eggs"], "m")
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, recipe_cache_key(None, {"diets": ["keto"]}, ["milk", "eggs"], "m"))
+        self.assertNotEqual(a, recipe_cache_key(None, {"diets": ["keto", "vegan"]}, ["milk", "eggs"], "other"))
+
+    def test_disk_tier_is_shared_and_bounded(self):
+        writer = RecipeCache(self.path, ttl=60, max_entries=2, memory_entries=1)
+        for key in ("a", "b", "c"):
+            writer.set(key, key.upper())
+
+        reader = RecipeCache(self.path, ttl=60, max_entries=2, memory_entries=1)
+        self.assertIsNone(reader.get("a"))
+        self.assertEqual(reader.get("c"), "C")
+        self.assertEqual(reader.get("c"), "C")
+        self.assertEqual(reader.stats()["disk_hits"], 1)
+        self.assertEqual(reader.stats()["memory_hits"], 1)
+        self.assertEqual(reader.stats()["misses"], 1)
+
+    def test_expired_entries_are_misses(self):
+        cache = RecipeCache(self.path, ttl=60, max_entries=10, memory_entries=10)
+        cache.set("a", "A")
+        with mock.patch("api.utils.cache.time.time", return_value=cache._memory["a"][1] + 61):
+            self.assertIsNone(cache.get("a"))
+
+
+def photo(seed, brightness=1.0, quality=90):
+    im = variants.Image.effect_mandelbrot((640, 480), (-2, -1.2 + seed, 1, 1.2 + seed), 100).convert("RGB")
+    im = im.point(lambda p: min(255, int(p * brightness)))
+    buf = io.BytesIO()
+    im.save(buf, format="JPEG", quality=quality)
+    buf.seek(0)
+    return buf
+
+
+@skipUnless(variants.Image, "Pillow is not installed")
+class NearDuplicateTests(SimpleTestCase):
+    def test_retakes_hash_close_and_other_photos_do_not(self):
+        first = dhash(photo(0))
+        self.assertLessEqual(hamming(first, dhash(photo(0, brightness=1.08, quality=70))), 4)
+        self.assertGreater(hamming(first, dhash(photo(1))), 12)
+
+    def test_index_matches_within_distance_only(self):
+        index = NearDuplicateIndex(max_distance=4, max_entries=3, ttl=60)
+        base = 0x0123456789ABCDEF
+        index.add(base, "ctx", "key")
+        self.assertEqual(index.find(base ^ 0b10101, "ctx"), "key")
+        self.assertIsNone(index.find(base ^ 0b1110111, "ctx"))
+        self.assertIsNone(index.find(base, "other ctx"))
+
+        for i in range(3):
+            index.add(i << 40, "ctx", i)
+        self.assertIsNone(index.find(base, "ctx"))
+        stats = index.stats()
+        self.assertEqual((stats["entries"], stats["evictions"], stats["hits"]), (3, 1, 1))
+
+    def test_retaken_photo_reuses_earlier_recipes(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache = RecipeCache(os.path.join(tmp.name, "r.sqlite3"), ttl=60, max_entries=10, memory_entries=10)
+        index = NearDuplicateIndex(max_distance=5, max_entries=10, ttl=60)
+        upstream = mock.Mock()
+        upstream.call.return_value = mock.Mock(output_text=RECIPE, usage=None)
+
+        with mock.patch("api.utils.gpt.recipe_cache", return_value=cache), \
+                mock.patch("api.utils.gpt.near_duplicates", return_value=index), \
+                mock.patch("api.utils.gpt.scheduler", return_value=upstream), \
+                mock.patch("api.utils.gpt.client"), \
+                mock.patch("api.utils.gpt.recipes_input", return_value=[]):
+            self.assertEqual(get_recipes(photo(0), "None", '["Eggs"]'), RECIPE)
+            self.assertEqual(get_recipes(photo(0, brightness=1.08, quality=70), "None", '["Eggs"]'), RECIPE)
+            get_recipes(photo(0), "Vegan", '["Eggs"]')
+
+        self.assertEqual(upstream.call.call_count, 2)
+        self.assertEqual(index.stats()["hits"], 1)
+
+
+def dish(name, products, time_min=20, difficulty=2, carbs_g=30.0):
+    return {"name": name, "products": products, "recipe": "Cook it.", "time_min": time_min,
+            "difficulty": difficulty, "energy_kcal": 400.0, "proteins_g": 20.0, "fats_g": 10.0,
+            "carbs_g": carbs_g, "products_exist": products}
+
+
+class CorpusTests(TestCase):
+    def setUp(self):
+        corpus.ingest([
+            dish("Omelette", ["Eggs (2)", "Milk (50ml)", "Salt"], time_min=10),
+            dish("Pancakes", ["Eggs", "Milk", "Flour (200g)"], time_min=30),
+            dish("Steak", ["Beef steak (250g)", "Butter", "Olive oil"], time_min=25, difficulty=3, carbs_g=0.0),
+            dish("Boiled eggs", ["Egg", "Water"], time_min=10, difficulty=1, carbs_g=1.0),
+            {"name": "Half", "products": ["Eggs"], "recipe": "", "time_min": None},
+        ])
+
+    def names(self, products, preferences="None", limit=10):
+        return [d["name"] for d in corpus.match(products, preferences, limit)]
+
+    def test_ingredients_are_normalized(self):
+        self.assertEqual(corpus.normalize_ingredient("Tomatoes (3 pieces)"), "tomato")
+        self.assertEqual(corpus.normalize_ingredient("Cherries"), "cherry")
+        self.assertEqual(corpus.ingredient_set(["Eggs", "egg", "Sea salt", "Olive oil"]), {"egg"})
+
+    def test_only_recipes_covered_by_the_pantry_match(self):
+        self.assertCountEqual(self.names('["eggs", "milk"]'), ["Omelette", "Boiled eggs"])
+        self.assertCountEqual(self.names('["eggs", "milk", "flour"]'), ["Omelette", "Pancakes", "Boiled eggs"])
+        self.assertEqual(self.names('["flour"]'), [])
+
+    def test_incomplete_and_repeated_recipes_are_not_stored_twice(self):
+        self.assertEqual(corpus.ingest([dish("Omelette", ["Eggs (2)", "Milk (50ml)", "Salt"])]), 0)
+        self.assertEqual(self.names('["eggs"]'), ["Boiled eggs"])
+
+    def test_diets_drop_forbidden_products(self):
+        pantry = '["eggs", "milk", "flour", "beef steak", "butter"]'
+        self.assertNotIn("Steak", self.names(pantry, '{"diets": ["vegetarian"]}'))
+        self.assertEqual(self.names(pantry, '{"diets": ["vegan"]}'), [])
+        self.assertCountEqual(self.names(pantry, '{"diets": ["keto"]}'), ["Steak", "Boiled eggs"])
+
+    @override_settings(CORPUS_MIN_MATCHES=1)
+    def test_preferences_the_corpus_cannot_enforce_go_to_the_model(self):
+        pantry = '["eggs", "milk", "beef steak", "butter"]'
+        self.assertIsNotNone(corpus.lookup(pantry, "None", None))
+        self.assertIsNotNone(corpus.lookup(pantry, '{"diets": ["None"], "time": []}', None))
+        for prefs in ("I am vegan", '{"diets": ["pescatarian"]}', '["vegan"]'):
+            self.assertIsNone(corpus.lookup(pantry, prefs, None))
+            self.assertEqual(self.names(pantry, prefs), [])
+
+    def test_preferred_time_ranks_first(self):
+        prefs = '{"time": ["30-60 minutes"]}'
+        self.assertEqual(self.names('["eggs", "milk", "flour"]', prefs)[0], "Pancakes")
+
+    @override_settings(CORPUS_MIN_MATCHES=3)
+    def test_products_only_requests_are_served_from_the_corpus(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with mock.patch("api.views.get_recipes") as get_recipes, mock.patch("api.views.get_photo", fake_photo), \
+                mock.patch.object(storage, "IMAGES_DIR", tmp.name), \
+                override_settings(IMAGE_EAGER_VARIANTS=[], IMAGE_STORE_SWEEP_EVERY=0):
+            body = self.client.post("/api/get-dishes/", {"products": '["eggs", "milk", "flour"]'}).json()
+            get_recipes.assert_not_called()
+            self.assertEqual(body["source"], "corpus")
+            self.assertEqual(len(body["dishes"]), 3)
+
+            get_recipes.return_value = RECIPE
+            body = self.client.post("/api/get-dishes/", {"products": '["bread", "meat"]'}).json()
+            self.assertEqual(body["source"], "model")
+        self.assertEqual(self.names('["bread", "meat"]'), ["Burger"])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = override_settings(SINGLEFLIGHT_LOCK_DIR=tmp.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def run_concurrently(self, flight, fn, n=5):
+        results = [None] * n
+        def worker(i):
+            try:
+                results[i] = flight.do("key", fn)
+            except Exception as exc:
+                results[i] = exc
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        return results
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight("test")
+        release = threading.Event()
+        calls = []
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return "text"
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results = self.run_concurrently(flight, slow)
+        self.assertEqual(results, ["text"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()["avoided"], 4)
+
+    def test_errors_reach_every_waiter(self):
+        flight = SingleFlight("test")
+        release = threading.Event()
+        def failing():
+            release.wait(5)
+            raise ValueError("boom")
+        threading.Timer(0.2, release.set).start()
+        results = self.run_concurrently(flight, failing, n=3)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    def test_waiting_on_another_process_lease_rechecks_first(self):
+        other_process, this_process = SingleFlight("test"), SingleFlight("test")
+        store = {}
+        with other_process.lease("key"):
+            t = threading.Thread(target=lambda: store.setdefault(
+                "result", this_process.do("key", lambda: "upstream", recheck=lambda: store.get("shared"))))
+            t.start()
+            t.join(0.3)
+            store["shared"] = "from other worker"
+        t.join(5)
+        self.assertEqual(store["result"], "from other worker")
+        self.assertEqual(this_process.stats()["cross_process"], 1)
+
+    def test_stream_follower_of_a_stuck_leader_calls_upstream_itself(self):
+        events = [mock.Mock(type="response.output_text.delta", delta=RECIPE)]
+        stream = mock.MagicMock()
+        stream.__iter__.return_value = iter(events)
+        upstream = mock.Mock()
+        upstream.call.return_value = stream
+        flight = SingleFlight("test")
+        flight.join("key")  # a leader that never settles
+
+        with mock.patch("api.utils.gpt.recipes_flight", flight), \
+                mock.patch("api.utils.gpt.lookup_recipes", return_value=("key", None, None)), \
+                mock.patch("api.utils.gpt.scheduler", return_value=upstream), mock.patch("api.utils.gpt.client"):
+            started = time.monotonic()
+            text = "".join(gpt.stream_recipes(None, "None", '["Bread"]', timeout=0.1))
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(text, RECIPE)
+        self.assertEqual(upstream.call.call_count, 1)
+
+
+async def afake_photo(name, products, recipe, download_path, timeout=None, quality="medium"):
+    return fake_photo(name, products, recipe, download_path, quality=quality)
+
+
+class AsyncGetDishesTests(ImageDirTestCase):
+    async def test_returns_dishes_and_generates_photos_on_the_loop(self):
+        request = AsyncRequestFactory().post("/api/get-dishes/", {"products": '["Bread", "Meat"]'})
+        with mock.patch("api.views.aget_recipes", mock.AsyncMock(return_value=RECIPE)), \
+                mock.patch("api.views.aget_photo", afake_photo):
+            response = await get_dishes_async(request)
+            body = json.loads(response.content)
+            image_id = body["dishes"][0]["image_id"]
+            self.assertEqual(storage.image_state(image_id), storage.PENDING)
+            await asyncio.sleep(0.05)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body["dishes"][0]["name"], "Burger")
+        self.assertEqual(storage.image_state(image_id), storage.READY)
+
+    async def test_missing_inputs_are_rejected(self):
+        response = await get_dishes_async(AsyncRequestFactory().post("/api/get-dishes/", {}))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_stream_sends_the_first_dish_before_the_model_finishes(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def chunks(*args, **kwargs):
+            yield RECIPE + "\n----------\n"
+            release.wait(5)
+            yield RECIPE.replace("Burger", "Toast")
+
+        request = AsyncRequestFactory().post("/api/get-dishes/", {"products": '["Bread", "Meat"]', "stream": "1"})
+        with mock.patch("api.views.stream_recipes", chunks), mock.patch("api.views.get_photo", fake_photo):
+            response = await get_dishes_async(request)
+            self.assertTrue(response.is_async)
+            content = aiter(response.streaming_content)
+            first = json.loads(await asyncio.wait_for(anext(content), 2))
+            self.assertFalse(release.is_set())
+            release.set()
+            events = [first] + [json.loads(line) async for line in content]
+
+        self.assertEqual(first["dish"]["name"], "Burger")
+        self.assertEqual([e["dish"]["name"] for e in events if e["type"] == "dish"], ["Burger", "Toast"])
+        self.assertEqual(events[-1]["type"], "done")
+
+    async def test_batch_stream_sends_each_item_as_it_finishes(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def get_recipes(img, preferences, products, **kwargs):
+            if "Eggs" in products:
+                release.wait(5)
+            return RECIPE
+
+        items = [{"id": "slow", "products": ["Eggs"]}, {"id": "fast", "products": ["Bread"]}]
+        with mock.patch("api.views.get_recipes", get_recipes), mock.patch("api.views.get_photo", fake_photo):
+            response = await self.async_client.post("/api/get-dishes/batch/", {"items": items},
+                                                    content_type="application/json")
+            content = aiter(response.streaming_content)
+            first = json.loads(await asyncio.wait_for(anext(content), 2))
+            self.assertFalse(release.is_set())
+            release.set()
+            events = [first] + [json.loads(line) async for line in content]
+
+        self.assertEqual((first["type"], first["id"]), ("dishes", "fast"))
+        self.assertEqual(events[-1]["type"], "done")
+
+
+class FlakyImagesHandler(BaseHTTPRequestHandler):
+    """Answers 429 to the first request and a tiny image to the rest."""
+    hits = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        type(self).hits += 1
+        if type(self).hits == 1:
+            body, code = b'{"error": {"message": "slow down"}}', 429
+        else:
+            body, code = b'{"created": 0, "data": [{"b64_json": "cG5n"}]}', 200
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class UpstreamSchedulerTests(SimpleTestCase):
+    def make_scheduler(self, hedge=False):
+        return UpstreamScheduler(
+            lanes=[Lane("image", per_minute=6000, burst=5, hedge=hedge)],
+            max_concurrency=2, max_retries=3, backoff_base=0.01, backoff_max=0.05, hedge_min_samples=3,
+        )
+
+    def test_429_from_a_local_server_is_retried(self):
+        from openai import OpenAI
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyImagesHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        client = OpenAI(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+
+        sched = self.make_scheduler()
+        response = sched.call("image", client.images.generate, model="gpt-image-1", prompt="dish")
+        self.assertEqual(response.data[0].b64_json, "cG5n")
+        self.assertEqual(FlakyImagesHandler.hits, 2)
+        self.assertEqual(sched.stats()["image"]["retries"], 1)
+
+    def test_non_retryable_errors_are_raised(self):
+        sched = self.make_scheduler()
+        with self.assertRaises(ValueError):
+            sched.call("image", mock.Mock(side_effect=ValueError("bad prompt")))
+        self.assertEqual(sched.stats()["image"]["errors"], 1)
+
+    def test_deadline_clamps_attempt_timeouts_and_stops_retries(self):
+        import httpx
+        from openai import RateLimitError
+
+        response = httpx.Response(429, headers={"retry-after": "20"},
+                                  request=httpx.Request("POST", "https://api.openai.com/v1/images"))
+        fn = mock.Mock(side_effect=RateLimitError("slow down", response=response, body=None))
+        sched = self.make_scheduler()
+        sched.backoff_max = 30
+        started = time.monotonic()
+        with self.assertRaises(RateLimitError):
+            sched.call("image", fn, timeout=60, deadline=started + 0.5)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(fn.call_count, 1)
+        self.assertLessEqual(fn.call_args.kwargs["timeout"], 0.5)
+
+        with self.assertRaises(TimeoutError):
+            sched.call("image", fn, deadline=time.monotonic())
+        self.assertEqual(fn.call_count, 1)
+
+    def test_slow_call_is_hedged(self):
+        sched = self.make_scheduler(hedge=True)
+        for _ in range(3):
+            sched.call("image", lambda: None)
+        calls = []
+        def sometimes_slow():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(1)
+                return "slow"
+            return "fast"
+        self.assertEqual(sched.call("image", sometimes_slow), "fast")
+        self.assertEqual(sched.stats()["image"]["hedge_wins"], 1)
+
+
+class DeadlineTests(ImageDirTestCase):
+    def post(self, **data):
+        return self.client.post("/api/get-dishes/", {"products": '["Bread", "Meat"]', **data})
+
+    def test_short_budgets_get_smaller_plans(self):
+        self.assertEqual(plan_for(None)["dishes"], None)
+        self.assertEqual(plan_for(40000), {"dishes": 3, "quality": "low", "images": True})
+        self.assertFalse(plan_for(5000)["images"])
+
+    def test_tiny_budget_skips_images_and_asks_for_fewer_dishes(self):
+        get_recipes = mock.Mock(return_value=RECIPE + "\n----------\n" + RECIPE.replace("Burger", "A") +
+                                "\n----------\n" + RECIPE.replace("Burger", "B"))
+        with mock.patch("api.views.get_recipes", get_recipes), mock.patch("api.views.get_photo") as photo:
+            body = self.post(deadline_ms="5000").json()
+
+        self.assertEqual(get_recipes.call_args.kwargs["dishes"], 2)
+        self.assertEqual([d["image_status"] for d in body["dishes"]], ["skipped", "skipped"])
+        photo.assert_not_called()
+
+    def test_slow_photo_is_reported_pending_and_finishes_later(self):
+        release = threading.Event()
+        def slow_photo(*args, **kwargs):
+            release.wait(5)
+            return fake_photo(*args, **kwargs)
+
+        plan = {"dishes": None, "quality": "low", "images": True}
+        with mock.patch("api.views.get_recipes", return_value=RECIPE), \
+                mock.patch("api.views.get_photo", slow_photo), mock.patch("api.views.plan_for", return_value=plan):
+            started = time.monotonic()
+            body = self.post(deadline_ms="600").json()
+            self.assertLess(time.monotonic() - started, 2)
+
+        dish = body["dishes"][0]
+        self.assertEqual(dish["image_status"], "pending")
+        release.set()
+        for _ in range(50):
+            if storage.image_state(dish["image_id"]) == storage.READY:
+                break
+            time.sleep(0.02)
+        self.assertEqual(storage.image_state(dish["image_id"]), storage.READY)
+
+    def test_stream_passes_the_budget_upstream_and_reports_late_photos_pending(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        def slow_photo(*args, **kwargs):
+            release.wait(5)
+            return fake_photo(*args, **kwargs)
+
+        stream = mock.Mock(return_value=iter([RECIPE]))
+        plan = {"dishes": None, "quality": "low", "images": True}
+        with mock.patch("api.views.stream_recipes", stream), mock.patch("api.views.get_photo", slow_photo), \
+                mock.patch("api.views.plan_for", return_value=plan):
+            started = time.monotonic()
+            response = self.post(deadline_ms="600", stream="1")
+            events = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+            self.assertLess(time.monotonic() - started, 2)
+        release.set()
+
+        self.assertLessEqual(stream.call_args.kwargs["timeout"], 0.6)
+        self.assertEqual([e["type"] for e in events], ["dish", "image_pending", "done"])
+
+    def test_budget_spent_before_the_call_is_a_504_without_going_upstream(self):
+        get_recipes = mock.Mock(return_value=RECIPE)
+        with mock.patch("api.views.get_recipes", get_recipes), mock.patch("api.views.stream_recipes") as stream:
+            for data in ({}, {"stream": "1"}):
+                response = self.post(deadline_ms="100", **data)
+                self.assertEqual(response.status_code, 504)
+                self.assertIn("Deadline exceeded", response.json()["error"])
+        get_recipes.assert_not_called()
+        stream.assert_not_called()
+
+    def test_connection_error_is_reported_as_a_missed_deadline(self):
+        import httpx
+        from openai import APIConnectionError
+
+        error = APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/responses"))
+        with mock.patch("api.views.get_recipes", side_effect=error):
+            response = self.post(deadline_ms="5000")
+        self.assertEqual(response.status_code, 504)
+
+    def test_invalid_deadline_is_rejected(self):
+        self.assertEqual(self.post(deadline_ms="soon").status_code, 400)
+
+
+class PromptTests(SimpleTestCase):
+    @skipUnless(tokens.tiktoken, "tiktoken is not installed")
+    def test_tokens_are_counted_with_a_tiktoken_encoding(self):
+        # A byte-level encoding built in place: the real BPE file is downloaded on first use.
+        enc = tokens.tiktoken.Encoding(name="bytes", pat_str=r"\w+|\s+|[^\w\s]+",
+                                       mergeable_ranks={bytes([i]): i for i in range(256)}, special_tokens={})
+        with mock.patch.object(tokens, "encoding", return_value=enc):
+            self.assertEqual(count_tokens("Eggs, milk"), len("Eggs, milk".encode()))
+        tokens.encoding.cache_clear()
+        self.addCleanup(tokens.encoding.cache_clear)
+        with mock.patch.object(tokens.tiktoken, "get_encoding", side_effect=OSError("offline")), \
+                self.assertLogs("api.utils.tokens", "WARNING"):
+            self.assertEqual(count_tokens("Eggs, milk"), 3)
+
+    def test_request_specific_text_comes_after_the_static_instructions(self):
+        request, prompt = recipes_request(None, '{"diets": ["Vegan", "keto"], "favourite": [], "time": "none"}',
+                                          '["Milk", "eggs", "milk"]', dishes=2)
+        self.assertEqual(request["instructions"], TEXT_INSTRUCTIONS)
+        self.assertNotIn("eggs", request["instructions"])
+        self.assertEqual(request["input"][0]["content"][0]["text"],
+                         "Dishes: 2\nProducts: eggs, Milk\nPreferences: diets=keto,vegan")
+        self.assertEqual(request["prompt_cache_key"], f"recipes-{prompt.version}")
+
+    def test_preferences_have_one_canonical_form(self):
+        a = canonical_preferences({"time": ["15-30 minutes"], "diets": ["Keto", "vegan"], "experience": "Beginner"})
+        b = canonical_preferences('{"experience": "beginner", "diets": ["vegan", "keto"], "time": ["15-30 minutes"]}')
+        self.assertEqual(a, b)
+        self.assertEqual(canonical_preferences("None"), "")
+
+    @override_settings(PROMPT_MAX_PRODUCTS=5, PROMPT_MAX_PRODUCT_CHARS=10)
+    def test_products_are_capped_and_clipped(self):
+        prompt = build_prompt("text", "None", [f"Product {i} with a long name" for i in range(20)])
+        products = prompt.text.split("\n")[1].removeprefix("Products: ").split(", ")
+        self.assertEqual(len(products), 5)
+        self.assertTrue(all(len(p) <= 10 for p in products))
+        self.assertTrue(prompt.truncated)
+
+    def test_products_are_dropped_until_the_prompt_fits(self):
+        fixed = count_tokens(TEXT_INSTRUCTIONS)
+        with override_settings(PROMPT_MAX_INPUT_TOKENS=fixed + 30):
+            prompt = build_prompt("text", "None", [f"item{i}" for i in range(40)])
+        self.assertLessEqual(prompt.tokens, fixed + 30)
+        self.assertEqual(prompt.tokens, fixed + count_tokens(prompt.text))
+        self.assertFalse(build_prompt("text", "None", ["eggs"]).truncated)
+
+    def test_usage_is_logged_per_prompt_version(self):
+        prompt = build_prompt("json", "None", ["eggs"])
+        usage = mock.Mock(input_tokens=120, output_tokens=300, input_tokens_details=mock.Mock(cached_tokens=64))
+        before = tokens.stats().get(prompt.version, {}).get("calls", 0)
+        with self.assertLogs("api.utils.tokens", "INFO") as logs:
+            tokens.log_usage(usage, prompt, time.monotonic())
+        self.assertIn("120 input tokens (64 cached", logs.output[0])
+        self.assertEqual(tokens.stats()[prompt.version]["calls"], before + 1)
+
+
+class ObservabilityTests(ImageDirTestCase):
+    def test_stages_are_reported_in_server_timing_and_metrics(self):
+        with mock.patch("api.views.get_recipes", return_value=RECIPE), \
+                mock.patch("api.views.get_photo", fake_photo):
+            response = self.client.post("/api/get-dishes/", {"products": '["Bread", "Meat"]', "deadline_ms": "20000"})
+
+        stages = [part.split(";")[0] for part in response["Server-Timing"].split(", ")]
+        for name in ("parse", "recipes", "parse_recipes", "photo_queue", "serialize", "total"):
+            self.assertIn(name, stages)
+        self.assertEqual(stages[-1], "total")
+
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn('dishes_stage_seconds_count{stage="parse_recipes"}', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="api/get-dishes/",method="POST",status="200",le="+Inf"}',
+                      body)
+        self.assertIn("# TYPE dishes_upstream gauge", body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test.", ["stage"], buckets=(0.1, 1))
+        metrics.REGISTRY.remove(histogram)
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value, stage="a")
+        lines = histogram.collect()
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_sum{stage="a"} 4.05', lines)
+
+    def test_only_warnings_bypass_log_sampling(self):
+        sampler = SampleFilter(rate=0.0)
+        record = lambda level: logging.LogRecord("api", level, __file__, 1, "msg", (), None)
+        self.assertFalse(sampler.filter(record(logging.INFO)))
+        self.assertTrue(sampler.filter(record(logging.WARNING)))
+
+
+class StructuredOutputTests(ImageDirTestCase):
+    def test_json_mode_sends_the_schema_and_a_shorter_prompt(self):
+        text, text_prompt = recipes_request(None, "None", ["Bread", "Meat"])
+        compact, compact_prompt = recipes_request(None, "None", ["Bread", "Meat"], fmt="json")
+        self.assertNotIn("text", text)
+        self.assertEqual(compact["text"]["format"]["type"], "json_schema")
+        self.assertLess(compact_prompt.tokens * 4, text_prompt.tokens)
+
+    def test_format_is_selected_per_request_or_in_settings(self):
+        post = lambda **data: self.client.post("/api/get-dishes/", {"products": '["Bread", "Meat"]', **data})
+        with mock.patch("api.views.get_recipes", return_value=RECIPE_JSON) as get_recipes, \
+                mock.patch("api.views.get_photo", fake_photo):
+            body = post(recipes_format="json").json()
+            self.assertEqual(get_recipes.call_args.kwargs["fmt"], "json")
+            self.assertEqual(body["dishes"][0]["time_min"], 10)
+
+            with override_settings(RECIPES_FORMAT="json"):
+                self.assertEqual(post().json()["dishes"][0]["name"], "Burger")
+            self.assertEqual(post(recipes_format="yaml").status_code, 400)
+
+
+class BatchTests(ImageDirTestCase):
+    def post(self, items, **data):
+        body = self.client.post("/api/get-dishes/batch/", {"items": items, **data}, content_type="application/json")
+        self.assertEqual(body.status_code, 200)
+        return [json.loads(line) for line in b"".join(body.streaming_content).splitlines()]
+
+    def test_identical_pantries_are_generated_once(self):
+        items = [{"id": "a", "products": ["Bread", "Meat"]}, {"id": "b", "products": ["Meat", "Bread"]},
+                 {"id": "c", "products": ["Eggs"]}]
+        get_recipes = mock.Mock(return_value=RECIPE)
+        with mock.patch("api.views.get_recipes", get_recipes), mock.patch("api.views.get_photo", fake_photo):
+            events = self.post(items)
+
+        self.assertEqual(get_recipes.call_count, 2)
+        dishes = {e["id"]: e["dishes"] for e in events if e["type"] == "dishes"}
+        self.assertEqual(sorted(dishes), ["a", "b", "c"])
+        self.assertEqual(dishes["a"], dishes["b"])
+        ready = [e["id"] for e in events if e["type"] == "image_ready"]
+        self.assertCountEqual(ready, ["a", "b", "c"])
+        self.assertEqual(events[-1], {"type": "done", "items": 3, "distinct": 2, "failed": 0})
+
+    def test_a_failing_item_does_not_fail_the_batch(self):
+        def get_recipes(img, preferences, products, **kwargs):
+            if "Eggs" in products:
+                raise RuntimeError("upstream error")
+            return RECIPE
+
+        items = [{"id": "ok", "products": ["Bread"]}, {"id": "bad", "products": ["Eggs"]},
+                 {"id": "ok", "products": ["Milk"]}, {"products": []}]
+        with mock.patch("api.views.get_recipes", get_recipes), \
+                mock.patch("api.views.get_photo", fake_photo), self.assertLogs("api.views", "ERROR"):
+            events = self.post(items, deadline_ms="5000")
+
+        by_type = {}
+        for e in events:
+            by_type.setdefault(e["type"], []).append(e.get("id"))
+        self.assertEqual(by_type["dishes"], ["ok"])
+        self.assertCountEqual(by_type["error"], ["bad", "ok", "3"])
+        self.assertNotIn("image_ready", by_type)  # 5 s budget: no images
+        self.assertEqual(events[-1]["failed"], 3)
+
+    def test_malformed_batches_are_rejected(self):
+        post = lambda items: self.client.post("/api/get-dishes/batch/", {"items": items})
+        self.assertEqual(post("not json").status_code, 400)
+        with override_settings(BATCH_MAX_ITEMS=1):
+            self.assertEqual(post(json.dumps([{"products": ["A"]}, {"products": ["B"]}])).status_code, 400)
+        response = self.client.post("/api/get-dishes/batch/", [{"products": ["A"]}], content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json())
+
+
+class WarmStoreTests(ImageDirTestCase):
+    def test_warms_frequent_inputs_once_and_resumes_after_failures(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "pantries.txt")
+        with open(path, "w") as f:
+            f.write('["Bread", "Meat"]\n{"products": ["meat", "bread"], "count": 3}\n# comment\nEggs, Milk\n')
+        cache = RecipeCache(os.path.join(tmp.name, "r.sqlite3"), ttl=60, max_entries=10, memory_entries=10)
+        upstream = mock.Mock()
+        upstream.call.side_effect = [RuntimeError("upstream error"), mock.Mock(output_text=RECIPE, usage=None)]
+
+        def run(*args):
+            out = io.StringIO()
+            call_command("warmstore", path, "--concurrency", "1", *args, stdout=out, stderr=io.StringIO())
+            return out.getvalue()
+
+        with mock.patch("api.utils.gpt.recipe_cache", return_value=cache), \
+                mock.patch("api.utils.warm.recipe_cache", return_value=cache), \
+                mock.patch("api.utils.gpt.scheduler", return_value=upstream), \
+                mock.patch("api.utils.gpt.client"), \
+                mock.patch("api.utils.warm.get_photo", fake_photo):
+            first = run()
+            self.assertIn("Inputs: 2 distinct, 5 requests", first)
+            self.assertIn("Warmed 1 inputs", first)
+            self.assertIn("1 failed", first)
+            self.assertIn("Coverage: 1/2 inputs, 20.0% of requests", first)
+
+            upstream.call.side_effect = None
+            upstream.call.return_value = mock.Mock(output_text=RECIPE, usage=None)
+            second = run("--resume")
+            self.assertIn("1 done in the interrupted run, 0 already warm, 1 to generate", second)
+            self.assertIn("Coverage: 2/2 inputs, 100.0% of requests", second)
+            self.assertFalse(os.path.exists(path + ".warm.json"))
+
+            third = run()
+            self.assertIn("2 already warm, 0 to generate", third)
+        self.assertEqual(upstream.call.call_count, 3)
+        image_id = storage.dish_image_id("Burger", ["Bread (2 slices)", "Meat (100g)"])
+        self.assertEqual(storage.image_state(image_id), storage.READY)
+
+
+class StartupTests(SimpleTestCase):
+    def test_openai_client_is_created_once_per_process(self):
+        with mock.patch("api.utils.gpt._client", None), mock.patch("api.utils.gpt.OpenAI") as openai:
+            first = gpt.client()
+            self.assertIs(gpt.client(), first)
+            with mock.patch("api.utils.gpt.os.getpid", return_value=-1):
+                gpt.client()
+        self.assertEqual(openai.call_count, 2)
+
+    def test_lean_profile_serves_the_api_without_contrib_apps(self):
+        script = (
+            "import django, json; django.setup()\n"
+            "from django.conf import settings; from django.test import Client\n"
+            "c = Client()\n"
+            "print(json.dumps([settings.INSTALLED_APPS, c.post('/api/get-dishes/', {}).status_code,\n"
+            "                  c.get('/metrics').status_code, c.get('/admin/').status_code]))\n"
+        )
+        env = {k: v for k, v in os.environ.items() if not k.startswith("DJANGO_")}
+        env.update(DJANGO_SETTINGS_MODULE="backend.settings_lean", DJANGO_SECRET_KEY="test",
+                   DJANGO_ALLOWED_HOSTS="testserver")
+        run = lambda env: subprocess.run([sys.executable, "-c", script], cwd=settings.BASE_DIR, env=env,
+                                         capture_output=True, text=True, timeout=60)
+        out = run(env)
+        apps, dishes, metrics_status, admin = json.loads(out.stdout.splitlines()[-1])
+        self.assertNotIn("django.contrib.auth", apps)
+        self.assertEqual((dishes, metrics_status, admin), (400, 200, 404))
+
+        for missing in ("DJANGO_SECRET_KEY", "DJANGO_ALLOWED_HOSTS"):
+            out = run({k: v for k, v in env.items() if k != missing})
+            self.assertNotEqual(out.returncode, 0)
+            self.assertIn(f"ImproperlyConfigured: Set {missing}", out.stderr)
+
+
+class WireFormatTests(ImageDirTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "r.sqlite3")
+        self.recipes = RecipeCache(path, ttl=60, max_entries=10, memory_entries=10)
+        self.dishes = RecipeCache(path, ttl=60, max_entries=10, memory_entries=10, table="dishes")
+        for patcher in (mock.patch("api.utils.dishes.dish_cache", return_value=self.dishes),
+                        mock.patch("api.utils.gpt.recipe_cache", return_value=self.recipes)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, headers=None, **data):
+        with mock.patch("api.views.get_recipes", return_value=RECIPE), mock.patch("api.views.get_photo", fake_photo), \
+                mock.patch("api.views.stream_recipes", return_value=iter([RECIPE])):
+            return self.client.post("/api/get-dishes/", {"products": '["Bread", "Meat"]', "deadline_ms": "5000", **data},
+                                    headers=headers or {})
+
+    def test_compact_dishes_are_completed_by_id(self):
+        dish = self.post(compact="1").json()["dishes"][0]
+        self.assertEqual(list(dish), ["name", "time_min", "difficulty", "energy_kcal", "proteins_g", "fats_g",
+                                      "carbs_g", "image_id", "image_status"])
+
+        full = self.client.get(f"/api/dishes/{dish['image_id']}/").json()["dish"]
+        self.assertEqual(full["recipe"], "Step 1.\nGrill the meat.")
+        self.assertEqual(self.client.get(f"/api/dishes/{dish['image_id']}/?fields=recipe").json()["dish"],
+                         {"recipe": full["recipe"], "image_id": dish["image_id"]})
+        self.assertEqual(self.client.get("/api/dishes/unknown/").status_code, 404)
+        # Compact dishes do not touch the recipe texts or their counters.
+        self.assertEqual(self.recipes.stats()["writes"], 0)
+        self.assertEqual(self.recipes.get(dish["image_id"]), None)
+        self.assertEqual(self.dishes.stats()["writes"], 1)
+
+        self.assertEqual(list(self.post(fields="name,recipe").json()["dishes"][0]), ["name", "recipe", "image_id"])
+        self.assertEqual(self.post(fields="name,secret").status_code, 400)
+
+    def test_json_is_compressed_when_the_client_accepts_it(self):
+        with override_settings(RESPONSE_COMPRESSION_MIN_BYTES=0):
+            plain = self.post()
+            packed = self.post(headers={"Accept-Encoding": "br;q=0, gzip"})
+            streamed = self.post(stream="1", headers={"Accept-Encoding": "gzip"})
+
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertIn("Accept-Encoding", packed["Vary"])
+        self.assertEqual(packed["Content-Encoding"], "gzip")
+        self.assertLess(len(packed.content), len(plain.content))
+        self.assertEqual(json.loads(gzip.decompress(packed.content)), plain.json())
+        self.assertNotIn("Content-Encoding", streamed)
+
+    @skipUnless(middleware.brotli, "brotli is not installed")
+    def test_json_is_brotli_compressed_when_the_client_prefers_it(self):
+        with override_settings(RESPONSE_COMPRESSION_MIN_BYTES=0):
+            plain = self.post()
+            packed = self.post(headers={"Accept-Encoding": "br, gzip"})
+        self.assertEqual(packed["Content-Encoding"], "br")
+        self.assertEqual(json.loads(middleware.brotli.decompress(packed.content)), plain.json())
+
+    @skipUnless(renderers.orjson, "orjson is not installed")
+    def test_orjson_output_matches_the_stdlib_encoder(self):
+        data = {"dishes": [{"name": "Crème brûlée", "energy_kcal": 310.5, "image_id": None}], "error": ErrorDetail("bad")}
+        with mock.patch.object(renderers, "orjson", None):
+            stdlib = renderers.dumps(data)
+        self.assertEqual(json.loads(renderers.dumps(data)), json.loads(stdlib))
+
+    def test_fast_renderer_matches_drf(self):
+        data = {"dishes": [{"name": "Crème brûlée", "energy_kcal": 310.5, "products": ["Eggs (2)"]}],
+                "error": ErrorDetail("bad")}
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
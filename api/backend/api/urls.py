@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.urls import path
-from .views import get_dishes, serve_image
+from .views import dish_detail, get_dishes, get_dishes_async, get_dishes_batch, serve_image
 
 urlpatterns = [
-    path("get-dishes/", get_dishes, name="dishes"),
+    path("get-dishes/", get_dishes_async if settings.ASYNC_VIEWS else get_dishes, name="dishes"),
+    path("get-dishes/batch/", get_dishes_batch, name="dishes_batch"),
+    path("dishes/<str:image_id>/", dish_detail, name="dish_detail"),
     path("images/<str:filename>/", serve_image, name="serve_image"),
 ]
\ No newline at end of file
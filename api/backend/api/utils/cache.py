@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def normalize_products(products):
+    if isinstance(products, str):
+        try:
+            products = json.loads(products)
+        except ValueError:
+            products = products.split(",")
+    if not isinstance(products, (list, tuple)):
+        return []
+    return sorted({str(p).strip().lower() for p in products if str(p).strip()})
+
+
+def normalize_preferences(preferences):
+    if isinstance(preferences, str):
+        try:
+            preferences = json.loads(preferences)
+        except ValueError:
+            return preferences.strip().lower()
+    if not isinstance(preferences, dict):
+        return preferences
+    canonical = {}
+    for key, value in preferences.items():
+        if isinstance(value, (list, tuple)):
+            value = sorted(str(v).strip().lower() for v in value)
+        elif isinstance(value, str):
+            value = value.strip().lower()
+        canonical[str(key)] = value
+    return canonical
+
+
+def file_sha256(source):
+    h = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    if hasattr(source, "chunks"):
+        for block in source.chunks():
+            h.update(block)
+    else:
+        h.update(source.read())
+    source.seek(0)
+    return h.hexdigest()
+
+
+def recipe_cache_key(img, preferences, products, model, **variant):
+    payload = {
+        "products": normalize_products(products),
+        "preferences": normalize_preferences(preferences),
+        "image": file_sha256(img) if img else None,
+        "model": model,
+    }
+    # Generation options (dish count, ...) only enter the key when set, so
+    # default requests keep hitting entries written before they existed.
+    payload.update((k, v) for k, v in variant.items() if v is not None)
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RecipeCache:
+    """Two-tier cache of raw recipe text keyed by ``recipe_cache_key``.
+
+    The first tier is a per-process LRU dict; the second is a SQLite file
+    shared by every worker on the host. Entries expire after ``ttl``
+    seconds and the SQLite tier keeps at most ``max_entries`` rows, evicting
+    the least recently read ones. Each ``table`` is a separate namespace
+    with its own cap and counters.
+    """
+
+    def __init__(self, path, ttl, max_entries, memory_entries, table="recipes"):
+        self.path = str(path)
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _remember(self, key, value, created):
+        with self._lock:
+            self._memory[key] = (value, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self._memory[key]
+
+        db = self._db()
+        row = db.execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._count("misses")
+            return None
+
+        db.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+        self._remember(key, row[0], row[1])
+        self._count("disk_hits")
+        return row[0]
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """``set`` for several ``(key, value)`` pairs in one transaction and one eviction pass."""
+        items = list(items)
+        if not items:
+            return
+        now = time.time()
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                [(key, value, now, now) for key, value in items],
+            )
+            db.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY accessed "
+                f"LIMIT max(0, (SELECT COUNT(*) FROM {self.table}) - ?))",
+                (self.max_entries,),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        for key, value in items:
+            self._remember(key, value, now)
+        with self._lock:
+            self.counters["writes"] += len(items)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
+
+
+_recipe_cache = None
+_recipe_cache_lock = threading.Lock()
+
+
+def recipe_cache():
+    global _recipe_cache
+    if _recipe_cache is None:
+        with _recipe_cache_lock:
+            if _recipe_cache is None:
+                _recipe_cache = RecipeCache(
+                    path=settings.RECIPE_CACHE_PATH,
+                    ttl=settings.RECIPE_CACHE_TTL,
+                    max_entries=settings.RECIPE_CACHE_MAX_ENTRIES,
+                    memory_entries=settings.RECIPE_CACHE_MEMORY_ENTRIES,
+                )
+    return _recipe_cache
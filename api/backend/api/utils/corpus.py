@@ -0,0 +1,228 @@
+import logging
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Exists, F, OuterRef
+
+from . import storage
+from .cache import normalize_preferences, normalize_products
+
+logger = logging.getLogger(__name__)
+
+# The prompt always allows these on top of the user's products.
+STAPLES = {"salt", "oil", "water"}
+
+# Diets are enforced by dropping the products they forbid from the pantry:
+# a recipe must use only pantry products, so it cannot contain them either.
+MEAT_FISH = {
+    "meat", "beef", "pork", "chicken", "turkey", "lamb", "veal", "duck", "bacon", "ham", "sausage", "salami",
+    "mince", "steak", "fish", "salmon", "tuna", "cod", "shrimp", "prawn", "anchovy", "crab", "squid", "gelatin",
+}
+DAIRY = {"milk", "cheese", "butter", "cream", "yogurt", "yoghurt", "kefir", "mozzarella", "parmesan", "feta",
+         "ricotta", "mascarpone", "ghee", "curd"}
+GLUTEN = {"bread", "flour", "pasta", "spaghetti", "noodle", "wheat", "barley", "rye", "couscous", "bulgur",
+          "semolina", "cracker", "biscuit", "tortilla", "bun", "dough", "breadcrumb", "beer"}
+DIET_BANS = {
+    "vegetarian": MEAT_FISH,
+    "vegan": MEAT_FISH | DAIRY | {"egg", "honey"},
+    "gluten-free": GLUTEN,
+    "dairy-free": DAIRY,
+    "lactose-free": DAIRY,
+}
+# Diets that are a limit on the carbs per dish (g)
+DIET_CARBS = {"keto": 10, "low-carb": 25}
+
+# Cooking experience -> hardest difficulty (out of 5) that ranks first
+EXPERIENCE_DIFFICULTY = {"beginner": 2, "intermediate": 3, "advanced": 4, "professional": 5}
+
+TIME_RE = re.compile(r"(\d+)\s*(?:-\s*(\d+)|(\+))?\s*(minute|min|hour|h)")
+
+SCORE_FIELDS = ("time_min", "difficulty", "hits", "ingredient_count")
+RESPONSE_FIELDS = ("name", "products", "recipe", "time_min", "difficulty",
+                   "energy_kcal", "proteins_g", "fats_g", "carbs_g", "image_id")
+
+
+def singular(word):
+    if word.endswith("oes") or word.endswith(("ches", "shes", "sses", "xes")):
+        return word[:-2]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def normalize_ingredient(product):
+    """'Tomatoes (1 piece)' -> 'tomato'; measurements and plurals do not split the index."""
+    name = re.sub(r"\(.*?\)|\[.*?\]", " ", str(product)).lower()
+    words = re.findall(r"[^\W\d_]+", name)
+    return " ".join(singular(w) for w in words)
+
+
+def is_staple(ingredient):
+    return ingredient in STAPLES or ingredient.rsplit(" ", 1)[-1] in STAPLES
+
+
+def ingredient_set(products):
+    names = {normalize_ingredient(p) for p in normalize_products(products)}
+    return {n for n in names if n and not is_staple(n)}
+
+
+def banned(ingredient, words):
+    return any(w in words for w in ingredient.split())
+
+
+def time_ranges(values):
+    """'15-30 minutes' / '1-2 hours' / '2+ hours' -> (low, high) minutes, high None when open."""
+    ranges = []
+    for value in values or ():
+        m = TIME_RE.search(str(value).lower())
+        if not m:
+            continue
+        scale = 60 if m.group(4).startswith("h") else 1
+        low = int(m.group(1)) * scale
+        high = None if m.group(3) else int(m.group(2) or m.group(1)) * scale
+        ranges.append((low, high))
+    return ranges
+
+
+def parse_preferences(preferences):
+    """Constraints the corpus can enforce, or None when it cannot tell what is allowed.
+
+    Free text ("vegan please") and diets without a rule here may forbid
+    anything, so those requests are left to the model.
+    """
+    prefs = normalize_preferences(preferences)
+    if prefs in (None, "", "none"):
+        return {"diets": [], "experience": "", "time": []}
+    if not isinstance(prefs, dict):
+        return None
+    diets = prefs.get("diets") or []
+    diets = [str(d) for d in (diets if isinstance(diets, list) else [diets]) if d != "none"]
+    if any(d not in DIET_BANS and d not in DIET_CARBS for d in diets):
+        return None
+    return {
+        "diets": diets,
+        "experience": prefs.get("experience") or "",
+        "time": prefs.get("time") or [],
+    }
+
+
+def score(recipe, prefs):
+    """Higher is better: fits the time and experience asked for, then popular, then uses more of the pantry."""
+    points = 0
+    ranges = time_ranges(prefs["time"])
+    if ranges and recipe.time_min is not None:
+        points += 2 * any(low <= recipe.time_min and (high is None or recipe.time_min <= high) for low, high in ranges)
+    cap = EXPERIENCE_DIFFICULTY.get(prefs["experience"])
+    if cap and recipe.difficulty is not None:
+        points += recipe.difficulty <= cap
+    return points, recipe.hits, recipe.ingredient_count
+
+
+def to_dish(recipe, products):
+    dish = {field: getattr(recipe, field) for field in RESPONSE_FIELDS}
+    dish["products_exist"] = list(products)
+    return dish
+
+
+def match(products, preferences, limit):
+    """Recipes covered by ``products`` that respect the diets, best first; [] on any database error.
+
+    A recipe qualifies when every non-staple ingredient is in the pantry.
+    Candidates come from the pivot index (the recipe's rarest ingredient
+    must be in the pantry) and the inverted index rules out any recipe
+    with an ingredient outside it, both in one indexed query.
+    """
+    from ..models import Recipe, RecipeIngredient
+
+    prefs = parse_preferences(preferences)
+    if prefs is None:
+        return []
+    pantry = ingredient_set(products)
+    for diet in prefs["diets"]:
+        words = DIET_BANS.get(diet)
+        if words:
+            pantry = {p for p in pantry if not banned(p, words)}
+    if not pantry:
+        return []
+
+    outside = RecipeIngredient.objects.filter(recipe=OuterRef("pk")).exclude(ingredient__in=pantry)
+    query = Recipe.objects.filter(pivot__in=pantry).exclude(Exists(outside))
+    for diet in prefs["diets"]:
+        if diet in DIET_CARBS:
+            query = query.filter(carbs_g__lte=DIET_CARBS[diet])
+
+    try:
+        # Candidates are ranked on the columns score() reads; only the
+        # winners are loaded with their products and recipe text.
+        candidates = query.order_by("-hits").values_list("pk", *SCORE_FIELDS, named=True)
+        candidates = list(candidates[:settings.CORPUS_MAX_CANDIDATES])
+        best = [r.pk for r in sorted(candidates, key=lambda r: score(r, prefs), reverse=True)[:limit]]
+        if best:
+            rows = Recipe.objects.in_bulk(best)
+            Recipe.objects.filter(pk__in=best).update(hits=F("hits") + 1)
+            best = [rows[pk] for pk in best]
+    except DatabaseError:
+        logger.exception("Recipe corpus lookup failed")
+        return []
+    products = normalize_products(products)
+    return [to_dish(r, products) for r in best]
+
+
+def ingest(recipes):
+    """Store parsed recipes in the corpus; returns how many were new. Never raises on database errors."""
+    from ..models import Ingredient, Recipe, RecipeIngredient
+
+    added = 0
+    if not settings.CORPUS_ENABLED:
+        return added
+    for dish in recipes:
+        if dish.get("time_min") is None or not dish.get("products"):
+            # Short or malformed blocks; not worth serving again.
+            continue
+        ingredients = sorted(ingredient_set(dish["products"]))
+        if not ingredients:
+            continue
+        image_id = dish.get("image_id") or storage.dish_image_id(dish["name"], dish["products"])
+        try:
+            with transaction.atomic():
+                if Recipe.objects.filter(image_id=image_id).update(hits=F("hits") + 1):
+                    continue
+                counts = dict(Ingredient.objects.filter(name__in=ingredients).values_list("name", "recipe_count"))
+                pivot = min(ingredients, key=lambda n: (counts.get(n, 0), n))
+                recipe = Recipe.objects.create(
+                    image_id=image_id,
+                    name=dish["name"][:200],
+                    products=dish["products"],
+                    recipe=dish["recipe"],
+                    time_min=dish["time_min"],
+                    difficulty=dish.get("difficulty"),
+                    energy_kcal=dish.get("energy_kcal"),
+                    proteins_g=dish.get("proteins_g"),
+                    fats_g=dish.get("fats_g"),
+                    carbs_g=dish.get("carbs_g"),
+                    pivot=pivot,
+                    ingredient_count=len(ingredients),
+                )
+                RecipeIngredient.objects.bulk_create(
+                    [RecipeIngredient(recipe=recipe, ingredient=n) for n in ingredients])
+                Ingredient.objects.bulk_create(
+                    [Ingredient(name=n) for n in ingredients if n not in counts], ignore_conflicts=True)
+                Ingredient.objects.filter(name__in=ingredients).update(recipe_count=F("recipe_count") + 1)
+            added += 1
+        except DatabaseError:
+            logger.exception("Could not store recipe %s in the corpus", dish.get("name"))
+    return added
+
+
+def lookup(products, preferences, dishes):
+    """Corpus answer for a products-only request, or None when the LLM should be asked."""
+    if not settings.CORPUS_ENABLED or not products or parse_preferences(preferences) is None:
+        return None
+    wanted = dishes or settings.CORPUS_MIN_MATCHES
+    found = match(products, preferences, limit=wanted)
+    if len(found) < min(wanted, settings.CORPUS_MIN_MATCHES):
+        return None
+    return found
@@ -0,0 +1,53 @@
+import time
+
+# (minimum budget in ms, plan) from the most to the least generous. The
+# numbers follow observed latencies: 3-4 recipes take ~10-15 s, a medium
+# 1024px photo ~20-40 s and a low-quality one ~8-15 s.
+PLANS = [
+    (60000, {"dishes": None, "quality": "medium", "images": True}),
+    (30000, {"dishes": 3, "quality": "low", "images": True}),
+    (15000, {"dishes": 2, "quality": "low", "images": True}),
+    (0, {"dishes": 2, "quality": "low", "images": False}),
+]
+
+DEFAULT_PLAN = PLANS[0][1]
+
+# Time kept back for parsing and serializing the response
+RESPONSE_MARGIN = 0.25
+
+
+def parse_deadline_ms(value):
+    if value in (None, ""):
+        return None
+    try:
+        deadline_ms = int(float(value))
+    except (TypeError, ValueError):
+        raise ValueError("deadline_ms must be a number of milliseconds.")
+    if deadline_ms <= 0:
+        raise ValueError("deadline_ms must be positive.")
+    return deadline_ms
+
+
+def plan_for(deadline_ms):
+    if deadline_ms is None:
+        return dict(DEFAULT_PLAN)
+    for minimum, plan in PLANS:
+        if deadline_ms >= minimum:
+            return dict(plan)
+
+
+class Budget:
+    """Wall-clock budget of one request, measured from when it was parsed."""
+
+    def __init__(self, deadline_ms):
+        self.deadline_ms = deadline_ms
+        self.expires = None if deadline_ms is None else time.monotonic() + deadline_ms / 1000
+
+    def remaining(self, margin=RESPONSE_MARGIN):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic() - margin)
+
+    def spent(self, margin=RESPONSE_MARGIN):
+        """True once a deadline was given and no time is left for an upstream call."""
+        return self.expires is not None and self.remaining(margin) <= 0
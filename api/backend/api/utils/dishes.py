@@ -0,0 +1,51 @@
+import json
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from . import corpus
+from .cache import RecipeCache
+
+
+def remember(recipes):
+    """Keep the full dishes of a compact response; one write for all of them."""
+    dish_cache().set_many(
+        (recipe["image_id"], json.dumps({k: v for k, v in recipe.items() if k != "image_status"}))
+        for recipe in recipes)
+
+
+def find(image_id):
+    """The full dish behind ``image_id``: one sent in a compact response, else a corpus recipe; None if unknown."""
+    text = dish_cache().get(image_id)
+    if text is not None:
+        return json.loads(text)
+    if not settings.CORPUS_ENABLED:
+        return None
+    from ..models import Recipe
+
+    try:
+        recipe = Recipe.objects.filter(image_id=image_id).first()
+    except DatabaseError:
+        return None
+    return corpus.to_dish(recipe, []) if recipe else None
+
+
+_dish_cache = None
+_dish_cache_lock = threading.Lock()
+
+
+def dish_cache():
+    """Full dishes behind compact responses: their own table, cap and counters next to the recipe texts."""
+    global _dish_cache
+    if _dish_cache is None:
+        with _dish_cache_lock:
+            if _dish_cache is None:
+                _dish_cache = RecipeCache(
+                    path=settings.RECIPE_CACHE_PATH,
+                    ttl=settings.DISH_CACHE_TTL,
+                    max_entries=settings.DISH_CACHE_MAX_ENTRIES,
+                    memory_entries=settings.DISH_CACHE_MEMORY_ENTRIES,
+                    table="dishes",
+                )
+    return _dish_cache
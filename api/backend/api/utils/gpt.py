@@ -1,64 +1,300 @@
-from openai import OpenAI
-import base64, mimetypes, os
-from .prompts import recipes_prompt
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, NOT_GIVEN
+import asyncio, base64, httpx, logging, os, threading, time, weakref
+from concurrent.futures import CancelledError, TimeoutError as FuturesTimeout
+from django.conf import settings
+from . import timing, tokens
+from .prompts import RECIPES_SCHEMA, build_prompt
+from .parser import FORMATS, JSON, TEXT
+from .cache import recipe_cache, recipe_cache_key
+from .phash import dhash, near_duplicates
+from .singleflight import recipes_flight
+from .scheduler import deadline_after, scheduler
+from .storage import write_atomic
+from .uploads import prepare_upload
 from dotenv import load_dotenv
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+RECIPES_MODEL = "gpt-4.1-mini"
 
-def file_to_data_url(source) -> str:
-    if isinstance(source, str):
-        if not os.path.exists(source):
-            raise FileNotFoundError(f"File not found: {source}")
-        mime = mimetypes.guess_type(source)[0] or "image/png"
-        with open(source, "rb") as f:
-            data = f.read()
-    else:
-        data = source.read()
-        mime = getattr(source, "content_type", None) or "image/png"
+# Built on first use: a worker that only serves images never sets up the
+# connection pool, and a forked worker never reuses its parent's sockets.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def client():
+    """The process-wide OpenAI client."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                load_dotenv()
+                # Retries and backoff are handled by the upstream scheduler, not the SDK.
+                _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+                _client_pid = os.getpid()
+    return _client
+
+# One pooled AsyncOpenAI client per event loop: httpx connections cannot be
+# shared between loops, and uvicorn runs a single loop per worker anyway.
+_async_clients = weakref.WeakKeyDictionary()
+
+def async_client():
+    loop = asyncio.get_running_loop()
+    aclient = _async_clients.get(loop)
+    if aclient is None:
+        load_dotenv()
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "200")),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "50")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30")),
+        )
+        aclient = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=limits),
+        )
+        _async_clients[loop] = aclient
+    return aclient
 
+def file_to_data_url(source) -> str:
+    if isinstance(source, str) and not os.path.exists(source):
+        raise FileNotFoundError(f"File not found: {source}")
+    # Downscaled / re-encoded copy, see utils/uploads.py
+    data, mime = prepare_upload(source)
     b64 = base64.b64encode(data).decode("utf-8")
     return f"data:{mime};base64,{b64}"
 
-def get_recipes(img, preferences, products):
-    content = [{"type": "input_text", "text": recipes_prompt(preferences, products)}]
+def recipes_format(fmt=None):
+    """``fmt`` or the configured default; raises ValueError for unknown formats."""
+    fmt = fmt or settings.RECIPES_FORMAT
+    if fmt not in FORMATS:
+        raise ValueError(f"recipes_format must be one of: {', '.join(FORMATS)}.")
+    return fmt
+
+def recipes_input(img, prompt):
+    content = [{"type": "input_text", "text": prompt.text}]
     if img:
         data_url = file_to_data_url(img)
         content.append({"type": "input_image", "image_url": data_url})
 
-    resp = client.responses.create(
-        model="gpt-4.1-mini",
-        input=[{
-            "role": "user",
-            "content": content
-        }]
-    )
-    print(resp.output_text)
-    return resp.output_text
+    return [{
+        "role": "user",
+        "content": content
+    }]
+
+def recipes_request(img, preferences, products, dishes=None, fmt=TEXT):
+    """``(kwargs for responses.create, Prompt)`` in the given output format.
+
+    The static instructions go first and the same prompt_cache_key is sent
+    for every call of a prompt version, so upstream prefix caching applies.
+    """
+    prompt = build_prompt(fmt, preferences, products, dishes)
+    request = {
+        "model": RECIPES_MODEL,
+        "instructions": prompt.instructions,
+        "input": recipes_input(img, prompt),
+        "prompt_cache_key": f"recipes-{prompt.version}",
+    }
+    if fmt == JSON:
+        request["text"] = {"format": {"type": "json_schema", "name": "recipes", "schema": RECIPES_SCHEMA, "strict": True}}
+    return request, prompt
+
+def cache_variant(dishes, fmt):
+    # The text format predates the option; its keys stay as they were.
+    return {"dishes": dishes, "fmt": None if fmt == TEXT else fmt}
+
+def lookup_recipes(img, preferences, products, dishes=None, fmt=TEXT):
+    """Exact, then near-duplicate photo cache lookup; returns ``(key, cached text or None, photo)``.
+
+    ``photo`` is the ``(dhash, context)`` to hand to ``remember_recipes``.
+    """
+    cache = recipe_cache()
+    key = recipe_cache_key(img, preferences, products, RECIPES_MODEL, **cache_variant(dishes, fmt))
+    cached = cache.get(key)
+    index = near_duplicates()
+    if cached is not None or not img or index is None:
+        return key, cached, None
+
+    value = dhash(img)
+    if value is None:
+        return key, None, None
+    # Everything but the photo itself must match exactly.
+    photo = (value, recipe_cache_key(None, preferences, products, RECIPES_MODEL, **cache_variant(dishes, fmt)))
+    near_key = index.find(*photo)
+    if near_key is not None:
+        cached = cache.get(near_key)
+    return key, cached, photo
+
+def remember_recipes(key, text, photo):
+    recipe_cache().set(key, text)
+    if photo is not None:
+        near_duplicates().add(*photo, key)
+
+def get_recipes(img, preferences, products, dishes=None, timeout=NOT_GIVEN, fmt=None):
+    fmt = recipes_format(fmt)
+    deadline = deadline_after(timeout)
+    cache = recipe_cache()
+    key, cached, photo = lookup_recipes(img, preferences, products, dishes, fmt)
+    if cached is not None:
+        return cached
 
-def get_photo(dish_name, products, recipe, download_path):
-    prompt = (
+    def call():
+        request, prompt = recipes_request(img, preferences, products, dishes, fmt)
+        started = time.monotonic()
+        with timing.stage("recipes_upstream"):
+            resp = scheduler().call(
+                "text",
+                client().responses.create,
+                **request,
+                timeout=timeout,
+                deadline=deadline
+            )
+        tokens.log_usage(resp.usage, prompt, started)
+        logger.debug("Recipes %s output: %s", prompt.version, resp.output_text)
+        remember_recipes(key, resp.output_text, photo)
+        return resp.output_text
+
+    wait = timeout if isinstance(timeout, (int, float)) else None
+    return recipes_flight.do(key, call, recheck=lambda: cache.get(key), timeout=wait)
+
+def stream_recipes(img, preferences, products, dishes=None, fmt=None, timeout=NOT_GIVEN):
+    fmt = recipes_format(fmt)
+    deadline = deadline_after(timeout)
+    key, cached, photo = lookup_recipes(img, preferences, products, dishes, fmt)
+    if cached is not None:
+        return iter([cached])
+
+    # Streams only coalesce within the process: a follower gets the whole
+    # text once the leader finishes. Holding a cross-process lease for the
+    # lifetime of a client-driven generator is not worth the risk.
+    fut, leader = recipes_flight.join(key)
+    if not leader:
+        wait = timeout if isinstance(timeout, (int, float)) else settings.SINGLEFLIGHT_LEASE_TIMEOUT
+        try:
+            return iter([fut.result(wait)])
+        except (FuturesTimeout, CancelledError):
+            # The leader is stuck or its client went away: stream our own
+            # answer, outside the flight.
+            fut = None
+
+    def settle(**outcome):
+        if fut is not None:
+            recipes_flight.settle(key, fut, **outcome)
+
+    try:
+        # The request is sent right away so upload/auth errors surface before
+        # the HTTP response starts; only the token deltas are consumed lazily.
+        request, prompt = recipes_request(img, preferences, products, dishes, fmt)
+        started = time.monotonic()
+        stream = scheduler().call(
+            "text",
+            client().responses.create,
+            **request,
+            stream=True,
+            timeout=timeout,
+            deadline=deadline
+        )
+    except BaseException as exc:
+        settle(error=exc)
+        raise
+    recipes_flight.record("calls")
+
+    def deltas():
+        parts = []
+        completed = False
+        try:
+            with stream:
+                for event in stream:
+                    if event.type == "response.output_text.delta":
+                        parts.append(event.delta)
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        completed = True
+                        tokens.log_usage(event.response.usage, prompt, started)
+        except BaseException as exc:
+            settle(error=exc)
+            raise
+        text = "".join(parts)
+        if completed:
+            remember_recipes(key, text, photo)
+        settle(result=text)
+
+    gen = deltas()
+    # A response that is dropped before its first chunk never runs the
+    # generator body; release the waiters when it is collected instead.
+    weakref.finalize(gen, settle, error=GeneratorExit())
+    return gen
+
+async def aget_recipes(img, preferences, products, dishes=None, timeout=NOT_GIVEN, fmt=None):
+    fmt = recipes_format(fmt)
+    deadline = deadline_after(timeout)
+    key, cached, photo = await asyncio.to_thread(lookup_recipes, img, preferences, products, dishes, fmt)
+    if cached is not None:
+        return cached
+
+    async def call():
+        request, prompt = await asyncio.to_thread(recipes_request, img, preferences, products, dishes, fmt)
+        started = time.monotonic()
+        with timing.stage("recipes_upstream"):
+            resp = await scheduler().acall(
+                "text",
+                async_client().responses.create,
+                **request,
+                timeout=timeout,
+                deadline=deadline
+            )
+        tokens.log_usage(resp.usage, prompt, started)
+        logger.debug("Recipes %s output: %s", prompt.version, resp.output_text)
+        await asyncio.to_thread(remember_recipes, key, resp.output_text, photo)
+        return resp.output_text
+
+    wait = timeout if isinstance(timeout, (int, float)) else None
+    return await recipes_flight.ado(key, call, timeout=wait)
+
+def photo_prompt(dish_name, products, recipe):
+    return (
         f"{dish_name} that was cooked with these products: {', '.join(products)}. "
         f"And cooked by this recipe:\n{recipe}\n\n"
         f"It should look tasty, the dish is served in the plate, the photo should not be cut, make plate take 75% of space"
     )
 
-    response = client.images.generate(
-        model="gpt-image-1",
-        prompt=prompt,
-        size="1024x1024",
-        quality="medium",
-        n=1
-    )
-
-    image_b64 = response.data[0].b64_json
-    image_bytes = base64.b64decode(image_b64)
+def save_photo(response, download_path):
+    with timing.stage("photo_write"):
+        image_b64 = response.data[0].b64_json
+        image_bytes = base64.b64decode(image_b64)
+        write_atomic(download_path, image_bytes)
+    return download_path
 
-    with open(download_path, "wb") as f:
-        f.write(image_bytes)
+def get_photo(dish_name, products, recipe, download_path, timeout=NOT_GIVEN, quality="medium"):
+    with timing.stage("photo_upstream"):
+        response = scheduler().call(
+            "image",
+            client().images.generate,
+            model="gpt-image-1",
+            prompt=photo_prompt(dish_name, products, recipe),
+            size="1024x1024",
+            quality=quality,
+            n=1,
+            timeout=timeout,
+            deadline=deadline_after(timeout)
+        )
+    return save_photo(response, download_path)
 
-    return download_path
+async def aget_photo(dish_name, products, recipe, download_path, timeout=NOT_GIVEN, quality="medium"):
+    with timing.stage("photo_upstream"):
+        response = await scheduler().acall(
+            "image",
+            async_client().images.generate,
+            model="gpt-image-1",
+            prompt=photo_prompt(dish_name, products, recipe),
+            size="1024x1024",
+            quality=quality,
+            n=1,
+            timeout=timeout,
+            deadline=deadline_after(timeout)
+        )
+    return await asyncio.to_thread(save_photo, response, download_path)
 
 if __name__ == "__main__":
     # print(get_recipes_by_image("test.jpg"))
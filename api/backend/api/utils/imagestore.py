@@ -0,0 +1,277 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+# Temp files from writes that died halfway are removed after this long.
+STALE_TMP_AGE = 3600
+
+
+def classify(filename):
+    """``(image_id, kind, source_tier)`` for a file in the store, kind in full/preview/variant/marker/tmp."""
+    parts = filename.split(".")
+    image_id = parts[0]
+    if parts[-1] == "tmp":
+        return image_id, "tmp", None
+    if len(parts) == 2 and parts[1] in (storage.PENDING, storage.FAILED):
+        return image_id, "marker", None
+    if len(parts) == 2:
+        return image_id, storage.FULL, None
+    if len(parts) == 3 and parts[1] == storage.PREVIEW:
+        return image_id, storage.PREVIEW, None
+    return image_id, "variant", storage.PREVIEW if parts[1] == storage.PREVIEW else storage.FULL
+
+
+class Entry:
+    __slots__ = ("path", "name", "kind", "source", "size", "atime", "mtime")
+
+    def __init__(self, path, name, kind, source, stat):
+        self.path = path
+        self.name = name
+        self.kind = kind
+        self.source = source
+        self.size = stat.st_size
+        self.atime = stat.st_atime
+        self.mtime = stat.st_mtime
+
+
+class Group:
+    """Every file that belongs to one image id; evicted as a unit."""
+
+    def __init__(self, image_id):
+        self.image_id = image_id
+        self.entries = []
+
+    @property
+    def size(self):
+        return sum(e.size for e in self.entries)
+
+    @property
+    def last_used(self):
+        return max((max(e.atime, e.mtime) for e in self.entries), default=0)
+
+    def kinds(self):
+        return {e.kind for e in self.entries}
+
+    def pending(self):
+        return any(e.kind == "marker" and e.name.endswith("." + storage.PENDING) for e in self.entries)
+
+
+def scan(root=None):
+    """Walk the sharded store; returns ``({image_id: Group}, legacy_paths)``.
+
+    Legacy paths are files left at the top level by the old flat layout.
+    """
+    root = root or storage.IMAGES_DIR
+    groups, legacy = {}, []
+    try:
+        top = list(os.scandir(root))
+    except FileNotFoundError:
+        return groups, legacy
+
+    for first in top:
+        if first.is_file():
+            if not first.name.startswith("."):
+                legacy.append(first.path)
+            continue
+        if not first.is_dir():
+            continue
+        for second in os.scandir(first.path):
+            if not second.is_dir():
+                continue
+            for entry in os.scandir(second.path):
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                image_id, kind, source = classify(entry.name)
+                group = groups.get(image_id)
+                if group is None:
+                    group = groups[image_id] = Group(image_id)
+                group.entries.append(Entry(entry.path, entry.name, kind, source, stat))
+    return groups, legacy
+
+
+def totals(groups):
+    files = sum(len(g.entries) for g in groups.values())
+    return files, sum(g.size for g in groups.values())
+
+
+def evict(groups, max_bytes, max_files, low_water, dry_run=False):
+    """Delete least recently used images until the store is under ``low_water`` of both caps."""
+    files, size = totals(groups)
+    over = (max_bytes and size > max_bytes) or (max_files and files > max_files)
+    result = {"evicted_images": 0, "evicted_files": 0, "freed_bytes": 0}
+    if not over:
+        return result
+
+    target_bytes = max_bytes * low_water if max_bytes else None
+    target_files = max_files * low_water if max_files else None
+    now = time.time()
+    for group in sorted(groups.values(), key=lambda g: g.last_used):
+        if (target_bytes is None or size <= target_bytes) and (target_files is None or files <= target_files):
+            break
+        # Never pull an image out from under a job that is still writing it.
+        if group.pending() and now - group.last_used < settings.PHOTO_PENDING_TTL:
+            continue
+        for entry in group.entries:
+            if not dry_run:
+                storage.remove(entry.path)
+            size -= entry.size
+            files -= 1
+            result["evicted_files"] += 1
+            result["freed_bytes"] += entry.size
+        result["evicted_images"] += 1
+        if not dry_run:
+            del groups[group.image_id]
+    return result
+
+
+def compact(groups, legacy, dry_run=False):
+    """Move legacy flat files into shards and drop temp files, stale markers and orphaned derivatives."""
+    result = {"migrated": 0, "removed_files": 0, "removed_bytes": 0, "removed_dirs": 0}
+    now = time.time()
+
+    def drop(entry):
+        if not dry_run:
+            storage.remove(entry.path)
+        result["removed_files"] += 1
+        result["removed_bytes"] += entry.size
+
+    for path in legacy:
+        name = os.path.basename(path)
+        image_id, kind, _ = classify(name)
+        if kind == "tmp":
+            if not dry_run:
+                storage.remove(path)
+            continue
+        if not dry_run:
+            target = os.path.join(storage.shard_dir(image_id), name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        result["migrated"] += 1
+
+    for group in list(groups.values()):
+        kinds = group.kinds()
+        keep = []
+        for entry in group.entries:
+            if entry.kind == "tmp" and now - entry.mtime > STALE_TMP_AGE:
+                drop(entry)
+            elif entry.kind == storage.PREVIEW and storage.FULL in kinds:
+                drop(entry)
+            elif entry.kind == "variant" and entry.source not in kinds:
+                drop(entry)
+            elif entry.kind == "variant" and entry.source == storage.PREVIEW and storage.FULL in kinds:
+                drop(entry)
+            elif (entry.kind == "marker" and entry.name.endswith("." + storage.PENDING)
+                  and now - entry.mtime > settings.PHOTO_PENDING_TTL):
+                # image_state already reports these as failed; the next request regenerates.
+                drop(entry)
+            else:
+                keep.append(entry)
+        group.entries = keep
+        if not keep and not dry_run:
+            del groups[group.image_id]
+
+    if not dry_run:
+        root = storage.IMAGES_DIR
+        for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+            if dirpath != root and not os.listdir(dirpath):
+                try:
+                    os.rmdir(dirpath)
+                    result["removed_dirs"] += 1
+                except OSError:
+                    pass
+    return result
+
+
+def report(groups, legacy):
+    files, size = totals(groups)
+    kinds = {}
+    for group in groups.values():
+        for entry in group.entries:
+            count, nbytes = kinds.get(entry.kind, (0, 0))
+            kinds[entry.kind] = (count + 1, nbytes + entry.size)
+    used = [g.last_used for g in groups.values() if g.entries]
+    return {
+        "images": len(groups),
+        "files": files,
+        "bytes": size,
+        "legacy_files": len(legacy),
+        "kinds": kinds,
+        "oldest_use": min(used) if used else None,
+        "newest_use": max(used) if used else None,
+        "max_bytes": settings.IMAGE_STORE_MAX_BYTES,
+        "max_files": settings.IMAGE_STORE_MAX_FILES,
+    }
+
+
+@contextmanager
+def maintenance_lock(blocking=False):
+    """Exclusive lock so only one process sweeps the store at a time; yields False if busy."""
+    os.makedirs(storage.IMAGES_DIR, exist_ok=True)
+    fd = os.open(os.path.join(storage.IMAGES_DIR, ".maintenance.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+def sweep(dry_run=False, compaction=False, blocking=False):
+    """Scan and enforce the configured caps; returns None if another process is sweeping."""
+    with maintenance_lock(blocking) as acquired:
+        if not acquired:
+            return None
+        groups, legacy = scan()
+        result = {}
+        if compaction:
+            result.update(compact(groups, legacy, dry_run))
+            if result["migrated"] and not dry_run:
+                groups, _ = scan()
+        result.update(evict(
+            groups, settings.IMAGE_STORE_MAX_BYTES, settings.IMAGE_STORE_MAX_FILES,
+            settings.IMAGE_STORE_LOW_WATER, dry_run,
+        ))
+        return result
+
+
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def note_write():
+    """Count a new image; every IMAGE_STORE_SWEEP_EVERY writes, sweep in the background."""
+    global _writes
+    if not settings.IMAGE_STORE_SWEEP_EVERY:
+        return
+    with _writes_lock:
+        _writes += 1
+        if _writes % settings.IMAGE_STORE_SWEEP_EVERY:
+            return
+    threading.Thread(target=background_sweep, name="image-store-sweep", daemon=True).start()
+
+
+def background_sweep():
+    try:
+        result = sweep()
+    except Exception:
+        logger.exception("Image store sweep failed")
+        return
+    if result and result["evicted_images"]:
+        logger.info("Image store sweep evicted %d images (%d bytes)",
+                    result["evicted_images"], result["freed_bytes"])
@@ -0,0 +1,284 @@
+import asyncio
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import CancelledError, Future
+
+from django.conf import settings
+
+from . import imagestore, storage, timing, variants
+from .singleflight import photos_flight
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first: every queued preview goes out before any full render.
+PRIORITIES = {storage.PREVIEW: 0, storage.FULL: 1}
+
+
+class QueueFull(Exception):
+    pass
+
+
+def existing_image(image_id, tier):
+    """Path of a file that already satisfies ``tier`` (a full render satisfies a preview)."""
+    tiers = (storage.FULL,) if tier == storage.FULL else storage.TIERS
+    found = storage.best_tier(image_id, tiers)
+    return storage.image_path(image_id, found) if found else None
+
+
+def job_succeeded(image_id, tier):
+    if tier == storage.FULL:
+        storage.set_state(image_id, storage.READY)
+        storage.remove_tier(image_id, storage.PREVIEW)
+        variants.prepare(image_id)
+        imagestore.note_write()
+    elif storage.best_tier(image_id, (storage.FULL,)):
+        # The full render finished first; its preview is no longer needed.
+        storage.remove_tier(image_id, storage.PREVIEW)
+
+
+def job_failed(image_id, tier):
+    logger.exception("Photo job %s (%s) failed", image_id, tier)
+    # The full render owns the state markers; a failed preview only means
+    # the client waits for the full image.
+    if tier == storage.FULL:
+        storage.set_state(image_id, storage.FAILED)
+
+
+def render_qualities(quality):
+    """``(full, preview)`` qualities to render for a request asking for ``quality``; ``preview`` may be None.
+
+    The full tier is content-addressed and served immutable, so a budget
+    render at the preview quality is only ever stored as the preview.
+    """
+    if quality == settings.PHOTO_PREVIEW_QUALITY:
+        return settings.PHOTO_FULL_QUALITY, quality
+    return quality, settings.PHOTO_PREVIEW_QUALITY if settings.PHOTO_PREVIEW else None
+
+
+def first_success(out, futures):
+    """Resolve ``out`` with the first successful result, or fail once all failed.
+
+    The callbacks run on whichever worker finished each future, so checking
+    and resolving ``out`` happen under one lock.
+    """
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(fut):
+        with lock:
+            if out.done():
+                return
+            if not fut.cancelled() and fut.exception() is None:
+                out.set_result(fut.result())
+                return
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                out.set_exception(CancelledError() if fut.cancelled() else fut.exception())
+
+    for fut in futures:
+        fut.add_done_callback(done)
+    return out
+
+
+class PhotoQueue:
+    """Process-wide bounded queue of dish photo jobs.
+
+    A fixed pool of daemon threads drains the queue, so slow image calls
+    never hold an HTTP worker. Every job gets a ``Future`` and its state is
+    mirrored to disk through ``storage.set_state``; a failing job only
+    fails its own future. Jobs are ordered by tier so previews for all
+    requests are rendered before full-quality images.
+    """
+
+    def __init__(self, workers, max_depth, job_timeout):
+        self.workers = workers
+        self.job_timeout = job_timeout
+        self._queue = queue.PriorityQueue(maxsize=max_depth)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._inflight = {}
+        self._pid = None
+
+    def _ensure_started(self):
+        # Threads do not survive a fork (gunicorn --preload), so start them
+        # lazily in whichever process submits first.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"photo-worker-{i}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, image_id, fn, *args, tier=storage.FULL, **kwargs):
+        """Queue ``fn`` to render ``tier`` of ``image_id`` unless one is already running here.
+
+        Images are content-addressed, so a second submit for the same id
+        attaches to the in-flight future, and an id whose file already
+        exists resolves immediately without calling ``fn``. ``fn`` gets the
+        target path as ``download_path``.
+        """
+        key = (image_id, tier)
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            fut = Future()
+            existing = existing_image(image_id, tier)
+            if existing:
+                fut.set_result(existing)
+                return fut
+            self._inflight[key] = fut
+
+        self._ensure_started()
+        fut.add_done_callback(lambda _: self._forget(key))
+        if tier == storage.FULL:
+            storage.set_state(image_id, storage.PENDING)
+        try:
+            self._queue.put_nowait((PRIORITIES[tier], next(self._seq), fut, image_id, tier, fn, args, kwargs,
+                                    timing.current(), time.perf_counter()))
+        except queue.Full:
+            if tier == storage.FULL:
+                storage.set_state(image_id, storage.FAILED)
+            fut.set_exception(QueueFull(f"photo queue is full ({self._queue.maxsize} jobs)"))
+        return fut
+
+    def submit_progressive(self, image_id, fn, *args, quality="medium", **kwargs):
+        """Queue a quick preview plus the full render; returns ``(first, full)``.
+
+        ``first`` resolves as soon as either tier is on disk, ``full`` when
+        the final image is. See ``render_qualities`` for the quality of each.
+        """
+        full_quality, preview_quality = render_qualities(quality)
+        full = self.submit(image_id, fn, *args, quality=full_quality, **kwargs)
+        if preview_quality is None or full.done():
+            return full, full
+        preview = self.submit(image_id, fn, *args, tier=storage.PREVIEW, quality=preview_quality, **kwargs)
+        return first_success(Future(), [preview, full]), full
+
+    def _forget(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            _, _, fut, image_id, tier, fn, args, kwargs, timings, queued = self._queue.get()
+            try:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                # Stages recorded by fn (upstream, disk write) land in the
+                # timings of the request that queued the photo.
+                timing.record("photo_queue", time.perf_counter() - queued, timings)
+                try:
+                    with timing.use(timings):
+                        result = photos_flight.do(
+                            f"{image_id}.{tier}",
+                            lambda: fn(*args, download_path=storage.image_path(image_id, tier),
+                                       timeout=self.job_timeout, **kwargs),
+                            recheck=lambda: existing_image(image_id, tier),
+                        )
+                except Exception as exc:
+                    job_failed(image_id, tier)
+                    fut.set_exception(exc)
+                else:
+                    job_succeeded(image_id, tier)
+                    fut.set_result(result)
+            finally:
+                self._queue.task_done()
+
+
+_photo_queue = None
+_photo_queue_lock = threading.Lock()
+
+
+def photo_queue():
+    global _photo_queue
+    if _photo_queue is None:
+        with _photo_queue_lock:
+            if _photo_queue is None:
+                _photo_queue = PhotoQueue(
+                    workers=settings.PHOTO_QUEUE_WORKERS,
+                    max_depth=settings.PHOTO_QUEUE_MAX_DEPTH,
+                    job_timeout=settings.PHOTO_JOB_TIMEOUT,
+                )
+    return _photo_queue
+
+
+# ASGI path: photos run as tasks on the worker's event loop instead of
+# threads, bounded by one semaphore per loop.
+_async_tasks = {}
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+def _async_semaphore():
+    loop = asyncio.get_running_loop()
+    sem = _async_semaphores.get(loop)
+    if sem is None:
+        sem = _async_semaphores[loop] = asyncio.Semaphore(settings.ASYNC_PHOTO_CONCURRENCY)
+    return sem
+
+
+async def _run_async(image_id, tier, fn, args, kwargs):
+    queued = time.perf_counter()
+    async with _async_semaphore():
+        timing.record("photo_queue", time.perf_counter() - queued)
+        existing = existing_image(image_id, tier)
+        if existing:
+            return existing
+        try:
+            result = await asyncio.wait_for(
+                fn(*args, download_path=storage.image_path(image_id, tier), **kwargs),
+                timeout=settings.PHOTO_JOB_TIMEOUT,
+            )
+        except Exception:
+            job_failed(image_id, tier)
+            raise
+    job_succeeded(image_id, tier)
+    return result
+
+
+def submit_async(image_id, fn, *args, tier=storage.FULL, **kwargs):
+    """Schedule coroutine function ``fn`` on the running loop.
+
+    Same contract as ``PhotoQueue.submit``: one task per image id and
+    tier, and an id whose file already exists resolves without calling
+    ``fn``.
+    """
+    key = (image_id, tier)
+    task = _async_tasks.get(key)
+    if task is not None:
+        return task
+    existing = existing_image(image_id, tier)
+    if existing:
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result(existing)
+        return fut
+
+    if tier == storage.FULL:
+        storage.set_state(image_id, storage.PENDING)
+    task = asyncio.ensure_future(_run_async(image_id, tier, fn, args, kwargs))
+    _async_tasks[key] = task
+    task.add_done_callback(lambda t: _async_tasks.pop(key, None))
+    # Retrieve the exception so a failed photo does not log "never retrieved".
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+def submit_progressive_async(image_id, fn, *args, quality="medium", **kwargs):
+    """Async counterpart of ``PhotoQueue.submit_progressive``."""
+    full_quality, preview_quality = render_qualities(quality)
+    full = submit_async(image_id, fn, *args, quality=full_quality, **kwargs)
+    if preview_quality is None or full.done():
+        return full, full
+    preview = submit_async(image_id, fn, *args, tier=storage.PREVIEW, quality=preview_quality, **kwargs)
+    return first_success(asyncio.get_running_loop().create_future(), [preview, full]), full
@@ -0,0 +1,17 @@
+import logging
+import random
+
+
+class SampleFilter(logging.Filter):
+    """Let every WARNING and above through, and only ``rate`` of the rest.
+
+    High-volume INFO/DEBUG lines (token usage, upload sizes, recipe text)
+    stay useful as a sample without flooding the log on the hot path.
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
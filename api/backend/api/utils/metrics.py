@@ -0,0 +1,128 @@
+import bisect
+import threading
+
+# Latency buckets in seconds, from a cache hit to a slow image render.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def number(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = self.header()
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{label_text(self.labelnames, key)} {number(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram in the Prometheus text format."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = self.header()
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = label_text(self.labelnames, key, [("le", number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text(self.labelnames, key)} {number(total)}")
+            lines.append(f"{self.name}_count{label_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauges:
+    """Values read at scrape time from an existing ``stats()`` function."""
+
+    def __init__(self, name, help, read, labelname="stat"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelname = labelname
+        REGISTRY.append(self)
+
+    def collect(self):
+        try:
+            stats = self.read() or {}
+        except Exception:  # a broken stats source must not take the endpoint down
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(stats.items()):
+            if isinstance(value, dict):
+                for sub, v in sorted(value.items()):
+                    if isinstance(v, (int, float)) and not isinstance(v, bool):
+                        lines.append(f'{self.name}{{{self.labelname}="{escape(key)}",field="{escape(sub)}"}} {number(v)}')
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'{self.name}{{{self.labelname}="{escape(key)}"}} {number(value)}')
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "dishes_stage_seconds", "Time spent in each stage of a request or photo job.", ["stage"])
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route.", ["route", "method", "status"])
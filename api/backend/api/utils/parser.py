@@ -0,0 +1,227 @@
+import json
+
+SEPARATOR = "\n----------\n"
+
+TEXT = "text"
+JSON = "json"
+FORMATS = (TEXT, JSON)
+
+NUMBER_START = set("0123456789+-.")
+
+
+def to_num(s, as_int=False):
+    s = s.strip().replace(",", ".")
+    try:
+        return int(float(s)) if as_int else float(s)
+    except ValueError:
+        return None
+
+
+def is_number(s):
+    # Checks the first character before to_num, so a products line does not cost a ValueError.
+    s = s.lstrip()
+    return s[:1] in NUMBER_START and to_num(s) is not None
+
+
+def split_list(line):
+    return [p.strip() for p in line.split(",") if p.strip()]
+
+
+def parse_block(block):
+    lines = [l for l in block.splitlines() if l.strip()]
+    # A last separator without its newline is not part of the dish.
+    if lines and lines[-1].strip() == SEPARATOR.strip():
+        lines.pop()
+
+    if len(lines) < 2 + 6:
+        if len(lines) < 2:
+            return None
+        return {
+            "name": lines[0].strip(),
+            "products": split_list(lines[1]),
+            "recipe": "\n".join(lines[2:]).strip(),
+            "time_min": None,
+            "difficulty": None,
+            "energy_kcal": None,
+            "proteins_g": None,
+            "fats_g": None,
+            "carbs_g": None,
+        }
+
+    # The numbers are followed by the products seen on the photo; answers
+    # that leave that line out end with the carbs.
+    has_exist = not is_number(lines[-1])
+    end = -7 if has_exist else -6
+    tail = lines[-7:-1] if has_exist else lines[-6:]
+    return {
+        "name": lines[0].strip(),
+        "products": split_list(lines[1]),
+        "recipe": "\n".join(lines[2:end]).strip(),
+        "time_min": to_num(tail[0], as_int=True),
+        "difficulty": to_num(tail[1], as_int=True),
+        "energy_kcal": to_num(tail[2]),
+        "proteins_g": to_num(tail[3]),
+        "fats_g": to_num(tail[4]),
+        "carbs_g": to_num(tail[5]),
+        "products_exist": split_list(lines[-1]) if has_exist else [],
+    }
+
+
+class RecipeParser:
+    """Turns a recipe text stream into recipe dicts, one block at a time.
+
+    Text is fed in arbitrary chunks (e.g. LLM token deltas). Each call to
+    ``feed`` returns the recipes whose separator has arrived; ``close``
+    flushes the last block. Pending text is kept as a list of chunks and
+    only the last ``len(SEPARATOR) - 1`` characters before a new chunk are
+    searched again, so every character is scanned and copied O(1) times.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._tail = ""
+
+    def feed(self, chunk):
+        recipes = []
+        overlap = len(self._tail)
+        window = self._tail + chunk
+        pos = 0
+
+        while True:
+            idx = window.find(SEPARATOR, pos)
+            if idx == -1:
+                break
+            if self._parts:
+                pending = "".join(self._parts)
+                self._parts = []
+                if idx >= overlap:
+                    block = pending + window[overlap:idx]
+                else:
+                    block = pending[:len(pending) - overlap + idx]
+            else:
+                block = window[pos:idx]
+            recipe = parse_block(block)
+            if recipe:
+                recipes.append(recipe)
+            pos = idx + len(SEPARATOR)
+
+        rest = window[max(pos, overlap):]
+        if rest:
+            self._parts.append(rest)
+        self._tail = (rest if pos else window)[-(len(SEPARATOR) - 1):]
+        return recipes
+
+    def close(self):
+        recipe = parse_block("".join(self._parts))
+        self._parts = []
+        self._tail = ""
+        return [recipe] if recipe else []
+
+
+def json_num(value, as_int=False):
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return None
+    return int(value) if as_int else float(value)
+
+
+def string_list(value):
+    return [str(v).strip() for v in value if str(v).strip()] if isinstance(value, list) else []
+
+
+def recipe_from_json(obj):
+    """Compact structured-output dish (see prompts.RECIPES_SCHEMA) -> the same dict parse_block returns."""
+    if not isinstance(obj, dict) or not str(obj.get("n") or "").strip():
+        return None
+    steps = string_list(obj.get("s"))
+    return {
+        "name": str(obj["n"]).strip(),
+        "products": string_list(obj.get("p")),
+        # Joined like parse_block joins the text mode's steps, blank lines dropped.
+        "recipe": "\n".join(f"Step {i}.\n{step}" for i, step in enumerate(steps, 1)),
+        "time_min": json_num(obj.get("t"), as_int=True),
+        "difficulty": json_num(obj.get("d"), as_int=True),
+        "energy_kcal": json_num(obj.get("e")),
+        "proteins_g": json_num(obj.get("pr")),
+        "fats_g": json_num(obj.get("f")),
+        "carbs_g": json_num(obj.get("c")),
+        "products_exist": string_list(obj.get("x")),
+    }
+
+
+class JsonRecipeParser:
+    """Streaming counterpart of RecipeParser for the structured-output mode.
+
+    The answer is ``{"r": [{...}, {...}]}``; each dish object is handed to
+    ``recipe_from_json`` as soon as its closing brace arrives. Only brace
+    depth and string state are tracked, so partial JSON is never re-parsed.
+    """
+
+    DISH_DEPTH = 2  # inside the top-level object and its array
+
+    def __init__(self):
+        self._parts = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        recipes = []
+        start = 0 if self._parts else None
+        for i, ch in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if ch == "{" and self._depth == self.DISH_DEPTH:
+                    start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if ch == "}" and self._depth == self.DISH_DEPTH and start is not None:
+                    self._parts.append(chunk[start:i + 1])
+                    recipe = self._finish()
+                    if recipe:
+                        recipes.append(recipe)
+                    start = None
+        if start is not None:
+            self._parts.append(chunk[start:])
+        return recipes
+
+    def _finish(self):
+        raw = "".join(self._parts)
+        self._parts = []
+        try:
+            return recipe_from_json(json.loads(raw))
+        except ValueError:
+            return None
+
+    def close(self):
+        # A dish cut off mid-object is incomplete; drop it.
+        self.__init__()
+        return []
+
+
+def recipe_parser(fmt=TEXT):
+    return JsonRecipeParser() if fmt == JSON else RecipeParser()
+
+
+def iter_recipes(chunks, fmt=TEXT):
+    parser = recipe_parser(fmt)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def parse_recipes(recipes_text: str, fmt=TEXT):
+    if fmt == TEXT:
+        # Whole text: one split is cheaper than the streaming parser's bookkeeping.
+        # Split before any stripping, as RecipeParser does, so that a trailing
+        # separator ends the last block in both.
+        return [r for r in map(parse_block, recipes_text.split(SEPARATOR)) if r]
+    return list(iter_recipes([recipes_text.strip()], fmt))
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow is optional; without it only exact cache hits are possible
+    Image = None
+
+BITS = 64
+
+
+def dhash(source):
+    """64-bit difference hash of an image path or upload, or None if it cannot be read.
+
+    The photo is decoded at a reduced size (JPEG draft mode), turned upright
+    and shrunk to 9x8 grey pixels; each bit says whether a pixel is brighter
+    than its right neighbour. Retakes of the same scene land a few bits apart.
+    """
+    if Image is None:
+        return None
+    f = open(source, "rb") if isinstance(source, str) else source
+    try:
+        f.seek(0)
+        with Image.open(f) as im:
+            im.draft("L", (64, 64))
+            im = ImageOps.exif_transpose(im.convert("L"))
+            pixels = list(im.resize((9, 8), Image.BILINEAR).getdata())
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    finally:
+        if isinstance(source, str):
+            f.close()
+        else:
+            f.seek(0)
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def split_blocks(bits, blocks):
+    """(shift, mask) pairs cutting a ``bits``-wide hash into ``blocks`` nearly equal parts."""
+    out, start = [], 0
+    for i in range(blocks):
+        width = bits // blocks + (1 if i < bits % blocks else 0)
+        out.append((start, (1 << width) - 1))
+        start += width
+    return out
+
+
+class NearDuplicateIndex:
+    """Multi-index hashing over recent photo hashes.
+
+    Each hash is cut into ``max_distance + 1`` blocks and filed under every
+    block value. By the pigeonhole principle two hashes within
+    ``max_distance`` bits agree exactly on at least one block, so a lookup
+    only checks the few entries sharing a block instead of scanning them
+    all. Entries are scoped by a context key (preferences, products, ...),
+    expire after ``ttl`` seconds and the oldest are dropped past
+    ``max_entries``.
+    """
+
+    def __init__(self, max_distance, max_entries, ttl):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.blocks = split_blocks(BITS, max_distance + 1)
+        self._entries = OrderedDict()  # (context, hash) -> (value, added)
+        self._tables = [{} for _ in self.blocks]  # (context, block value) -> set of hashes
+        self._lock = threading.Lock()
+        self.counters = {"lookups": 0, "hits": 0, "adds": 0, "evictions": 0, "candidates": 0, "distance_sum": 0}
+
+    def _keys(self, context, value):
+        return [(context, (value >> shift) & mask) for shift, mask in self.blocks]
+
+    def _drop(self, entry_key):
+        context, value = entry_key
+        del self._entries[entry_key]
+        for table, key in zip(self._tables, self._keys(context, value)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[key]
+
+    def _expire(self, now):
+        while self._entries:
+            entry_key, (_, added) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - added <= self.ttl:
+                break
+            self._drop(entry_key)
+            self.counters["evictions"] += 1
+
+    def add(self, value, context, payload):
+        now = time.time()
+        with self._lock:
+            entry_key = (context, value)
+            if entry_key in self._entries:
+                self._drop(entry_key)
+            self._entries[entry_key] = (payload, now)
+            for table, key in zip(self._tables, self._keys(context, value)):
+                table.setdefault(key, set()).add(value)
+            self.counters["adds"] += 1
+            self._expire(now)
+
+    def find(self, value, context):
+        """Payload of the closest recent hash within ``max_distance``, or None."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self.counters["lookups"] += 1
+            best, best_distance = None, self.max_distance + 1
+            seen = set()
+            for table, key in zip(self._tables, self._keys(context, value)):
+                for candidate in table.get(key, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = hamming(value, candidate)
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+            self.counters["candidates"] += len(seen)
+            if best is None:
+                return None
+            self.counters["hits"] += 1
+            self.counters["distance_sum"] += best_distance
+            return self._entries[(context, best)][0]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+        lookups = stats["lookups"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["avg_candidates"] = stats["candidates"] / lookups if lookups else 0.0
+        stats["avg_hit_distance"] = stats["distance_sum"] / stats["hits"] if stats["hits"] else 0.0
+        return stats
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def near_duplicates():
+    """Process-wide index, or None when disabled or Pillow is missing."""
+    global _index
+    if Image is None or not settings.NEAR_DUPLICATE_CACHE:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex(
+                    max_distance=settings.NEAR_DUPLICATE_DISTANCE,
+                    max_entries=settings.NEAR_DUPLICATE_MAX_ENTRIES,
+                    ttl=settings.NEAR_DUPLICATE_TTL,
+                )
+    return _index
@@ -1,11 +1,24 @@
-def recipes_prompt(preferences, products):
-    if not isinstance(preferences, str):
-        preferences = f"""Diets: {", ".join(preferences['diets'])}. Cooking experience: {preferences['experience']}. Favourite cuisines: {", ".join(preferences['favourite'])}. Meal preparation time: {", ".join(preferences['time'])}
-"""
+import json
+import logging
+from collections import namedtuple
 
-    return f"""Give me recipes of 3-4 pretty popular dishes i can make with these products{':'+', '.join(products) if products else ''} (AND salt, oil, water). Use only products I have, no other products. 
+from django.conf import settings
+
+from .cache import normalize_preferences
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# The instructions never change between requests and go first (as the
+# Responses API ``instructions``), so the upstream prompt cache can reuse
+# them; everything request-specific goes into the short suffix built by
+# recipes_suffix. Bump the version whenever the wording changes, it is
+# logged with every call's token usage.
+PROMPT_VERSIONS = {"text": "text-2", "json": "json-2"}
+
+TEXT_INSTRUCTIONS = """Give me recipes of pretty popular dishes i can make with the products listed at the end (AND salt, oil, water). Use only products I have, no other products. Give as many dishes as asked at the end (3-4 if not given).
 Make sure you give exactly all products (if image is provided), check all text on packages (it can be in any language)
-Preferences: {preferences}. Use them strictly when generating dishes (if nothing is provided omit it).
+Use the preferences listed at the end strictly when generating dishes (if nothing is provided omit them).
 Every recipe should be in this format:
 Dish name
 List of products used and measurements in brackets (separated by coma, if measurements are not exact like 50g of tomatoes use the amount of the product, for example: Tomatoes (1 piece))
@@ -52,4 +65,132 @@ Try to generate popular dishes in first order.
 Dont use any text before and after all recipes. Dont write titles like "Dish name", "Dish recipe", only type the name itself without anything.
 The recipe should be detailed (everything should be by steps like in example). Try to make steps as detailed as possible. If it written about something that takes time write how much time it takes. If there are some concrete measurements in the step include them into the text. Every step should come with a new line (new line for a word step and number, then a new line with exact step and then a new line after all), exactly like its given in the example.
 For energy value provide only number (without any text like "kcal" or "g")
-As an answer provide all recipes in the given format, without any symbols before first dish's name and without any symbols after last dish recipe."""
\ No newline at end of file
+As an answer provide all recipes in the given format, without any symbols before first dish's name and without any symbols after last dish recipe."""
+
+# Compact structured-output mode: the layout lives in RECIPES_SCHEMA, so the
+# prompt only carries the instructions. Keys are short on purpose, every
+# key is repeated once per dish in the output.
+RECIPE_FIELDS = {
+    "n": {"type": "string", "description": "dish name"},
+    "p": {"type": "array", "items": {"type": "string"}, "description": "products used, amount in brackets: Tomatoes (1 piece)"},
+    "s": {"type": "array", "items": {"type": "string"}, "description": "detailed steps with times and amounts"},
+    "t": {"type": "integer", "description": "minutes"},
+    "d": {"type": "integer", "description": "difficulty 1-5"},
+    "e": {"type": "number", "description": "kcal"},
+    "pr": {"type": "number", "description": "proteins g"},
+    "f": {"type": "number", "description": "fats g"},
+    "c": {"type": "number", "description": "carbs g"},
+    "x": {"type": "array", "items": {"type": "string"}, "description": "all products on the image, amount in brackets"},
+}
+
+RECIPES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "r": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": RECIPE_FIELDS,
+                "required": list(RECIPE_FIELDS),
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["r"],
+    "additionalProperties": False,
+}
+
+JSON_INSTRUCTIONS = """Recipes of popular dishes, most popular first, using only the products listed at the end (and salt, oil, water); as many as asked (3-4 if not given).
+If an image is provided, list every product on it, read all package text (any language).
+Follow the preferences listed at the end strictly (ignore if none)."""
+
+PREFERENCE_KEYS = {"diets": "diets", "experience": "experience", "favourite": "cuisines", "time": "time"}
+
+
+def canonical_preferences(preferences):
+    """One compact, order-independent line: 'diets=keto,vegan; experience=beginner; time=15-30 minutes'.
+
+    Accepts the dict the app sends, its JSON string, or free text; empty
+    values and 'none' are dropped so equivalent requests produce the same
+    suffix.
+    """
+    prefs = normalize_preferences(preferences)
+    if not isinstance(prefs, dict):
+        text = " ".join(str(prefs or "").split())
+        return "" if text in ("", "none", "null") else text
+    parts = []
+    for key in sorted(prefs):
+        value = prefs[key]
+        values = value if isinstance(value, list) else [value]
+        values = [str(v) for v in values if v not in (None, "") and str(v) != "none"]
+        if values:
+            parts.append(f"{PREFERENCE_KEYS.get(key, key)}={','.join(values)}")
+    return "; ".join(parts)
+
+
+def recipes_suffix(preferences, products, dishes=None):
+    """Request-specific tail of the prompt; ``products`` and ``preferences`` are already canonical."""
+    lines = [f"Dishes: {dishes or '3-4'}"]
+    lines.append(f"Products: {', '.join(products) if products else 'only those on the image'}")
+    lines.append(f"Preferences: {preferences or 'none'}")
+    return "\n".join(lines)
+
+
+def instructions_for(fmt):
+    return JSON_INSTRUCTIONS if fmt == "json" else TEXT_INSTRUCTIONS
+
+
+def product_list(products):
+    """Products as given (JSON list, list or comma-separated text), stripped and deduplicated, in order."""
+    if isinstance(products, str):
+        try:
+            products = json.loads(products)
+        except ValueError:
+            products = products.split(",")
+    if not isinstance(products, (list, tuple)):
+        return []
+    seen = {}
+    for p in products:
+        name = " ".join(str(p).split())
+        if name and name.lower() not in seen:
+            seen[name.lower()] = name
+    return list(seen.values())
+
+
+Prompt = namedtuple("Prompt", "instructions text version tokens truncated")
+
+
+def build_prompt(fmt, preferences, products, dishes=None):
+    """Static instructions plus a suffix that fits PROMPT_MAX_INPUT_TOKENS.
+
+    Truncation rules, in order: product names are clipped to
+    PROMPT_MAX_PRODUCT_CHARS, only the first PROMPT_MAX_PRODUCTS products
+    are kept, preferences are clipped to PROMPT_MAX_PREFERENCES_CHARS,
+    then products are dropped from the end until the text fits. The
+    photo is not counted; its cost depends on the upstream resize.
+    """
+    products = product_list(products)
+    clipped = [p[:settings.PROMPT_MAX_PRODUCT_CHARS].strip() for p in products[:settings.PROMPT_MAX_PRODUCTS]]
+    truncated = clipped != products
+    prefs = canonical_preferences(preferences)
+    if len(prefs) > settings.PROMPT_MAX_PREFERENCES_CHARS:
+        prefs, truncated = prefs[:settings.PROMPT_MAX_PREFERENCES_CHARS], True
+    # Sorted so the same pantry in any order gives the same suffix.
+    products = sorted(clipped, key=str.lower)
+
+    instructions = instructions_for(fmt)
+    fixed = count_tokens(instructions)
+    text = recipes_suffix(prefs, products, dishes)
+    tokens = fixed + count_tokens(text)
+    while tokens > settings.PROMPT_MAX_INPUT_TOKENS and products:
+        products.pop()
+        truncated = True
+        text = recipes_suffix(prefs, products, dishes)
+        tokens = fixed + count_tokens(text)
+
+    if tokens > settings.PROMPT_MAX_INPUT_TOKENS:
+        logger.error("Recipe prompt is %d tokens, over PROMPT_MAX_INPUT_TOKENS=%d even without products",
+                     tokens, settings.PROMPT_MAX_INPUT_TOKENS)
+    elif truncated:
+        logger.warning("Recipe prompt truncated to %d products, %d tokens", len(products), tokens)
+    return Prompt(instructions, text, PROMPT_VERSIONS[fmt], tokens, truncated)
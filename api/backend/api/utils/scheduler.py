@@ -0,0 +1,294 @@
+import asyncio
+import math
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+
+import openai
+from django.conf import settings
+
+
+def deadline_after(timeout):
+    """``time.monotonic()`` deadline ``timeout`` seconds from now; None without a numeric timeout."""
+    if isinstance(timeout, (int, float)) and not isinstance(timeout, bool):
+        return time.monotonic() + timeout
+    return None
+
+
+def until(deadline, wait):
+    """``wait`` cut short so that it ends by ``deadline``."""
+    if deadline is None:
+        return wait
+    return max(0.0, min(wait, deadline - time.monotonic()))
+
+
+def clamp_timeout(kwargs, deadline):
+    """``kwargs`` with ``timeout`` at most the time left; raises FuturesTimeout once none is."""
+    if deadline is None:
+        return kwargs
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise FuturesTimeout("Upstream deadline exceeded.")
+    timeout = kwargs.get("timeout")
+    if isinstance(timeout, (int, float)) and not isinstance(timeout, bool):
+        left = min(left, timeout)
+    return {**kwargs, "timeout": left}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; ``reserve`` returns how long to wait for a token."""
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class Lane:
+    """Per-model-kind limits and stats (``text`` or ``image``)."""
+
+    def __init__(self, name, per_minute, burst, hedge):
+        self.name = name
+        self.bucket = TokenBucket(per_minute, burst)
+        self.hedge = hedge
+        self.latencies = deque(maxlen=200)
+        self.lock = threading.Lock()
+        self.counters = {
+            "calls": 0, "retries": 0, "errors": 0, "hedges": 0, "hedge_wins": 0,
+            "queue_wait_sum": 0.0, "queue_wait_max": 0.0,
+        }
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def record(self, queue_wait, latency):
+        with self.lock:
+            self.counters["calls"] += 1
+            self.counters["queue_wait_sum"] += queue_wait
+            self.counters["queue_wait_max"] = max(self.counters["queue_wait_max"], queue_wait)
+            self.latencies.append(latency)
+
+    def p95(self, min_samples=1):
+        with self.lock:
+            if len(self.latencies) < min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)]
+
+    def hedge_delay(self, min_samples):
+        """p95 of recent latencies, or None until there is enough data."""
+        return self.p95(min_samples) if self.hedge else None
+
+
+class UpstreamScheduler:
+    """Single choke point for every OpenAI call made by the API.
+
+    Each call is rate limited by its lane's token bucket, then waits for
+    one of ``max_concurrency`` global slots. 429, 5xx and connection
+    errors are retried with full-jitter exponential backoff (honouring
+    ``Retry-After``). Lanes with hedging on fire a second request once a
+    call outlives the lane's p95 latency and keep whichever answers first.
+
+    ``deadline`` (a ``time.monotonic()`` value) bounds a whole call,
+    retries included: each attempt's timeout is clamped to what is left,
+    and a retry whose backoff would end past it is not made.
+    """
+
+    def __init__(self, lanes, max_concurrency, max_retries, backoff_base, backoff_max, hedge_min_samples=20):
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_min_samples = hedge_min_samples
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = weakref.WeakKeyDictionary()
+        self._hedge_pool = None
+        self._hedge_pool_lock = threading.Lock()
+
+    def retry_delay(self, exc, attempt, deadline=None):
+        if attempt >= self.max_retries:
+            return None
+        status = getattr(exc, "status_code", None)
+        # A timeout means the caller's own budget is spent, so it is final.
+        if isinstance(exc, openai.APITimeoutError):
+            return None
+        if not (isinstance(exc, openai.APIConnectionError) or status == 429 or (status or 0) >= 500):
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        response = getattr(exc, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            delay = max(delay, min(self.backoff_max, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    # -- sync path ---------------------------------------------------------
+
+    def call(self, kind, fn, *args, deadline=None, **kwargs):
+        lane = self.lanes[kind]
+        delay = lane.hedge_delay(self.hedge_min_samples)
+        if delay is None:
+            return self._with_retries(lane, fn, args, kwargs, deadline)
+        return self._hedged(lane, delay, fn, args, kwargs, deadline)
+
+    def _attempt(self, lane, fn, args, kwargs, deadline=None):
+        queued = time.monotonic()
+        time.sleep(until(deadline, lane.bucket.reserve()))
+        with self._slots:
+            started = time.monotonic()
+            result = fn(*args, **clamp_timeout(kwargs, deadline))
+            lane.record(started - queued, time.monotonic() - started)
+        return result
+
+    def _with_retries(self, lane, fn, args, kwargs, deadline=None):
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(lane, fn, args, kwargs, deadline)
+            except Exception as exc:
+                delay = self.retry_delay(exc, attempt, deadline)
+                if delay is None:
+                    lane.count("errors")
+                    raise
+                lane.count("retries")
+                time.sleep(delay)
+                attempt += 1
+
+    def _pool(self):
+        with self._hedge_pool_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency * 2, thread_name_prefix="upstream-hedge")
+            return self._hedge_pool
+
+    def _hedged(self, lane, delay, fn, args, kwargs, deadline=None):
+        primary = self._pool().submit(self._with_retries, lane, fn, args, kwargs, deadline)
+        try:
+            return primary.result(timeout=delay)
+        except FuturesTimeout:
+            pass
+
+        lane.count("hedges")
+        backup = self._pool().submit(self._with_retries, lane, fn, args, kwargs, deadline)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    if fut is backup:
+                        lane.count("hedge_wins")
+                    return fut.result()
+        return primary.result()
+
+    # -- async path --------------------------------------------------------
+
+    def _async_semaphore(self):
+        loop = asyncio.get_running_loop()
+        sem = self._async_slots.get(loop)
+        if sem is None:
+            sem = self._async_slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return sem
+
+    async def acall(self, kind, fn, *args, deadline=None, **kwargs):
+        lane = self.lanes[kind]
+        delay = lane.hedge_delay(self.hedge_min_samples)
+        if delay is None:
+            return await self._awith_retries(lane, fn, args, kwargs, deadline)
+
+        primary = asyncio.ensure_future(self._awith_retries(lane, fn, args, kwargs, deadline))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        lane.count("hedges")
+        backup = asyncio.ensure_future(self._awith_retries(lane, fn, args, kwargs, deadline))
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            lane.count("hedge_wins")
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _awith_retries(self, lane, fn, args, kwargs, deadline=None):
+        attempt = 0
+        while True:
+            queued = time.monotonic()
+            try:
+                await asyncio.sleep(until(deadline, lane.bucket.reserve()))
+                async with self._async_semaphore():
+                    started = time.monotonic()
+                    result = await fn(*args, **clamp_timeout(kwargs, deadline))
+                    lane.record(started - queued, time.monotonic() - started)
+                return result
+            except Exception as exc:
+                delay = self.retry_delay(exc, attempt, deadline)
+                if delay is None:
+                    lane.count("errors")
+                    raise
+                lane.count("retries")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def stats(self):
+        stats = {}
+        for name, lane in self.lanes.items():
+            with lane.lock:
+                lane_stats = dict(lane.counters)
+            calls = lane_stats["calls"]
+            lane_stats["queue_wait_avg"] = lane_stats["queue_wait_sum"] / calls if calls else 0.0
+            lane_stats["p95_latency"] = lane.p95()
+            stats[name] = lane_stats
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = UpstreamScheduler(
+                    lanes=[
+                        Lane("text", settings.UPSTREAM_TEXT_RPM, settings.UPSTREAM_TEXT_BURST,
+                             settings.UPSTREAM_HEDGE_TEXT),
+                        Lane("image", settings.UPSTREAM_IMAGE_RPM, settings.UPSTREAM_IMAGE_BURST,
+                             settings.UPSTREAM_HEDGE_IMAGE),
+                    ],
+                    max_concurrency=settings.UPSTREAM_MAX_CONCURRENCY,
+                    max_retries=settings.UPSTREAM_MAX_RETRIES,
+                    backoff_base=settings.UPSTREAM_BACKOFF_BASE,
+                    backoff_max=settings.UPSTREAM_BACKOFF_MAX,
+                )
+    return _scheduler
@@ -0,0 +1,106 @@
+import functools
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import storage
+
+# Full renders never change once written; previews are replaced in place.
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@functools.lru_cache(maxsize=4096)
+def content_etag(path, mtime_ns, size):
+    """Strong ETag from the file bytes; keyed on mtime and size so a rewrite gets a new one."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return quote_etag(h.hexdigest()[:32])
+
+
+def parse_range(header, size):
+    """``(start, end)`` inclusive for a single byte range, None to ignore it, or ValueError if unsatisfiable."""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        # Multiple ranges or another unit: serve the whole file instead.
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def read_range(path, start, end, block_size=1 << 16):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def offload(path):
+    """Empty response that tells the front server to send ``path`` itself."""
+    response = HttpResponse()
+    if settings.IMAGE_SENDFILE == "nginx":
+        relative = os.path.relpath(path, storage.IMAGES_DIR)
+        response["X-Accel-Redirect"] = settings.IMAGE_ACCEL_PREFIX.rstrip("/") + "/" + relative
+    else:
+        response["X-Sendfile"] = path
+    return response
+
+
+def file_response(request, path, stat, content_type, cache_control):
+    """Serve an image with validators, 304s, single byte ranges and optional sendfile."""
+    etag = content_etag(path, stat.st_mtime_ns, stat.st_size)
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        byte_range = None
+        if_range = request.headers.get("If-Range")
+        if not settings.IMAGE_SENDFILE and (not if_range or if_range == etag):
+            try:
+                byte_range = parse_range(request.headers.get("Range"), stat.st_size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{stat.st_size}"
+                return response
+
+        if settings.IMAGE_SENDFILE:
+            response = offload(path)
+        elif byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(read_range(path, start, end), status=206)
+            response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            response["Content-Length"] = str(end - start + 1)
+        else:
+            response = FileResponse(open(path, "rb"))
+        response["Content-Type"] = content_type
+        if not settings.IMAGE_SENDFILE:
+            # With sendfile the front server answers ranges itself.
+            response["Accept-Ranges"] = "bytes"
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,143 @@
+import asyncio
+import fcntl
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class SingleFlight:
+    """Collapse concurrent identical upstream calls into one.
+
+    Callers in the same process that ask for a key while a call for it is
+    running get that call's result (or its exception). Across processes
+    the leader also holds a lock-file lease; a process that has to wait
+    for someone else's lease runs ``recheck`` first, so it can pick up the
+    result the other worker already stored instead of calling upstream.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "shared": 0, "cross_process": 0}
+
+    def record(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def join(self, key):
+        """Return ``(future, leader)``; the leader must ``settle`` the future."""
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.counters["shared"] += 1
+                return fut, False
+            fut = Future()
+            fut.set_running_or_notify_cancel()
+            self._calls[key] = fut
+            return fut, True
+
+    def settle(self, key, fut, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is fut:
+                del self._calls[key]
+        if fut.done():
+            return
+        if error is None:
+            fut.set_result(result)
+        elif isinstance(error, Exception):
+            fut.set_exception(error)
+        else:
+            # KeyboardInterrupt, GeneratorExit from a dropped stream, ...:
+            # waiters get a CancelledError rather than the leader's signal.
+            fut.set_exception(CancelledError(f"{self.name} call for {key} was cancelled"))
+
+    def do(self, key, fn, recheck=None, timeout=None):
+        fut, leader = self.join(key)
+        if not leader:
+            return fut.result(timeout)
+
+        try:
+            with self.lease(key) as contended:
+                result = recheck() if contended and recheck else None
+                if result is not None:
+                    self.record("cross_process")
+                else:
+                    self.record("calls")
+                    result = fn()
+        except BaseException as exc:
+            self.settle(key, fut, error=exc)
+            raise
+        self.settle(key, fut, result=result)
+        return result
+
+    async def ado(self, key, coro_fn, timeout=None):
+        """Async ``do`` for the ASGI path; coalesces within the process only."""
+        fut, leader = self.join(key)
+        if not leader:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout)
+
+        try:
+            self.record("calls")
+            result = await coro_fn()
+        except BaseException as exc:
+            self.settle(key, fut, error=exc)
+            raise
+        self.settle(key, fut, result=result)
+        return result
+
+    @contextmanager
+    def lease(self, key):
+        """Hold an exclusive lock file for ``key``; yields True if we had to wait."""
+        lock_dir = os.path.join(settings.SINGLEFLIGHT_LOCK_DIR, self.name)
+        os.makedirs(lock_dir, exist_ok=True)
+        path = os.path.join(lock_dir, f"{key}.lock")
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_LEASE_TIMEOUT
+        contended = False
+
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                contended = True
+                if time.monotonic() > deadline:
+                    # A stuck holder must not block us forever; go upstream.
+                    yield contended
+                    return
+                time.sleep(0.05)
+                continue
+            # The previous holder unlinks the file before unlocking; if we
+            # locked an orphaned inode, start over on the current path.
+            try:
+                same = os.fstat(fd).st_ino == os.stat(path).st_ino
+            except FileNotFoundError:
+                same = False
+            if same:
+                break
+            os.close(fd)
+
+        try:
+            yield contended
+        finally:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self._calls)
+        stats["avoided"] = stats["shared"] + stats["cross_process"]
+        return stats
+
+
+recipes_flight = SingleFlight("recipes")
+photos_flight = SingleFlight("photos")
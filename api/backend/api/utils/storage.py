@@ -0,0 +1,172 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .cache import normalize_products
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+# Image tiers, best first: a cheap preview lands quickly and is replaced by
+# the full render under the same image id.
+FULL = "full"
+PREVIEW = "preview"
+TIERS = (FULL, PREVIEW)
+
+CONTENT_TYPE = "image/png"
+
+
+def dish_image_id(name, products):
+    """Content address of a dish photo: the same dish always maps to the same file."""
+    raw = json.dumps([" ".join(name.lower().split()), normalize_products(products)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def image_id_from_filename(filename):
+    return filename.rsplit(".", 1)[0] if "." in filename else filename
+
+
+def shard_dir(image_id):
+    """Two-level fan-out (``ab/cd/``) so no directory grows past a few hundred entries."""
+    digest = hashlib.sha256(image_id.encode("utf-8")).hexdigest()
+    return os.path.join(IMAGES_DIR, digest[:2], digest[2:4])
+
+
+def image_path(image_id, tier=FULL):
+    suffix = "" if tier == FULL else f".{tier}"
+    return os.path.join(shard_dir(image_id), f"{image_id}{suffix}.png")
+
+
+def variant_path(image_id, tier, width, fmt):
+    """Derived copy of a tier resized to ``width`` px and encoded as ``fmt``."""
+    suffix = "" if tier == FULL else f".{tier}"
+    return os.path.join(shard_dir(image_id), f"{image_id}{suffix}.w{width}.{fmt}")
+
+
+def remove_tier(image_id, tier):
+    """Delete a non-full tier together with every variant derived from it."""
+    for path in glob.glob(os.path.join(shard_dir(image_id), f"{glob.escape(image_id)}.{tier}.*")):
+        remove(path)
+
+
+def best_tier(image_id, tiers=TIERS):
+    for tier in tiers:
+        if os.path.exists(image_path(image_id, tier)):
+            return tier
+    return None
+
+
+def legacy_path(image_id, tier=FULL):
+    """Where the flat layout, before sharding, kept a tier."""
+    suffix = "" if tier == FULL else f".{tier}"
+    return os.path.join(IMAGES_DIR, f"{image_id}{suffix}.png")
+
+
+def adopt_legacy(image_id, tier):
+    """Move a flat-layout file into its shard; True if there was one.
+
+    Image URLs handed out before sharding keep working without waiting
+    for ``manage.py imagestore --compact``.
+    """
+    legacy = legacy_path(image_id, tier)
+    if not os.path.exists(legacy):
+        return False
+    path = image_path(image_id, tier)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.replace(legacy, path)
+    except FileNotFoundError:
+        pass  # another worker moved it first
+    return True
+
+
+def find_sharded(image_id, tiers):
+    for tier in tiers:
+        path = image_path(image_id, tier)
+        try:
+            return tier, path, os.stat(path)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def find_image(image_id, tiers=TIERS):
+    """``(tier, path, stat)`` of the best tier on disk, or None; one stat per tier.
+
+    On a miss the old flat layout is checked too, see ``adopt_legacy``.
+    """
+    found = find_sharded(image_id, tiers)
+    if found is None and any([adopt_legacy(image_id, tier) for tier in tiers]):
+        found = find_sharded(image_id, tiers)
+    return found
+
+
+def write_atomic(path, data):
+    """Write via a temp file and rename so readers never see a partial image."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        remove(tmp)
+        raise
+
+
+def touch(path, stat, interval):
+    """Bump the access time used for LRU eviction, at most once per ``interval`` seconds.
+
+    mtime is kept so the file's ETag does not change. Filesystems mounted
+    noatime/relatime would otherwise never tell us a hot image apart from
+    a cold one.
+    """
+    now = time.time()
+    if now - stat.st_atime < interval:
+        return
+    try:
+        os.utime(path, ns=(int(now * 1e9), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def marker_path(image_id, state):
+    return os.path.join(shard_dir(image_id), f"{image_id}.{state}")
+
+
+def set_state(image_id, state):
+    """Record the generation state of an image on disk so every worker sees it."""
+    os.makedirs(shard_dir(image_id), exist_ok=True)
+    for other in (PENDING, FAILED):
+        if other != state:
+            remove(marker_path(image_id, other))
+    if state != READY:
+        with open(marker_path(image_id, state), "w"):
+            pass
+
+
+def image_state(image_id, pending_ttl=None, tiers=TIERS):
+    if best_tier(image_id, tiers):
+        return READY
+    if os.path.exists(marker_path(image_id, FAILED)):
+        return FAILED
+    try:
+        started = os.path.getmtime(marker_path(image_id, PENDING))
+    except FileNotFoundError:
+        return None
+    if pending_ttl is not None and time.time() - started > pending_ttl:
+        return FAILED
+    return PENDING
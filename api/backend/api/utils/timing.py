@@ -0,0 +1,72 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from .metrics import STAGE_SECONDS
+
+_current = contextvars.ContextVar("timings", default=None)
+
+
+class Timings:
+    """Stage durations of one request; photo jobs it queued add theirs too.
+
+    Stages can repeat (one photo per dish), so each keeps a total and a
+    count. Thread-safe: photo workers record into the request's object.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> [seconds, count], in first-seen order
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """``Server-Timing`` header value; repeated stages report their sum and count."""
+        with self._lock:
+            stages = [(name, seconds, count) for name, (seconds, count) in self.stages.items()]
+        parts = []
+        for name, seconds, count in stages + [("total", self.elapsed(), 1)]:
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if count > 1:
+                part += f';desc="{count}x"'
+            parts.append(part)
+        return ", ".join(parts)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def use(timings):
+    """Make ``timings`` the current request's (or job's) timings inside the block."""
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def record(name, seconds, timings=None):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = timings or current()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
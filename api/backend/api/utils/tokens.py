@@ -0,0 +1,68 @@
+import logging
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; without it counts are estimated
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+ENCODING = "o200k_base"  # gpt-4o / gpt-4.1 family
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+_lock = threading.Lock()
+usage_totals = {}  # prompt version -> counters
+
+
+@lru_cache(maxsize=1)
+def encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(ENCODING)
+    except Exception:  # the BPE file is downloaded on first use and may be unavailable
+        logger.warning("tiktoken encoding %s unavailable, estimating token counts", ENCODING)
+        return None
+
+
+def count_tokens(text):
+    """Token count of ``text``: exact with tiktoken, otherwise a slight overestimate.
+
+    The estimate takes the larger of one token per 4 characters (English
+    prose) and one per word or punctuation mark (short words, numbers,
+    non-Latin scripts), which errs on the side of staying under budget.
+    """
+    enc = encoding()
+    if enc is not None:
+        return len(enc.encode(text))
+    return max(math.ceil(len(text) / 4), len(WORD_RE.findall(text)))
+
+
+def log_usage(usage, prompt, started):
+    """Log and accumulate one call's token usage under its prompt version."""
+    latency_ms = (time.monotonic() - started) * 1000
+    if usage is None:
+        logger.info("Recipes %s: no usage reported, %.0f ms", prompt.version, latency_ms)
+        return
+    details = getattr(usage, "input_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    logger.info("Recipes %s: %d input tokens (%d cached, %d estimated text), %d output tokens, %.0f ms",
+                prompt.version, usage.input_tokens, cached, prompt.tokens, usage.output_tokens, latency_ms)
+    with _lock:
+        totals = usage_totals.setdefault(prompt.version, {
+            "calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "latency_ms": 0.0})
+        totals["calls"] += 1
+        totals["input_tokens"] += usage.input_tokens
+        totals["cached_tokens"] += cached
+        totals["output_tokens"] += usage.output_tokens
+        totals["latency_ms"] += latency_ms
+
+
+def stats():
+    with _lock:
+        return {version: dict(totals) for version, totals in usage_totals.items()}
@@ -0,0 +1,122 @@
+import io
+import logging
+import mimetypes
+import os
+import threading
+
+from django.conf import settings
+
+from . import timing
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow is optional; without it uploads are sent unchanged
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+ENCODE_OPTIONS = {"jpeg": {"optimize": True, "progressive": True}, "webp": {"method": 4}}
+ORIENTATION = 0x0112
+
+_lock = threading.Lock()
+counters = {"images": 0, "reencoded": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def source_size(source, f):
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    size = getattr(source, "size", None)
+    if size is None:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+    return size
+
+
+def source_mime(source):
+    if isinstance(source, str):
+        return mimetypes.guess_type(source)[0] or "image/png"
+    return getattr(source, "content_type", None) or "image/png"
+
+
+def read_all(f):
+    f.seek(0)
+    return f.read()
+
+
+def record(size_in, size_out, reencoded):
+    with _lock:
+        counters["images"] += 1
+        counters["reencoded"] += int(reencoded)
+        counters["bytes_in"] += size_in
+        counters["bytes_out"] += size_out
+    # Totals are exported as dishes_uploads at /metrics; the per-upload line is for debugging.
+    if size_in:
+        logger.debug("Upload %s: %d -> %d bytes (%.0f%% saved)", "re-encoded" if reencoded else "sent as is",
+                    size_in, size_out, 100 * (size_in - size_out) / size_in)
+
+
+def shrink(f, max_edge, fmt, quality):
+    """Decode ``f`` at reduced size, apply EXIF rotation and encode; returns ``(bytes, rotated)``.
+
+    ``thumbnail`` lets the JPEG decoder scale by 1/2..1/8 while decoding, so
+    a 12 MP photo is never held at full resolution, and every later step
+    works in place on that single decoded copy.
+    """
+    with Image.open(f) as im:
+        rotated = im.getexif().get(ORIENTATION, 1) != 1
+        im.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        ImageOps.exif_transpose(im, in_place=True)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        buf = io.BytesIO()
+        im.save(buf, format=FORMATS[fmt][0], quality=quality, **ENCODE_OPTIONS[fmt])
+    return buf.getvalue(), rotated
+
+
+def prepare_upload(source):
+    """Bytes and mime type of an upload as it should be sent to the vision model.
+
+    ``source`` is a path or a file-like upload; it is rewound afterwards so
+    callers can read it again. The original is kept when re-encoding would
+    not make it smaller and it needs no rotation.
+    """
+    with timing.stage("upload_encode"):
+        return _prepare_upload(source)
+
+
+def _prepare_upload(source):
+    f = open(source, "rb") if isinstance(source, str) else source
+    try:
+        f.seek(0)
+        size_in = source_size(source, f)
+        if Image is None or not settings.UPLOAD_MAX_EDGE:
+            data = read_all(f)
+            record(size_in, len(data), False)
+            return data, source_mime(source)
+
+        fmt = settings.UPLOAD_FORMAT
+        try:
+            data, rotated = shrink(f, settings.UPLOAD_MAX_EDGE, fmt, settings.UPLOAD_QUALITY)
+        except (UnidentifiedImageError, OSError, ValueError):
+            # Let the model see whatever the client sent.
+            data, rotated = None, False
+
+        if data is None or (len(data) >= size_in and not rotated):
+            data = read_all(f)
+            record(size_in, len(data), False)
+            return data, source_mime(source)
+        record(size_in, len(data), True)
+        return data, FORMATS[fmt][1]
+    finally:
+        if isinstance(source, str):
+            f.close()
+        else:
+            f.seek(0)
+
+
+def stats():
+    with _lock:
+        stats = dict(counters)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    return stats
@@ -0,0 +1,166 @@
+import functools
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import storage
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is optional; without it only the original PNG is served
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "avif": "image/avif"}
+
+
+@functools.lru_cache(maxsize=None)
+def available_formats():
+    if Image is None:
+        return ("png",)
+    return ("png",) + tuple(fmt for fmt in ("webp", "avif") if features.check(fmt))
+
+
+def snap_width(width):
+    """Round a requested width up to a configured size so variants stay few; None is the original."""
+    for size in sorted(settings.IMAGE_VARIANT_WIDTHS):
+        if width <= size:
+            return size
+    return None
+
+
+def negotiate(accept):
+    for fmt in settings.IMAGE_ACCEPT_FORMATS:
+        if fmt in available_formats() and CONTENT_TYPES.get(fmt, "") in accept:
+            return fmt
+    return "png"
+
+
+def choose(width, fmt, accept):
+    """``(width, fmt)`` to serve for ``?w=&fmt=`` and Accept; ``(None, "png")`` is the original file."""
+    if width in (None, ""):
+        width = None
+    else:
+        try:
+            width = int(width)
+        except ValueError:
+            raise ValueError("w must be a number of pixels.")
+        if width <= 0:
+            raise ValueError("w must be positive.")
+        width = snap_width(width)
+
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in CONTENT_TYPES:
+            raise ValueError(f"fmt must be one of {', '.join(CONTENT_TYPES)}.")
+    else:
+        fmt = negotiate(accept)
+    if fmt not in available_formats():
+        fmt = "png"
+    return width, fmt
+
+
+def encode_options(fmt):
+    if fmt == "webp":
+        return {"quality": settings.IMAGE_WEBP_QUALITY, "method": 4}
+    if fmt == "avif":
+        return {"quality": settings.IMAGE_AVIF_QUALITY}
+    return {"optimize": True}
+
+
+def encode(src, dst, width, fmt, options):
+    """Resize and re-encode ``src`` into ``dst``; runs in the encoder processes."""
+    with Image.open(src) as im:
+        im.load()
+        if width and im.width > width:
+            im = im.resize((width, round(im.height * width / im.width)), Image.LANCZOS)
+        buf = io.BytesIO()
+        im.save(buf, format=fmt.upper(), **options)
+    storage.write_atomic(dst, buf.getvalue())
+    return dst
+
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+_inflight = {}
+
+
+def pool():
+    global _pool, _pool_pid
+    with _lock:
+        # Like the photo queue, never reuse a pool inherited through fork.
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def log_failure(fut):
+    global _pool
+    if fut.cancelled() or fut.exception() is None:
+        return
+    logger.error("Image variant failed: %s", fut.exception())
+    if isinstance(fut.exception(), BrokenProcessPool):
+        # A crashed encoder breaks the whole pool; start a fresh one next time.
+        with _lock:
+            _pool = None
+
+
+def render(image_id, tier, width, fmt):
+    """Future for the variant's path; encodes in the pool unless it is on disk or already running."""
+    dst = storage.variant_path(image_id, tier, width or "full", fmt)
+    with _lock:
+        fut = _inflight.get(dst)
+        if fut is not None:
+            return fut
+    if os.path.exists(dst):
+        fut = Future()
+        fut.set_result(dst)
+        return fut
+
+    src = storage.image_path(image_id, tier)
+    fut = pool().submit(encode, src, dst, width, fmt, encode_options(fmt))
+    with _lock:
+        fut = _inflight.setdefault(dst, fut)
+    fut.add_done_callback(lambda _: _inflight.pop(dst, None))
+    fut.add_done_callback(log_failure)
+    return fut
+
+
+def variant(image_id, tier, width, fmt, timeout=None):
+    """``(path, stat, content_type)`` of a variant, or None to fall back to the original."""
+    if Image is None or (width is None and fmt == "png"):
+        return None
+    try:
+        path = render(image_id, tier, width, fmt).result(timeout)
+        return path, os.stat(path), CONTENT_TYPES[fmt]
+    except Exception:
+        # Slow or failed encodes serve the original; a running encode still
+        # finishes and is picked up by the next request.
+        return None
+
+
+def prepare(image_id):
+    """Queue the configured eager variants of a freshly written full image."""
+    if Image is None:
+        return
+    for spec in settings.IMAGE_EAGER_VARIANTS:
+        width, _, fmt = spec.partition(":")
+        try:
+            width, fmt = choose(width, fmt, "")
+            if width is not None or fmt != "png":
+                render(image_id, storage.FULL, width, fmt)
+        except Exception:
+            # Variants are an optimisation; the photo job itself succeeded.
+            logger.exception("Could not queue image variant %s for %s", spec, image_id)
@@ -0,0 +1,126 @@
+import json
+import os
+from collections import namedtuple
+
+from django.db import connections
+
+from . import corpus, storage
+from .cache import recipe_cache, recipe_cache_key
+from .gpt import RECIPES_MODEL, cache_variant, get_photo, get_recipes
+from .jobs import photo_queue
+from .parser import parse_recipes
+
+# One distinct input. ``key`` is the recipe cache key get_dishes computes
+# for it, ``count`` how often it was seen in the input.
+Pantry = namedtuple("Pantry", "key products preferences count")
+
+
+def parse_line(line):
+    """``(products, preferences, count)`` of one input line, or None for blank lines and comments.
+
+    Lines are JSON objects (``{"products": [...], "preferences": {...},
+    "count": 12}``, the shape of a get-dishes request), JSON lists of
+    products, or comma-separated products.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    try:
+        value = json.loads(line)
+    except ValueError:
+        value = line.split(",")
+    if isinstance(value, dict):
+        return value.get("products") or [], value.get("preferences"), int(value.get("count") or 1)
+    if isinstance(value, list):
+        return [str(p).strip() for p in value if str(p).strip()], None, 1
+    return None
+
+
+def read_pantries(lines, presets=(None,), dishes=None, fmt="text"):
+    """Distinct inputs from ``lines``, most frequent first.
+
+    Lines without preferences are crossed with every preset (``None``
+    stands for no preferences). Inputs that get_dishes would treat as the
+    same request are merged and their counts added up.
+    """
+    merged = {}
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None or not parsed[0]:
+            continue
+        products, preferences, count = parsed
+        for prefs in ([preferences] if preferences is not None else presets):
+            prefs = "None" if prefs is None else prefs if isinstance(prefs, str) else json.dumps(prefs)
+            key = recipe_cache_key(None, prefs, products, RECIPES_MODEL, **cache_variant(dishes, fmt))
+            if key in merged:
+                merged[key] = merged[key]._replace(count=merged[key].count + count)
+            else:
+                merged[key] = Pantry(key, products, prefs, count)
+    return sorted(merged.values(), key=lambda p: -p.count)
+
+
+def dishes_of(text, dishes, fmt):
+    recipes = parse_recipes(text, fmt)[:dishes]
+    for recipe in recipes:
+        recipe["image_id"] = storage.dish_image_id(recipe["name"], recipe["products"])
+    return recipes
+
+
+def missing_photos(recipes):
+    return [r for r in recipes if not storage.best_tier(r["image_id"], (storage.FULL,))]
+
+
+def is_warm(pantry, dishes=None, fmt="text", photos=True):
+    """True when get_dishes and serve_image can answer ``pantry`` from local data."""
+    text = recipe_cache().get(pantry.key)
+    if text is None:
+        return False
+    return not photos or not missing_photos(dishes_of(text, dishes, fmt))
+
+
+def warm(pantry, dishes=None, fmt="text", quality="medium", photos=True):
+    """Generate what ``pantry`` is missing; returns ``(recipe calls, photos rendered)``.
+
+    Recipes go through get_recipes, so they land in the recipe cache (and
+    the corpus), photos through the photo queue into the image store.
+    Runs on a worker thread of the warmstore command.
+    """
+    try:
+        text = recipe_cache().get(pantry.key)
+        called = text is None
+        if called:
+            text = get_recipes(None, pantry.preferences, pantry.products, dishes=dishes, fmt=fmt)
+        recipes = dishes_of(text, dishes, fmt)
+        if called:
+            corpus.ingest(recipes)
+        missing = missing_photos(recipes) if photos else []
+        futures = [photo_queue().submit_progressive(r["image_id"], get_photo, r["name"], r["products"],
+                                                    r["recipe"], quality=quality)[1] for r in missing]
+        for fut in futures:
+            fut.result()
+        return int(called), len(missing)
+    finally:
+        connections.close_all()
+
+
+class Checkpoint:
+    """Keys finished by an interrupted warm run, so ``--resume`` does not look at them again."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = set(json.load(f).get("done", []))
+
+    def add(self, key):
+        self.done.add(key)
+        self.save()
+
+    def save(self):
+        if self.path:
+            storage.write_atomic(self.path, json.dumps({"done": sorted(self.done)}).encode())
+
+    def clear(self):
+        if self.path:
+            storage.remove(self.path)
@@ -1,136 +1,573 @@
 from django.shortcuts import render
-import os
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from rest_framework.permissions import AllowAny
 from rest_framework import status
-from rest_framework.decorators import api_view, parser_classes
-import mimetypes
-from django.http import FileResponse
-from .utils.gpt import get_recipes, get_photo
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import uuid
-
-def parse_recipes(recipes_text: str):
-    blocks = [b.strip() for b in recipes_text.strip().split("\n----------\n") if b.strip()]
-    results = []
-
-    for block in blocks:
-        lines = [l for l in block.splitlines() if l.strip()]
-        if len(lines) < 2 + 6:
-            if len(lines) >= 2:
-                name = lines[0].strip()
-                products_line = lines[1].strip()
-                products = [p.strip() for p in products_line.split(",") if p.strip()]
-                recipe_body = "\n".join(lines[2:]).strip()
-                results.append({
-                    "name": name,
-                    "products": products,
-                    "recipe": recipe_body,
-                    "time_min": None,
-                    "difficulty": None,
-                    "energy_kcal": None,
-                    "proteins_g": None,
-                    "fats_g": None,
-                    "carbs_g": None,
-                })
-            continue
-
-        name = lines[0].strip()
-        products_line = lines[1].strip()
-        products = [p.strip() for p in products_line.split(",") if p.strip()]
-
-        tail = lines[-6:]
-        recipe_body_lines = lines[2:-6]
-        recipe_body = "\n".join(recipe_body_lines).strip()
-
-        def to_num(s, as_int=False):
-            s = s.strip()
-            s = s.replace(",", ".")
-            try:
-                return int(float(s)) if as_int else float(s)
-            except ValueError:
-                return None
-
-        time_min = to_num(tail[0], as_int=True)
-        difficulty = to_num(tail[1], as_int=True)
-        energy_kcal = to_num(tail[2], as_int=False)
-        proteins_g = to_num(tail[3], as_int=False)
-        fats_g = to_num(tail[4], as_int=False)
-        carbs_g = to_num(tail[5], as_int=False)
-
-        products_line = lines[-1].strip()
-        products_exist = [p.strip() for p in products_line.split(",") if p.strip()]
-        print(products_exist)
-
-        results.append({
-            "name": name,
-            "products": products,
-            "recipe": recipe_body,
-            "time_min": time_min,
-            "difficulty": difficulty,
-            "energy_kcal": energy_kcal,
-            "proteins_g": proteins_g,
-            "fats_g": fats_g,
-            "carbs_g": carbs_g,
-            "products_exist": products_exist,
-        })
-
-    return results
-    
+from rest_framework.decorators import api_view, parser_classes, renderer_classes
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.utils.cache import patch_vary_headers
+from asgiref.sync import sync_to_async
+from .utils.gpt import RECIPES_MODEL, cache_variant, get_recipes, get_photo, stream_recipes, aget_recipes, aget_photo, recipes_format
+from .utils.parser import parse_recipes, recipe_parser
+from .utils.jobs import photo_queue, submit_progressive_async
+from .renderers import FastJSONRenderer, dumps
+from .utils import corpus, dishes, metrics, serving, storage, timing, tokens, uploads, variants
+from .utils.cache import recipe_cache, recipe_cache_key
+from .utils.phash import near_duplicates
+from .utils.scheduler import scheduler
+from .utils.singleflight import photos_flight, recipes_flight
+from .utils.deadline import Budget, parse_deadline_ms, plan_for
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait, TimeoutError as FuturesTimeout
+from django.conf import settings
+from django.db import connections
+from openai import APIConnectionError, NOT_GIVEN
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+def wants_stream(request):
+    # Works for both DRF requests and the plain Django request of the async view
+    query = getattr(request, "query_params", request.GET)
+    data = getattr(request, "data", request.POST)
+    flag = query.get("stream") or data.get("stream")
+    if flag:
+        return str(flag).lower() in ("1", "true", "yes")
+    return "application/x-ndjson" in request.headers.get("Accept", "")
+
+def ndjson(event):
+    return dumps(event) + b"\n"
+
+def photo_args(recipe):
+    image_id = storage.dish_image_id(recipe['name'], recipe['products'])
+    recipe['image_id'] = image_id
+    return image_id, (recipe['name'], recipe['products'], recipe['recipe'])
+
+def queue_photo(recipe, quality="medium"):
+    """Queue the dish photo; returns (first, full) futures, see PhotoQueue.submit_progressive."""
+    image_id, args = photo_args(recipe)
+    return photo_queue().submit_progressive(image_id, get_photo, *args, quality=quality)
+
+def request_plan(request):
+    """Read ``deadline_ms`` and ``recipes_format``; returns the request's (budget, plan, format), raises ValueError."""
+    query = getattr(request, "query_params", request.GET)
+    data = getattr(request, "data", request.POST)
+    deadline_ms = parse_deadline_ms(query.get("deadline_ms") or data.get("deadline_ms"))
+    fmt = recipes_format(query.get("recipes_format") or data.get("recipes_format"))
+    return Budget(deadline_ms), plan_for(deadline_ms), fmt
+
+# compact=1 returns these; the rest of a dish is fetched from /api/dishes/<image_id>/
+SUMMARY_FIELDS = ("name", "time_min", "difficulty", "energy_kcal", "proteins_g", "fats_g", "carbs_g",
+                  "image_id", "image_status")
+DISH_FIELDS = SUMMARY_FIELDS + ("products", "recipe", "products_exist")
+
+def dish_fields(request):
+    """Dish fields asked for with ``fields=a,b`` or ``compact=1``, in that order; None for whole dishes.
+
+    ``image_id`` is always included, it is what the rest is fetched by.
+    Raises ValueError for unknown fields.
+    """
+    query = getattr(request, "query_params", request.GET)
+    data = getattr(request, "data", request.POST)
+    if (query.get("compact") or data.get("compact")) in ("1", "true"):
+        return SUMMARY_FIELDS
+    raw = query.get("fields") or data.get("fields")
+    if not raw:
+        return None
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = sorted(set(fields) - set(DISH_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown dish fields: {', '.join(unknown)}.")
+    return tuple(dict.fromkeys(fields + ["image_id"]))
+
+def project(recipes, fields):
+    """``recipes`` cut down to ``fields``; the full dishes are kept for /api/dishes/<image_id>/."""
+    if fields is None:
+        return recipes
+    dishes.remember(recipes)
+    return [{f: r[f] for f in fields if f in r} for r in recipes]
+
+def upstream_timeout(budget):
+    remaining = budget.remaining()
+    return NOT_GIVEN if remaining is None else remaining
+
+# Upstream failures answered as a missed deadline. APITimeoutError is an
+# APIConnectionError, and so is what httpx raises for a spent timeout.
+DEADLINE_ERRORS = (APIConnectionError, FuturesTimeout, asyncio.TimeoutError)
+DEADLINE_EXCEEDED = "Deadline exceeded before recipes were ready."
+
+def image_status(fut):
+    if fut is None:
+        return "skipped"
+    if not fut.done():
+        return "pending"
+    if fut.cancelled() or fut.exception() is not None:
+        return "failed"
+    return "ready"
+
+def parsed_batches(chunks, fmt="text"):
+    """Recipes completed by each streamed chunk (often none), then the rest."""
+    parser = recipe_parser(fmt)
+    for chunk in chunks:
+        yield parser.feed(chunk)
+    yield parser.close()
+
+def stream_dishes(batches, quality="medium", source="model", fields=None, budget=None, images=True):
+    # batches: lists of parsed recipes as they become available.
+    # future -> (image_id, event type); the first image of a dish is reported
+    # as image_ready, a later full render as image_upgraded.
+    futures = {}
+
+    def finished_images(wait=False):
+        done = [f for f in futures if f.done()]
+        if wait:
+            done = as_completed(futures, timeout=budget and budget.remaining())
+        for fut in done:
+            image_id, kind = futures.pop(fut)
+            if fut.exception() is None:
+                yield ndjson({"type": kind, "image_id": image_id})
+            elif kind == "image_ready":
+                yield ndjson({"type": "image_failed", "image_id": image_id})
+
+    def submit(recipe):
+        if not images:
+            photo_args(recipe)
+            return ndjson({"type": "dish", "dish": project([recipe], fields)[0]})
+        first, full = queue_photo(recipe, quality)
+        futures[first] = (recipe['image_id'], "image_ready")
+        if full is not first:
+            futures[full] = (recipe['image_id'], "image_upgraded")
+        return ndjson({"type": "dish", "dish": project([recipe], fields)[0]})
+
+    recipes = []
+    try:
+        for batch in batches:
+            for recipe in batch:
+                recipes.append(recipe)
+                yield submit(recipe)
+            yield from finished_images()
+    except DEADLINE_ERRORS:
+        yield ndjson({"type": "error", "error": "Deadline exceeded before all recipes were ready."})
+    if source == "model":
+        corpus.ingest(recipes)
+
+    # Out of budget, the photos keep rendering in the queue and
+    # serve_image finds them later, as in the batch endpoint.
+    try:
+        yield from finished_images(wait=True)
+    except FuturesTimeout:
+        for image_id, kind in futures.values():
+            if kind == "image_ready":
+                yield ndjson({"type": "image_pending", "image_id": image_id})
+    yield ndjson({"type": "done", "source": source})
+
+def dish_events(image, preferences, products, known, plan, fmt, budget, fields=None):
+    """NDJSON events of get-dishes with ``stream=1``; the upstream call starts before the first event."""
+    options = dict(quality=plan["quality"], fields=fields, budget=budget, images=plan["images"])
+    if known is not None:
+        return stream_dishes([known], source="corpus", **options)
+    chunks = stream_recipes(image, preferences, products, dishes=plan["dishes"], fmt=fmt,
+                            timeout=upstream_timeout(budget))
+    return stream_dishes(parsed_batches(chunks, fmt), **options)
+
+async def aiterate(events):
+    """``events`` as an async iterator, each item pulled on a worker thread.
+
+    ASGI buffers a synchronous streaming body whole before sending it, so
+    under ASGI the events have to be handed over one by one.
+    """
+    pull = sync_to_async(next, thread_sensitive=False)
+    end = object()
+    try:
+        while (event := await pull(events, end)) is not end:
+            yield event
+    finally:
+        if hasattr(events, "close"):
+            await sync_to_async(events.close, thread_sensitive=False)()
+
+def streaming_response(request, events):
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        events = aiterate(events)
+    response = StreamingHttpResponse(events, content_type="application/x-ndjson")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 @api_view(["POST"])
 @parser_classes([MultiPartParser, FormParser])
+@renderer_classes([FastJSONRenderer])
 def get_dishes(request):
-    image = request.FILES.get("image")
-    preferences = request.data.get("preferences", "None")
-    products = request.data.get("products", [])
+    with timing.stage("parse"):
+        image = request.FILES.get("image")
+        preferences = request.data.get("preferences", "None")
+        products = request.data.get("products", [])
 
     if not image and not products:
         return Response({"error": "No image or products provided."}, status=status.HTTP_400_BAD_REQUEST)
 
-    recipes = get_recipes(image, preferences, products)
-    recipes = parse_recipes(recipes)
+    try:
+        budget, plan, fmt = request_plan(request)
+        fields = dish_fields(request)
+    except ValueError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Products-only requests are answered from stored recipes when enough match.
+    with timing.stage("corpus"):
+        known = None if image else corpus.lookup(products, preferences, plan["dishes"])
 
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    images_dir = os.path.join(current_dir, 'images')
-    os.makedirs(images_dir, exist_ok=True)
+    # A budget already spent on parsing would reach upstream as timeout=0.
+    if known is None and budget.spent():
+        return Response({"error": DEADLINE_EXCEEDED}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+    if wants_stream(request):
+        try:
+            events = dish_events(image, preferences, products, known, plan, fmt, budget, fields)
+        except DEADLINE_ERRORS:
+            return Response({"error": DEADLINE_EXCEEDED}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        return streaming_response(request, events)
+
+    if known is not None:
+        recipes = known
+    else:
+        try:
+            with timing.stage("recipes"):
+                recipes = get_recipes(image, preferences, products, dishes=plan["dishes"],
+                                      timeout=upstream_timeout(budget), fmt=fmt)
+        except DEADLINE_ERRORS:
+            return Response({"error": DEADLINE_EXCEEDED}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        with timing.stage("parse_recipes"):
+            recipes = parse_recipes(recipes, fmt)[:plan["dishes"]]
 
     futures = []
-    with ThreadPoolExecutor(max_workers=min(8, max(1, len(recipes)))) as executor:
-        for recipe in recipes:
-            image_id = str(uuid.uuid4())
-            download_path = os.path.join(images_dir, f"{image_id}.png")
-            recipe['image_id'] = image_id
+    for recipe in recipes:
+        if plan["images"]:
+            first, _ = queue_photo(recipe, plan["quality"])
+            futures.append(first)
+        else:
+            photo_args(recipe)
+            futures.append(None)
 
-            futures.append(
-                executor.submit(
-                    get_photo,
-                    recipe['name'],
-                    recipe['products'],
-                    recipe['recipe'],
-                    download_path,
-                )
-            )
+    if known is None:
+        with timing.stage("corpus_ingest"):
+            corpus.ingest(recipes)
 
-        for fut in as_completed(futures):
-            _ = fut.result()
+    # With a budget, give the photos whatever time is left; anything still
+    # running keeps going in the queue and serve_image will find it later.
+    running = [f for f in futures if f is not None]
+    if running and budget.remaining():
+        with timing.stage("photos_wait"):
+            wait(running, timeout=budget.remaining())
 
+    for recipe, fut in zip(recipes, futures):
+        recipe['image_status'] = image_status(fut)
 
-    return Response({"status": "ok", "dishes": recipes}, status=status.HTTP_200_OK)
+    return Response({"status": "ok", "source": "model" if known is None else "corpus",
+                     "dishes": project(recipes, fields)}, status=status.HTTP_200_OK)
     
+@csrf_exempt
+@require_POST
+async def get_dishes_async(request):
+    """ASGI variant of get_dishes: same contract, no thread per request or photo."""
+    with timing.stage("parse"):
+        image = request.FILES.get("image")
+        preferences = request.POST.get("preferences", "None")
+        products = request.POST.get("products", [])
+
+    if not image and not products:
+        return JsonResponse({"error": "No image or products provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        budget, plan, fmt = request_plan(request)
+        fields = dish_fields(request)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    with timing.stage("corpus"):
+        known = None if image else await sync_to_async(corpus.lookup)(products, preferences, plan["dishes"])
+
+    if known is None and budget.spent():
+        return JsonResponse({"error": DEADLINE_EXCEEDED}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+    if wants_stream(request):
+        try:
+            events = await sync_to_async(dish_events, thread_sensitive=False)(
+                image, preferences, products, known, plan, fmt, budget, fields)
+        except DEADLINE_ERRORS:
+            return JsonResponse({"error": DEADLINE_EXCEEDED}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        return streaming_response(request, events)
+
+    if known is not None:
+        recipes = known
+    else:
+        try:
+            with timing.stage("recipes"):
+                recipes = await aget_recipes(image, preferences, products, dishes=plan["dishes"],
+                                             timeout=upstream_timeout(budget), fmt=fmt)
+        except DEADLINE_ERRORS:
+            return JsonResponse({"error": DEADLINE_EXCEEDED}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        with timing.stage("parse_recipes"):
+            recipes = parse_recipes(recipes, fmt)[:plan["dishes"]]
+        with timing.stage("corpus_ingest"):
+            await sync_to_async(corpus.ingest)(recipes)
+
+    tasks = []
+    for recipe in recipes:
+        image_id, args = photo_args(recipe)
+        if plan["images"]:
+            first, _ = submit_progressive_async(image_id, aget_photo, *args, quality=plan["quality"])
+            tasks.append(first)
+        else:
+            tasks.append(None)
+
+    running = [t for t in tasks if t is not None]
+    if running and budget.remaining():
+        # asyncio.wait never cancels; late photos finish in the background.
+        with timing.stage("photos_wait"):
+            await asyncio.wait(running, timeout=budget.remaining())
+
+    for recipe, task in zip(recipes, tasks):
+        recipe['image_status'] = image_status(task)
+
+    if fields is not None:
+        recipes = await sync_to_async(project)(recipes, fields)
+    with timing.stage("serialize"):
+        body = dumps({"status": "ok", "source": "model" if known is None else "corpus", "dishes": recipes})
+    return HttpResponse(body, content_type="application/json", status=status.HTTP_200_OK)
+
+class BatchItemError(ValueError):
+    pass
+
+def batch_items(request):
+    """Items of a batch request as a list of dicts; raises ValueError if the batch itself is malformed."""
+    items = request.data.get("items")
+    if isinstance(items, str):
+        try:
+            items = json.loads(items)
+        except ValueError:
+            raise ValueError("items must be a JSON list.")
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list.")
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise ValueError(f"At most {settings.BATCH_MAX_ITEMS} items per batch.")
+    return items
+
+def batch_input(request, item, index):
+    """``(id, image, preferences, products)`` of one item; raises BatchItemError with the item's id."""
+    if not isinstance(item, dict):
+        raise BatchItemError(str(index), "Each item must be an object.")
+    item_id = str(item.get("id", index))
+    image = None
+    if item.get("image"):
+        image = request.FILES.get(str(item["image"]))
+        if image is None:
+            raise BatchItemError(item_id, f"No uploaded file named {item['image']!r}.")
+    products = item.get("products") or []
+    if not isinstance(products, (list, str)):
+        raise BatchItemError(item_id, "products must be a list.")
+    if not image and not products:
+        raise BatchItemError(item_id, "No image or products provided.")
+    preferences = item.get("preferences") or "None"
+    if not isinstance(preferences, str):
+        preferences = json.dumps(preferences)
+    return item_id, image, preferences, json.dumps(products) if isinstance(products, list) else products
+
+def batch_recipes(image, preferences, products, plan, fmt, budget):
+    """Recipes for one distinct batch input, from the corpus or the model; runs on a batch worker thread."""
+    try:
+        known = None if image else corpus.lookup(products, preferences, plan["dishes"])
+        if known is not None:
+            return known, "corpus"
+        if budget.spent():
+            raise FuturesTimeout()
+        text = get_recipes(image, preferences, products, dishes=plan["dishes"], timeout=upstream_timeout(budget), fmt=fmt)
+        recipes = parse_recipes(text, fmt)[:plan["dishes"]]
+        for recipe in recipes:
+            photo_args(recipe)
+        corpus.ingest(recipes)
+        return recipes, "model"
+    finally:
+        # Worker threads outlive the request; do not leave their connections open.
+        connections.close_all()
+
+def batch_events(inputs, plan, fmt, budget, rejected=0, fields=None):
+    """NDJSON events for a batch, in completion order.
+
+    Identical inputs are generated once and reported under every id that
+    sent them. Recipes run on at most BATCH_CONCURRENCY threads and photos
+    go through the shared photo queue. A failing item only produces an
+    ``error`` event for its ids. ``rejected`` items failed validation
+    and already had theirs.
+    """
+    groups = {}  # dedupe key -> ids
+    pool = ThreadPoolExecutor(max_workers=settings.BATCH_CONCURRENCY, thread_name_prefix="batch")
+    pending = {}  # recipes future -> dedupe key
+    photos = {}  # first-photo future -> [(id, image_id)]; the photo queue shares futures between equal dishes
+    failed = rejected
+    try:
+        for item_id, image, preferences, products in inputs:
+            key = recipe_cache_key(image, preferences, products, RECIPES_MODEL, **cache_variant(plan["dishes"], fmt))
+            if key in groups:
+                groups[key].append(item_id)
+                continue
+            groups[key] = [item_id]
+            pending[pool.submit(batch_recipes, image, preferences, products, plan, fmt, budget)] = key
+
+        while pending or photos:
+            timeout = budget.remaining() if not pending else None
+            done, _ = wait(list(pending) + list(photos), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break  # out of budget; the photos keep rendering in the queue
+            for fut in done:
+                if fut in photos:
+                    kind = "image_ready" if fut.exception() is None else "image_failed"
+                    for item_id, image_id in photos.pop(fut):
+                        yield ndjson({"type": kind, "id": item_id, "image_id": image_id})
+                    continue
+
+                ids = groups[pending.pop(fut)]
+                try:
+                    recipes, source = fut.result()
+                except Exception as exc:
+                    logger.exception("Batch item %s failed", ids[0])
+                    failed += len(ids)
+                    error = DEADLINE_EXCEEDED if isinstance(exc, DEADLINE_ERRORS) else "Could not generate recipes."
+                    for item_id in ids:
+                        yield ndjson({"type": "error", "id": item_id, "error": error})
+                    continue
+                for recipe in recipes:
+                    recipe["image_status"] = "pending" if plan["images"] else "skipped"
+                    if plan["images"]:
+                        first, _ = queue_photo(recipe, plan["quality"])
+                        photos.setdefault(first, []).extend((item_id, recipe["image_id"]) for item_id in ids)
+                shown = project(recipes, fields)
+                for item_id in ids:
+                    yield ndjson({"type": "dishes", "id": item_id, "source": source, "dishes": shown})
+
+        for waiting in photos.values():
+            for item_id, image_id in waiting:
+                yield ndjson({"type": "image_pending", "id": item_id, "image_id": image_id})
+        yield ndjson({"type": "done", "items": sum(len(ids) for ids in groups.values()) + rejected,
+                      "distinct": len(groups), "failed": failed})
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@api_view(["POST"])
+@parser_classes([JSONParser, MultiPartParser, FormParser])
+def get_dishes_batch(request):
+    """Many pantries in one call; streams NDJSON events keyed by each item's ``id``.
+
+    Body: ``items`` (a list, or its JSON in a form field) of
+    ``{"id", "products", "preferences", "image"}``, where ``image`` names
+    an uploaded file field. ``deadline_ms`` and ``recipes_format`` apply
+    to the whole batch.
+    """
+    # A JSON body may be any value; everything below reads it as an object.
+    if not isinstance(request.data, dict):
+        return Response({"error": "The body must be an object with items."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        budget, plan, fmt = request_plan(request)
+        fields = dish_fields(request)
+        items = batch_items(request)
+    except ValueError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    inputs, invalid, seen = [], [], set()
+    for index, item in enumerate(items):
+        try:
+            item = batch_input(request, item, index)
+            if item[0] in seen:
+                raise BatchItemError(item[0], "Duplicate id.")
+            seen.add(item[0])
+            inputs.append(item)
+        except BatchItemError as exc:
+            invalid.append(ndjson({"type": "error", "id": exc.args[0], "error": exc.args[1]}))
+
+    def events():
+        yield from invalid
+        yield from batch_events(inputs, plan, fmt, budget, rejected=len(invalid), fields=fields)
+
+    return streaming_response(request, events())
+
+@api_view(["GET"])
+@renderer_classes([FastJSONRenderer])
+def dish_detail(request, image_id):
+    """The whole dish behind a compact response; ``fields=`` picks parts of it (e.g. ``fields=recipe``)."""
+    try:
+        fields = dish_fields(request)
+    except ValueError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    dish = dishes.find(image_id)
+    if dish is None:
+        return Response({"error": "Unknown dish."}, status=status.HTTP_404_NOT_FOUND)
+    if fields is not None:
+        dish = {f: dish[f] for f in fields if f in dish}
+    response = Response({"status": "ok", "dish": dish})
+    response["Cache-Control"] = "private, max-age=3600"
+    return response
+
 @api_view(['GET'])
 def serve_image(request, filename):
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    image_path = os.path.join(current_dir, 'images', filename)
-    
-    if not os.path.exists(image_path):
-        response_data = {"status": "failed"}
-        return Response(response_data, status=status.HTTP_404_NOT_FOUND)
-    
-    content_type, _ = mimetypes.guess_type(image_path)
-    if not content_type:
-        content_type = 'application/octet-stream'
-    
-    response = FileResponse(open(image_path, 'rb'), content_type=content_type)
+    image_id = storage.image_id_from_filename(filename)
+    # ?tier=full waits for the final render; the default serves the best
+    # image on disk, which may still be the preview.
+    tier = request.query_params.get("tier", storage.PREVIEW)
+    if tier not in storage.TIERS:
+        return Response({"error": "tier must be 'preview' or 'full'."}, status=status.HTTP_400_BAD_REQUEST)
+    tiers = (storage.FULL,) if tier == storage.FULL else storage.TIERS
+    # ?w=256&fmt=webp picks a resized / re-encoded variant; without fmt the
+    # Accept header decides.
+    try:
+        width, fmt = variants.choose(
+            request.query_params.get("w"), request.query_params.get("fmt"), request.headers.get("Accept", ""))
+    except ValueError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    found = storage.find_image(image_id, tiers)
+    if found:
+        served_tier, image_path, stat = found
+        content_type = storage.CONTENT_TYPE
+        derived = variants.variant(image_id, served_tier, width, fmt, timeout=settings.IMAGE_VARIANT_TIMEOUT)
+        if derived:
+            image_path, stat, content_type = derived
+        storage.touch(image_path, stat, settings.IMAGE_STORE_TOUCH_INTERVAL)
+        cache_control = serving.IMMUTABLE if served_tier == storage.FULL else serving.REVALIDATE
+        response = serving.file_response(request, image_path, stat, content_type, cache_control)
+        response["X-Image-Tier"] = served_tier
+        if not request.query_params.get("fmt"):
+            patch_vary_headers(response, ["Accept"])
+        return response
+
+    state = storage.image_state(image_id, pending_ttl=settings.PHOTO_PENDING_TTL, tiers=())
+    if state == storage.PENDING:
+        response = Response({"status": "pending"}, status=status.HTTP_202_ACCEPTED)
+        response["Retry-After"] = str(settings.PHOTO_RETRY_AFTER)
+    elif state == storage.FAILED:
+        response = Response({"status": "failed"}, status=status.HTTP_502_BAD_GATEWAY)
+    else:
+        response = Response({"status": "failed"}, status=status.HTTP_404_NOT_FOUND)
+    response["Cache-Control"] = "no-store"
     return response
+
+
+# Counters the modules already keep, read at scrape time.
+metrics.Gauges("dishes_upstream", "Upstream scheduler counters per lane.", lambda: scheduler().stats(), "lane")
+metrics.Gauges("dishes_recipe_cache", "Recipe cache counters.", lambda: recipe_cache().stats())
+metrics.Gauges("dishes_dish_cache", "Compact-response dish cache counters.", lambda: dishes.dish_cache().stats())
+metrics.Gauges("dishes_singleflight", "Coalesced upstream calls.",
+               lambda: {"recipes": recipes_flight.stats(), "photos": photos_flight.stats()}, "flight")
+metrics.Gauges("dishes_near_duplicates", "Near-duplicate photo index counters.",
+               lambda: near_duplicates() and near_duplicates().stats())
+metrics.Gauges("dishes_uploads", "Upload preprocessing counters.", uploads.stats)
+metrics.Gauges("dishes_recipe_tokens", "Recipe token usage per prompt version.", tokens.stats, "version")
+metrics.Gauges("dishes_photo_queue", "Photo queue depth.", lambda: {"depth": photo_queue().depth()})
+
+def metrics_view(request):
+    """Prometheus text exposition of the histograms and counters above."""
+    if not settings.METRICS_ENABLED:
+        return HttpResponse(status=404)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
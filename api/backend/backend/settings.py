@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -122,3 +125,237 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Dish photo generation queue (see api/utils/jobs.py)
+
+PHOTO_QUEUE_WORKERS = int(os.getenv('PHOTO_QUEUE_WORKERS', '8'))
+
+PHOTO_QUEUE_MAX_DEPTH = int(os.getenv('PHOTO_QUEUE_MAX_DEPTH', '256'))
+
+PHOTO_JOB_TIMEOUT = float(os.getenv('PHOTO_JOB_TIMEOUT', '120'))
+
+# Concurrent image generations per event loop on the ASGI path
+ASYNC_PHOTO_CONCURRENCY = int(os.getenv('ASYNC_PHOTO_CONCURRENCY', '256'))
+
+# Serve get-dishes with the native async view (set by backend/asgi.py)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0') == '1'
+
+# Seconds a client should wait before polling a pending image again
+PHOTO_RETRY_AFTER = int(os.getenv('PHOTO_RETRY_AFTER', '2'))
+
+# A pending marker older than this is treated as a failed generation
+PHOTO_PENDING_TTL = int(os.getenv('PHOTO_PENDING_TTL', '600'))
+
+# Render a quick low-quality preview ahead of every full photo
+PHOTO_PREVIEW = os.getenv('PHOTO_PREVIEW', '1') == '1'
+
+PHOTO_PREVIEW_QUALITY = os.getenv('PHOTO_PREVIEW_QUALITY', 'low')
+
+# Quality of the stored full image. A request that can only wait for a
+# preview-quality render (a short deadline) gets it as the preview tier
+# and the full image is still rendered at this quality behind it.
+PHOTO_FULL_QUALITY = os.getenv('PHOTO_FULL_QUALITY', 'medium')
+
+# Let the front server send image bytes (see api/utils/serving.py):
+# '' serves from Django, 'nginx' answers with X-Accel-Redirect under
+# IMAGE_ACCEL_PREFIX (an internal location aliased to the images dir),
+# 'sendfile' answers with X-Sendfile (Apache mod_xsendfile, lighttpd).
+IMAGE_SENDFILE = os.getenv('IMAGE_SENDFILE', '')
+
+IMAGE_ACCEL_PREFIX = os.getenv('IMAGE_ACCEL_PREFIX', '/protected-images/')
+
+# Resized / re-encoded image variants (see api/utils/variants.py). Requested
+# widths are rounded up to one of IMAGE_VARIANT_WIDTHS; IMAGE_ACCEPT_FORMATS
+# are the formats the Accept header may pick, in order of preference.
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '128,256,512').split(',') if w]
+
+IMAGE_ACCEPT_FORMATS = [f for f in os.getenv('IMAGE_ACCEPT_FORMATS', 'webp').split(',') if f]
+
+# Variants encoded as soon as a full photo is written, as "width:format"
+IMAGE_EAGER_VARIANTS = [v for v in os.getenv('IMAGE_EAGER_VARIANTS', '256:webp').split(',') if v]
+
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', '2'))
+
+# Seconds a request waits for a lazy encode before falling back to the original
+IMAGE_VARIANT_TIMEOUT = float(os.getenv('IMAGE_VARIANT_TIMEOUT', '5'))
+
+IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', '80'))
+
+IMAGE_AVIF_QUALITY = int(os.getenv('IMAGE_AVIF_QUALITY', '60'))
+
+# Image store limits (see api/utils/imagestore.py). When either cap is
+# exceeded the least recently served images are evicted down to
+# IMAGE_STORE_LOW_WATER of it; 0 disables a cap. A sweep runs in the
+# background every IMAGE_STORE_SWEEP_EVERY new photos and on demand with
+# `manage.py imagestore`.
+IMAGE_STORE_MAX_BYTES = int(os.getenv('IMAGE_STORE_MAX_BYTES', str(5 * 1024 ** 3)))
+
+IMAGE_STORE_MAX_FILES = int(os.getenv('IMAGE_STORE_MAX_FILES', '0'))
+
+IMAGE_STORE_LOW_WATER = float(os.getenv('IMAGE_STORE_LOW_WATER', '0.9'))
+
+IMAGE_STORE_SWEEP_EVERY = int(os.getenv('IMAGE_STORE_SWEEP_EVERY', '200'))
+
+# Served images get their access time bumped at most this often (seconds)
+IMAGE_STORE_TOUCH_INTERVAL = int(os.getenv('IMAGE_STORE_TOUCH_INTERVAL', '3600'))
+
+
+# Pantry photo preprocessing before the vision call (see api/utils/uploads.py).
+# The long edge is capped at UPLOAD_MAX_EDGE px (0 sends uploads unchanged)
+# and the photo is re-encoded as UPLOAD_FORMAT ('jpeg' or 'webp').
+
+UPLOAD_MAX_EDGE = int(os.getenv('UPLOAD_MAX_EDGE', '1536'))
+
+UPLOAD_FORMAT = os.getenv('UPLOAD_FORMAT', 'jpeg')
+
+UPLOAD_QUALITY = int(os.getenv('UPLOAD_QUALITY', '85'))
+
+
+# Recipe text cache (see api/utils/cache.py)
+
+RECIPE_CACHE_PATH = os.getenv('RECIPE_CACHE_PATH', str(BASE_DIR / 'recipe_cache.sqlite3'))
+
+RECIPE_CACHE_TTL = int(os.getenv('RECIPE_CACHE_TTL', str(7 * 24 * 3600)))
+
+RECIPE_CACHE_MAX_ENTRIES = int(os.getenv('RECIPE_CACHE_MAX_ENTRIES', '50000'))
+
+RECIPE_CACHE_MEMORY_ENTRIES = int(os.getenv('RECIPE_CACHE_MEMORY_ENTRIES', '1024'))
+
+# Full dishes behind compact=1 responses (see api/utils/dishes.py), in their
+# own table of the recipe cache file so they never evict recipe texts.
+
+DISH_CACHE_TTL = int(os.getenv('DISH_CACHE_TTL', str(24 * 3600)))
+
+DISH_CACHE_MAX_ENTRIES = int(os.getenv('DISH_CACHE_MAX_ENTRIES', '20000'))
+
+DISH_CACHE_MEMORY_ENTRIES = int(os.getenv('DISH_CACHE_MEMORY_ENTRIES', '1024'))
+
+
+# Reuse recipes for near-identical pantry photos (see api/utils/phash.py):
+# a photo whose dHash is within NEAR_DUPLICATE_DISTANCE bits of one seen in
+# the last NEAR_DUPLICATE_TTL seconds, with the same preferences and
+# products, gets that photo's recipes.
+
+NEAR_DUPLICATE_CACHE = os.getenv('NEAR_DUPLICATE_CACHE', '1') == '1'
+
+NEAR_DUPLICATE_DISTANCE = int(os.getenv('NEAR_DUPLICATE_DISTANCE', '5'))
+
+NEAR_DUPLICATE_TTL = int(os.getenv('NEAR_DUPLICATE_TTL', '900'))
+
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', '20000'))
+
+
+# Recipe corpus (see api/utils/corpus.py): every generated recipe is stored
+# with an ingredient index, and a products-only request is answered from it
+# when at least CORPUS_MIN_MATCHES stored recipes (or the requested number
+# of dishes, if fewer) use only those products and respect the diets.
+
+CORPUS_ENABLED = os.getenv('CORPUS_ENABLED', '1') == '1'
+
+CORPUS_MIN_MATCHES = int(os.getenv('CORPUS_MIN_MATCHES', '3'))
+
+# Lookups stay under ~10 ms up to about 50k stored recipes; past that they
+# grow with the corpus (~13 ms at 100k in api/benchmarks/bench_corpus.py).
+CORPUS_MAX_CANDIDATES = int(os.getenv('CORPUS_MAX_CANDIDATES', '200'))
+
+
+# Recipe output format (see api/utils/gpt.py): 'text' is the original
+# line-based format, 'json' a compact structured output with a much shorter
+# prompt. Requests can override it with recipes_format=text|json.
+
+RECIPES_FORMAT = os.getenv('RECIPES_FORMAT', 'text')
+
+
+# Batch endpoint /api/get-dishes/batch/: items per request, and how many
+# distinct items generate recipes at once (photos use the photo queue).
+
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+
+# Response wire format (see api/middleware.py and api/renderers.py): JSON and
+# text responses of at least RESPONSE_COMPRESSION_MIN_BYTES are brotli (when
+# installed) or gzip encoded, as the client's Accept-Encoding allows; streamed
+# responses never are. Dish payloads are encoded with orjson when installed.
+
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', '1') == '1'
+
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '512'))
+
+RESPONSE_BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', '5'))
+
+
+# Recipe prompt budget (see api/utils/prompts.py): product names are clipped,
+# the list is capped and then shortened until instructions + request text fit
+# PROMPT_MAX_INPUT_TOKENS (counted with tiktoken when installed, estimated
+# otherwise; the photo is not counted).
+
+PROMPT_MAX_PRODUCTS = int(os.getenv('PROMPT_MAX_PRODUCTS', '60'))
+
+PROMPT_MAX_PRODUCT_CHARS = int(os.getenv('PROMPT_MAX_PRODUCT_CHARS', '60'))
+
+PROMPT_MAX_PREFERENCES_CHARS = int(os.getenv('PROMPT_MAX_PREFERENCES_CHARS', '400'))
+
+PROMPT_MAX_INPUT_TOKENS = int(os.getenv('PROMPT_MAX_INPUT_TOKENS', '2500'))
+
+
+# Observability (see api/middleware.py and api/utils/metrics.py): per-stage
+# timings go into a Server-Timing header and histograms served at /metrics.
+# Below WARNING only LOG_SAMPLE_RATE of the log lines are kept.
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', '1') == '1'
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {'()': 'api.utils.logs.SampleFilter', 'rate': LOG_SAMPLE_RATE},
+    },
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain', 'filters': ['sample']},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
+
+# Cross-process single-flight leases (see api/utils/singleflight.py)
+
+SINGLEFLIGHT_LOCK_DIR = os.getenv('SINGLEFLIGHT_LOCK_DIR', str(BASE_DIR / 'locks'))
+
+SINGLEFLIGHT_LEASE_TIMEOUT = float(os.getenv('SINGLEFLIGHT_LEASE_TIMEOUT', '180'))
+
+
+# Upstream (OpenAI) scheduler (see api/utils/scheduler.py)
+
+UPSTREAM_TEXT_RPM = float(os.getenv('UPSTREAM_TEXT_RPM', '500'))
+
+UPSTREAM_TEXT_BURST = int(os.getenv('UPSTREAM_TEXT_BURST', '20'))
+
+UPSTREAM_IMAGE_RPM = float(os.getenv('UPSTREAM_IMAGE_RPM', '50'))
+
+UPSTREAM_IMAGE_BURST = int(os.getenv('UPSTREAM_IMAGE_BURST', '10'))
+
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '32'))
+
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '4'))
+
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', '0.5'))
+
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', '20'))
+
+UPSTREAM_HEDGE_TEXT = os.getenv('UPSTREAM_HEDGE_TEXT', '0') == '1'
+
+UPSTREAM_HEDGE_IMAGE = os.getenv('UPSTREAM_HEDGE_IMAGE', '0') == '1'
@@ -0,0 +1,63 @@
+"""
+Lean production profile for the JSON API.
+
+    DJANGO_SETTINGS_MODULE=backend.settings_lean gunicorn backend.wsgi
+
+Everything from settings.py, minus what a JSON-only API never uses: admin,
+auth, sessions, messages, static files, templates, CSRF and clickjacking
+middleware. DEBUG is off unless DJANGO_DEBUG=1; DJANGO_SECRET_KEY and
+DJANGO_ALLOWED_HOSTS are required. Run
+`python api/benchmarks/bench_startup.py` to compare it with settings.py.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import SECRET_KEY
+
+DEBUG = os.getenv('DJANGO_DEBUG', '0') == '1'
+
+# Production refuses to start on the development key or without a host list;
+# with DJANGO_DEBUG=1 both fall back to local-only values.
+if os.getenv('DJANGO_SECRET_KEY'):
+    SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+elif not DEBUG:
+    raise ImproperlyConfigured('Set DJANGO_SECRET_KEY for backend.settings_lean (or DJANGO_DEBUG=1).')
+
+ALLOWED_HOSTS = [h.strip() for h in os.getenv('DJANGO_ALLOWED_HOSTS', '').split(',') if h.strip()]
+if not ALLOWED_HOSTS:
+    if not DEBUG:
+        raise ImproperlyConfigured('Set DJANGO_ALLOWED_HOSTS (comma-separated) for backend.settings_lean.')
+    ALLOWED_HOSTS = ['localhost', '127.0.0.1', '[::1]']
+
+INSTALLED_APPS = [
+    'rest_framework',
+    'api',
+]
+
+MIDDLEWARE = [
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.CompressionMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'backend.urls_lean'
+
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+USE_I18N = False
+
+# Without django.contrib.auth there is no user model: requests are
+# anonymous (request.user is None) and only JSON is rendered, so the
+# browsable API and its templates are never loaded.
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': [],
+    'UNAUTHENTICATED_USER': None,
+    'DEFAULT_RENDERER_CLASSES': ['api.renderers.FastJSONRenderer'],
+}
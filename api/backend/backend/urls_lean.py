@@ -0,0 +1,8 @@
+"""URL configuration of the lean profile (backend/settings_lean.py): the API without the admin."""
+from django.urls import path, include
+from api.views import metrics_view
+
+urlpatterns = [
+    path("api/", include("api.urls")),
+    path("metrics", metrics_view, name="metrics"),
+]
@@ -0,0 +1,120 @@
+"""Benchmark: recipe corpus lookups (pivot + inverted index) vs. scanning every recipe.
+
+Builds a throwaway sqlite corpus of synthetic recipes whose ingredients
+follow a Zipf distribution, like real pantries (eggs everywhere, saffron rarely).
+
+Run from the repo root or api/:  python api/benchmarks/bench_corpus.py [--sizes 1000 10000 1000000]
+
+Each step stores its first 1000 new recipes through corpus.ingest (the
+"ingest" column) and bulk-loads the rest the same way, so corpora of a
+million recipes build in minutes. The linear scan is only run up to
+SCAN_MAX recipes.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+# Letters only: normalize_ingredient drops digits and quantities.
+INGREDIENTS = ["ing" + "".join(chr(97 + (i // 26 ** k) % 26) for k in range(2)) + "a" for i in range(600)]
+WEIGHTS = [1 / (i + 1) for i in range(len(INGREDIENTS))]
+INGEST_SAMPLE = 1000
+SCAN_MAX = 50000
+
+
+def synthetic(rng, n):
+    for i in range(n):
+        products = set(rng.choices(INGREDIENTS, WEIGHTS, k=rng.randint(3, 9)))
+        yield {"name": f"Dish {i}", "products": sorted(products), "recipe": "Cook.", "time_min": rng.randint(5, 120),
+               "difficulty": rng.randint(1, 5), "energy_kcal": 500.0, "proteins_g": 20.0, "fats_g": 15.0,
+               "carbs_g": float(rng.randint(0, 80)), "image_id": f"{i:032x}"}
+
+
+def bulk_load(batch, chunk=5000):
+    """What corpus.ingest stores for ``batch``, in bulk; pivots follow the same rule."""
+    from django.db import transaction
+    from api.models import Ingredient, Recipe, RecipeIngredient
+    from api.utils import corpus
+
+    counts = dict(Ingredient.objects.values_list("name", "recipe_count"))
+    for start in range(0, len(batch), chunk):
+        rows, ingredients = [], []
+        for dish in batch[start:start + chunk]:
+            names = sorted(corpus.ingredient_set(dish["products"]))
+            pivot = min(names, key=lambda n: (counts.get(n, 0), n))
+            for n in names:
+                counts[n] = counts.get(n, 0) + 1
+            fields = {k: dish[k] for k in ("image_id", "name", "products", "recipe", "time_min", "difficulty",
+                                             "energy_kcal", "proteins_g", "fats_g", "carbs_g")}
+            rows.append(Recipe(pivot=pivot, ingredient_count=len(names), **fields))
+            ingredients.append(names)
+        with transaction.atomic():
+            Recipe.objects.bulk_create(rows)
+            RecipeIngredient.objects.bulk_create(
+                [RecipeIngredient(recipe=r, ingredient=n) for r, names in zip(rows, ingredients) for n in names])
+    Ingredient.objects.bulk_create([Ingredient(name=n, recipe_count=c) for n, c in counts.items()],
+                                   update_conflicts=True, unique_fields=["name"], update_fields=["recipe_count"])
+
+
+def scan(recipes, pantry):
+    from api.utils import corpus
+    return [r["name"] for r in recipes if corpus.ingredient_set(r["products"]) <= pantry]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    settings.DATABASES["default"]["NAME"] = os.path.join(tmp.name, "corpus.sqlite3")
+    django.setup()
+    from django.core.management import call_command
+    from api.utils import corpus
+    call_command("migrate", "api", verbosity=0)
+
+    rng = random.Random(0)
+    recipes, stored = [], 0
+    for size in args.sizes:
+        batch = list(synthetic(rng, size - stored))
+        for i, r in enumerate(batch):
+            r["image_id"] = f"{stored + i:032x}"
+            r["name"] = f"Dish {stored + i}"
+        started = time.perf_counter()
+        corpus.ingest(batch[:INGEST_SAMPLE])
+        ingest = (time.perf_counter() - started) / min(len(batch), INGEST_SAMPLE)
+        bulk_load(batch[INGEST_SAMPLE:])
+        if size <= SCAN_MAX:
+            recipes += batch
+        stored = size
+
+        pantries = [set(rng.choices(INGREDIENTS, WEIGHTS, k=rng.randint(8, 25))) for _ in range(50)]
+        # Timed at the size lookup() asks for; the whole candidate list is checked below.
+        started = time.perf_counter()
+        found = [corpus.match(sorted(p), "None", limit=settings.CORPUS_MIN_MATCHES) for p in pantries]
+        indexed = (time.perf_counter() - started) / len(pantries)
+        linear = None
+        if size <= SCAN_MAX:
+            started = time.perf_counter()
+            scanned = [scan(recipes, p) for p in pantries[:5]]
+            linear = (time.perf_counter() - started) / 5
+            every = [corpus.match(sorted(p), "None", limit=1000) for p in pantries[:5]]
+            assert all(len(f) == min(len(s), settings.CORPUS_MAX_CANDIDATES) for f, s in zip(every, scanned))
+        hits = sum(1 for f in found if len(f) >= settings.CORPUS_MIN_MATCHES)
+        scan_ms = f"{linear * 1e3:8.1f}" if linear is not None else f"{'-':>8}"
+        print(f"{size:>7} recipes  ingest {ingest * 1e3:6.2f} ms/recipe  lookup {indexed * 1e3:7.2f} ms   "
+              f"scan {scan_ms} ms   {hits}/{len(pantries)} pantries answered without the LLM")
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Micro-benchmarks for the hot helpers: parse_recipes (both formats) and file_to_data_url.
+
+Run from the repo root or api/:  python api/benchmarks/bench_micro.py [photo ...]
+
+Recipe text comes from the fake OpenAI server's canned answers, so the
+numbers track the same input the load test sends through the API.
+"""
+import json
+import os
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "backend"))
+sys.path.insert(0, HERE)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+
+import fake_openai  # noqa: E402
+from api.utils.gpt import file_to_data_url  # noqa: E402
+from api.utils.parser import parse_recipes  # noqa: E402
+
+
+def best_of(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def payloads(dishes):
+    # The canned answers have four dishes; repeat them for larger ones.
+    count, repeat = min(dishes, 4), max(1, dishes // 4)
+    text = "\n----------\n".join([fake_openai.recipes_text(count)] * repeat)
+    compact = json.dumps({"r": json.loads(fake_openai.recipes_json(count))["r"] * repeat})
+    return (("text", text), ("json", compact))
+
+
+def bench_parser():
+    print(f"{'parse_recipes':<28} {'bytes':>8} {'us/call':>10}")
+    for dishes in (1, 4, 16):
+        for fmt, payload in payloads(dishes):
+            assert len(parse_recipes(payload, fmt)) == dishes
+            per_call = best_of(lambda: parse_recipes(payload, fmt), 200)
+            print(f"{f'{dishes} dishes, {fmt}':<28} {len(payload):>8} {per_call * 1e6:>10.1f}")
+
+
+def bench_data_url(paths):
+    photos = paths or [os.path.join(HERE, "..", "test.jpg")]
+    print(f"\n{'file_to_data_url':<28} {'bytes':>8} {'ms/call':>10} {'url bytes':>10}")
+    for path in photos:
+        with open(path, "rb") as f:
+            raw = f.read()
+        name = os.path.basename(path)
+        upload = SimpleUploadedFile(name, raw, content_type="image/jpeg")
+        for label, source in ((f"{name} (path)", path), (f"{name} (upload)", upload)):
+            url = file_to_data_url(source)
+            per_call = best_of(lambda: file_to_data_url(source), 5)
+            print(f"{label:<28} {len(raw):>8} {per_call * 1e3:>10.1f} {len(url):>10}")
+
+
+def main():
+    bench_parser()
+    bench_data_url(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Micro-benchmark: incremental RecipeParser vs. the original parse_recipes.
+
+Run from the repo root or api/:  python api/benchmarks/bench_parser.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from api.utils.parser import RecipeParser, parse_recipes  # noqa: E402
+
+RECIPE = """Garlic Mashed Potatoes
+Potatoes (500g), Garlic (3 cloves), Olive oil (3 tbsp), Salt (to taste)
+""" + "\n\n".join(f"Step {i}.\nDo step number {i} carefully, it takes about {i} minutes." for i in range(1, 9)) + """
+25
+2
+310
+6
+12
+45.5
+Potatoes (1 kg), Garlic (1 head), Olive oil (1 bottle)"""
+
+
+def legacy_parse_recipes(recipes_text):
+    blocks = [b.strip() for b in recipes_text.strip().split("\n----------\n") if b.strip()]
+    results = []
+
+    for block in blocks:
+        lines = [l for l in block.splitlines() if l.strip()]
+        if len(lines) < 2 + 6:
+            if len(lines) >= 2:
+                products = [p.strip() for p in lines[1].strip().split(",") if p.strip()]
+                results.append({
+                    "name": lines[0].strip(),
+                    "products": products,
+                    "recipe": "\n".join(lines[2:]).strip(),
+                    "time_min": None,
+                    "difficulty": None,
+                    "energy_kcal": None,
+                    "proteins_g": None,
+                    "fats_g": None,
+                    "carbs_g": None,
+                })
+            continue
+
+        products = [p.strip() for p in lines[1].strip().split(",") if p.strip()]
+        # Same numeric-tail fix as parse_block: the numbers sit before the
+        # products-on-the-photo line.
+        tail = lines[-7:-1]
+
+        def to_num(s, as_int=False):
+            s = s.strip()
+            s = s.replace(",", ".")
+            try:
+                return int(float(s)) if as_int else float(s)
+            except ValueError:
+                return None
+
+        results.append({
+            "name": lines[0].strip(),
+            "products": products,
+            "recipe": "\n".join(lines[2:-7]).strip(),
+            "time_min": to_num(tail[0], as_int=True),
+            "difficulty": to_num(tail[1], as_int=True),
+            "energy_kcal": to_num(tail[2], as_int=False),
+            "proteins_g": to_num(tail[3], as_int=False),
+            "fats_g": to_num(tail[4], as_int=False),
+            "carbs_g": to_num(tail[5], as_int=False),
+            "products_exist": [p.strip() for p in lines[-1].strip().split(",") if p.strip()],
+        })
+
+    return results
+
+
+def chunked_parse(chunks):
+    parser = RecipeParser()
+    out = []
+    for chunk in chunks:
+        out += parser.feed(chunk)
+    return out + parser.close()
+
+
+def token_chunks(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def bench(label, fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"  {label:<38} {best * 1000:9.3f} ms")
+    return best
+
+
+def main():
+    for count in (4, 100, 2000):
+        text = "\n----------\n".join([RECIPE] * count)
+        chunks = token_chunks(text)
+        assert parse_recipes(text) == legacy_parse_recipes(text) == chunked_parse(chunks)
+
+        number = max(1, 2000 // count)
+        print(f"{count} recipes, {len(text) / 1024:.0f} KiB, {len(chunks)} token chunks")
+        legacy = bench("legacy parse_recipes(full text)", lambda: legacy_parse_recipes(text), number)
+        whole = bench("parse_recipes(full text)", lambda: parse_recipes(text), number)
+        bench("RecipeParser.feed(4-char chunks)", lambda: chunked_parse(chunks), number)
+        print(f"  legacy / new on full text: {legacy / whole:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Size and encode time of the get-dishes JSON body: full vs compact dishes,
+DRF's JSONRenderer vs FastJSONRenderer (orjson), and gzip / brotli.
+
+Run from the repo root or api/:  python api/benchmarks/bench_payload.py [--dishes 4]
+
+The dishes are the fake OpenAI server's canned recipes, parsed like a
+real answer; "before" is the full payload through DRF's renderer without
+compression, as get-dishes used to answer.
+"""
+import argparse
+import gzip
+import os
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "backend"))
+sys.path.insert(0, HERE)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.utils.text import compress_string  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+import fake_openai  # noqa: E402
+from api import middleware, renderers  # noqa: E402
+from api.utils import storage  # noqa: E402
+from api.utils.parser import parse_recipes  # noqa: E402
+from api.views import SUMMARY_FIELDS  # noqa: E402
+
+
+def best_of(fn, number=200):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def payload(dishes, fields=None):
+    # The canned answers have four dishes; repeat them for larger ones.
+    recipes = parse_recipes(fake_openai.recipes_text(min(dishes, 4)))
+    recipes = (recipes * (dishes // len(recipes) + 1))[:dishes]
+    for recipe in recipes:
+        recipe["image_id"] = storage.dish_image_id(recipe["name"], recipe["products"])
+        recipe["image_status"] = "pending"
+    if fields:
+        recipes = [{f: r[f] for f in fields if f in r} for r in recipes]
+    return {"status": "ok", "source": "model", "dishes": recipes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dishes", type=int, default=4)
+    args = parser.parse_args()
+
+    drf, fast = JSONRenderer(), renderers.FastJSONRenderer()
+    print(f"orjson: {'yes' if renderers.orjson else 'no (stdlib fallback)'}, "
+          f"brotli: {'yes' if middleware.brotli else 'no'}\n")
+    print(f"{'payload':<10}{'renderer':<10}{'encode us':>10}{'bytes':>9}{'gzip':>8}{'gzip us':>9}"
+          f"{'br':>8}{'br us':>8}")
+    for label, fields in (("full", None), ("compact", SUMMARY_FIELDS)):
+        data = payload(args.dishes, fields)
+        for name, renderer in (("drf", drf), ("fast", fast)):
+            body = renderer.render(data)
+            encode = best_of(lambda: renderer.render(data))
+            gz = compress_string(body)
+            gzip_us = best_of(lambda: compress_string(body), 50)
+            assert gzip.decompress(gz) == body
+            if middleware.brotli:
+                br = len(middleware.brotli.compress(body, quality=5))
+                br_us = best_of(lambda: middleware.brotli.compress(body, quality=5), 50) * 1e6
+                br_cols = f"{br:>8}{br_us:>8.0f}"
+            else:
+                br_cols = f"{'-':>8}{'-':>8}"
+            print(f"{label:<10}{name:<10}{encode * 1e6:>10.1f}{len(body):>9}{len(gz):>8}{gzip_us * 1e6:>9.0f}{br_cols}")
+
+
+if __name__ == "__main__":
+    main()
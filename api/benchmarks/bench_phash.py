@@ -0,0 +1,47 @@
+"""Micro-benchmark: multi-index hashing lookup vs. a linear Hamming scan.
+
+Run from the repo root or api/:  python api/benchmarks/bench_phash.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from api.utils.phash import NearDuplicateIndex, hamming  # noqa: E402
+
+DISTANCE = 5
+CONTEXT = "ctx"
+
+
+def linear_find(hashes, value):
+    best = min(hashes, key=lambda h: hamming(h, value))
+    return best if hamming(best, value) <= DISTANCE else None
+
+
+def main():
+    rng = random.Random(0)
+    for size in (1000, 20000, 100000):
+        hashes = [rng.getrandbits(64) for _ in range(size)]
+        index = NearDuplicateIndex(max_distance=DISTANCE, max_entries=size, ttl=3600)
+        for h in hashes:
+            index.add(h, CONTEXT, h)
+        # Half the queries are near-duplicates of stored hashes, half are new photos.
+        queries = []
+        for i in range(200):
+            if i % 2:
+                flips = rng.sample(range(64), rng.randint(0, DISTANCE))
+                queries.append(rng.choice(hashes) ^ sum(1 << b for b in flips))
+            else:
+                queries.append(rng.getrandbits(64))
+
+        assert [index.find(q, CONTEXT) for q in queries] == [linear_find(hashes, q) for q in queries]
+        mih = timeit.timeit(lambda: [index.find(q, CONTEXT) for q in queries], number=5) / (5 * len(queries))
+        linear = timeit.timeit(lambda: [linear_find(hashes, q) for q in queries[:20]], number=1) / 20
+        print(f"{size:>7} hashes  multi-index {mih * 1e6:8.1f} us/lookup   linear {linear * 1e6:10.1f} us/lookup   "
+              f"{linear / mih:6.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Cold start of one API worker under each settings profile.
+
+For every profile a fresh server process is started RUNS times and the
+script reports the medians of:
+
+  setup      import of the WSGI application (django.setup and settings)
+  first      spawn to the first answered request (/metrics), interpreter start included
+  dishes     the first get-dishes call afterwards (URL conf, views and OpenAI client on first use)
+  rss        resident memory after setup and after that get-dishes call
+
+    python api/benchmarks/bench_startup.py --runs 5
+    python api/benchmarks/bench_startup.py --profiles backend.settings backend.settings_lean
+
+Upstream calls go to the fake OpenAI server (see fake_openai.py); each run
+uses an empty recipe cache and a deadline that skips photos, so nothing
+but a recipe cache file in a temp dir is written. RSS reads /proc (Linux).
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(HERE, "..", "backend")
+sys.path.insert(0, HERE)
+
+import fake_openai  # noqa: E402
+
+
+def rss_kb(pid="self"):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def serve(settings_module, port):
+    """Child process: build the WSGI app like a worker would, report, then serve."""
+    started = time.perf_counter()
+    sys.path.insert(0, BACKEND)
+    os.environ["DJANGO_SETTINGS_MODULE"] = settings_module
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    setup = time.perf_counter() - started
+    print(json.dumps({"setup": setup, "rss_kb": rss_kb()}), flush=True)
+
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    class Quiet(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    make_server("127.0.0.1", port, application, server_class=Server, handler_class=Quiet).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def one_run(settings_module, env, run):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    spawned = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, __file__, "--serve", settings_module, "--port", str(port)],
+                            cwd=BACKEND, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        report = json.loads(proc.stdout.readline())
+        while True:
+            try:
+                requests.get(f"{base}/metrics", timeout=5)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.005)
+        first = time.perf_counter() - spawned
+
+        started = time.perf_counter()
+        # A new pantry per run and profile, so every call goes upstream.
+        products = json.dumps(["Potatoes", "Onions", f"Spice blend {settings_module} {run}"])
+        resp = requests.post(f"{base}/api/get-dishes/", data={"products": products, "deadline_ms": "10000"}, timeout=60)
+        dishes = time.perf_counter() - started
+        if resp.status_code != 200:
+            raise SystemExit(f"{settings_module}: get-dishes answered {resp.status_code}: {resp.text[:200]}")
+        return {"setup": report["setup"], "first": first, "dishes": dishes,
+                "rss_setup": report["rss_kb"] / 1024, "rss_dishes": rss_kb(proc.pid) / 1024}
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=["backend.settings", "backend.settings_lean"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    server, base_url = fake_openai.start_in_thread(fake_openai.FakeOpenAI(text_latency="fixed:0"))
+    tmp = tempfile.TemporaryDirectory()
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench", CORPUS_ENABLED="0",
+               RECIPE_CACHE_PATH=os.path.join(tmp.name, "recipes.sqlite3"), NEAR_DUPLICATE_CACHE="0",
+               DJANGO_SECRET_KEY="bench", DJANGO_ALLOWED_HOSTS="127.0.0.1")
+
+    print(f"{'profile':<26}{'setup ms':>10}{'first ms':>10}{'dishes ms':>11}{'rss setup MB':>14}{'rss dishes MB':>15}")
+    for profile in args.profiles:
+        runs = [one_run(profile, env, i) for i in range(args.runs)]
+        median = {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+        print(f"{profile:<26}{median['setup'] * 1000:>10.0f}{median['first'] * 1000:>10.0f}"
+              f"{median['dishes'] * 1000:>11.0f}{median['rss_setup']:>14.1f}{median['rss_dishes']:>15.1f}")
+    server.shutdown()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
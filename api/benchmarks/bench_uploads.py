@@ -0,0 +1,74 @@
+"""Benchmark: upload preprocessing (EXIF rotate, downscale, re-encode) vs. sending photos unchanged.
+
+Run from the repo root or api/:  python api/benchmarks/bench_uploads.py [photo ...]
+
+Without arguments it uses api/test.jpg plus synthetic 12 MP and 48 MP
+phone-sized JPEGs. Needs Pillow.
+"""
+import base64
+import io
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "backend"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from api.utils.uploads import prepare_upload  # noqa: E402
+
+
+def synthetic(width, height):
+    # Noise over a gradient compresses roughly like a real photo.
+    im = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    im = Image.blend(im, noise, 0.3)
+    exif = im.getexif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    im.save(buf, format="JPEG", quality=92, exif=exif)
+    return buf.getvalue()
+
+
+def samples(paths):
+    if paths:
+        for path in paths:
+            with open(path, "rb") as f:
+                yield os.path.basename(path), f.read()
+        return
+    with open(os.path.join(HERE, "..", "test.jpg"), "rb") as f:
+        yield "test.jpg", f.read()
+    yield "synthetic 12MP", synthetic(4032, 3024)
+    yield "synthetic 48MP", synthetic(8064, 6048)
+
+
+def main():
+    configs = [
+        ("jpeg q85 1536", {"UPLOAD_MAX_EDGE": 1536, "UPLOAD_FORMAT": "jpeg", "UPLOAD_QUALITY": 85}),
+        ("webp q80 1536", {"UPLOAD_MAX_EDGE": 1536, "UPLOAD_FORMAT": "webp", "UPLOAD_QUALITY": 80}),
+        ("jpeg q85 1024", {"UPLOAD_MAX_EDGE": 1024, "UPLOAD_FORMAT": "jpeg", "UPLOAD_QUALITY": 85}),
+    ]
+    print(f"{'photo':<16} {'config':<14} {'in':>10} {'out':>10} {'data url':>10} {'saved':>6} {'ms':>7}")
+    for name, raw in samples(sys.argv[1:]):
+        print(f"{name:<16} {'unchanged':<14} {len(raw):>10} {len(raw):>10} {len(base64.b64encode(raw)):>10} "
+              f"{'0%':>6} {'-':>7}")
+        for label, overrides in configs:
+            with override_settings(**overrides):
+                started = time.perf_counter()
+                data, _ = prepare_upload(io.BytesIO(raw))
+                elapsed = (time.perf_counter() - started) * 1000
+            saved = 1 - len(data) / len(raw)
+            print(f"{'':<16} {label:<14} {len(raw):>10} {len(data):>10} {len(base64.b64encode(data)):>10} "
+                  f"{saved:>6.0%} {elapsed:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
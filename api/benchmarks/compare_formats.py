@@ -0,0 +1,82 @@
+"""Compare the line-based text format with the compact JSON-schema format.
+
+Calls the real API (needs OPENAI_API_KEY), bypassing the recipe cache, and
+reports per format: estimated prompt tokens, input/output tokens, time to the first
+parsed dish (streaming), end-to-end latency and how many dishes came back
+with every numeric field.
+
+Run from the repo root or api/:
+    python api/benchmarks/compare_formats.py --runs 3 --products "eggs, milk, flour, tomatoes"
+    python api/benchmarks/compare_formats.py --image pantry.jpg
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from api.utils.gpt import client, recipes_request  # noqa: E402
+from api.utils.parser import FORMATS, recipe_parser  # noqa: E402
+
+NUMBERS = ("time_min", "difficulty", "energy_kcal", "proteins_g", "fats_g", "carbs_g")
+
+
+def run(fmt, image, preferences, products, dishes):
+    request, prompt = recipes_request(image, preferences, products, dishes, fmt)
+    parser = recipe_parser(fmt)
+    recipes, first_dish, usage = [], None, None
+    started = time.perf_counter()
+    with client().responses.create(**request, stream=True) as stream:
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                recipes += parser.feed(event.delta)
+                if recipes and first_dish is None:
+                    first_dish = time.perf_counter() - started
+            elif event.type == "response.completed":
+                usage = event.response.usage
+    recipes += parser.close()
+    total = time.perf_counter() - started
+    complete = sum(all(r.get(k) is not None for k in NUMBERS) for r in recipes)
+    return {
+        "prompt_tokens_est": prompt.tokens,
+        "input_tokens": usage.input_tokens if usage else 0,
+        "output_tokens": usage.output_tokens if usage else 0,
+        "first_dish_s": first_dish or total,
+        "total_s": total,
+        "dishes": len(recipes),
+        "complete": complete,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--products", default="eggs, milk, flour, tomatoes, cheese, onion, chicken")
+    parser.add_argument("--preferences", default="None")
+    parser.add_argument("--dishes", type=int, default=None)
+    parser.add_argument("--image", default=None)
+    args = parser.parse_args()
+    products = [p.strip() for p in args.products.split(",") if p.strip()]
+
+    results = {fmt: [] for fmt in FORMATS}
+    for i in range(args.runs):
+        # Alternate the order so neither format always runs on a warm connection.
+        for fmt in (FORMATS if i % 2 == 0 else FORMATS[::-1]):
+            results[fmt].append(run(fmt, args.image, args.preferences, products, args.dishes))
+
+    columns = ("prompt_tokens_est", "input_tokens", "output_tokens", "first_dish_s", "total_s", "dishes", "complete")
+    print(f"{'format':<8}" + "".join(f"{c:>15}" for c in columns))
+    for fmt, runs in results.items():
+        means = [statistics.mean(r[c] for r in runs) for c in columns]
+        print(f"{fmt:<8}" + "".join(f"{m:>15.2f}" if isinstance(m, float) else f"{m:>15}" for m in means))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Offline stand-in for the OpenAI endpoints the backend calls.
+
+Implements POST /v1/responses (plain and streamed, text and json_schema
+output) and POST /v1/images/generations, with configurable latency,
+error and 429 rates. Point the backend at it with OPENAI_BASE_URL:
+
+    python api/benchmarks/fake_openai.py --port 8100 --text-latency lognormal:2,0.4 --rate-limit 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake python api/backend/manage.py runserver
+
+Latency specs: ``fixed:S``, ``uniform:LO,HI`` or ``lognormal:MEDIAN,SIGMA``
+(seconds). Streamed answers spend the first 20% of the latency before the
+first token and spread the rest over the chunks.
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DISHES = [
+    ("Garlic Mashed Potatoes", ["Potatoes (500g)", "Garlic (3 cloves)", "Olive oil (3 tbsp)"], 25, 2, 310, 6, 12, 45.5),
+    ("Potato Onion Soup", ["Potatoes (3 pieces)", "Onions (1 piece)", "Garlic (2 cloves)"], 40, 2, 240, 5, 7, 38),
+    ("Crispy Potato Wedges", ["Potatoes (4 pieces)", "Olive oil (2 tbsp)"], 45, 1, 280, 4, 10, 42),
+    ("Caramelized Onion Hash", ["Potatoes (2 pieces)", "Onions (2 pieces)", "Garlic (1 clove)"], 35, 3, 330, 6, 14, 44),
+]
+STEPS = [
+    "Peel and dice the potatoes into even chunks, about 2 cm each.",
+    "Bring a pot of salted water to a boil; cook the potatoes for 15 minutes until tender.",
+    "Meanwhile slice the onions and crush the garlic with the flat side of a knife.",
+    "Warm 2 tbsp of oil in a pan over medium heat and cook the onions for 8 minutes.",
+    "Combine everything, season with salt and pepper and serve hot.",
+]
+PANTRY = ["Potatoes (1 kg)", "Onions (3 pieces)", "Garlic (1 head)", "Olive oil (1 bottle)"]
+
+
+def recipes_text(count):
+    blocks = []
+    for name, products, *numbers in DISHES[:count]:
+        steps = "\n\n".join(f"Step {i}.\n{s}" for i, s in enumerate(STEPS, 1))
+        blocks.append("\n".join([name, ", ".join(products), steps, *map(str, numbers), ", ".join(PANTRY)]))
+    return "\n----------\n".join(blocks)
+
+
+def recipes_json(count):
+    dishes = [{"n": name, "p": products, "s": STEPS, "t": t, "d": d, "e": e, "pr": pr, "f": f, "c": c, "x": PANTRY}
+              for name, products, t, d, e, pr, f, c in DISHES[:count]]
+    return json.dumps({"r": dishes})
+
+
+def solid_png(size, rgb=(214, 160, 92)):
+    """A valid ``size`` x ``size`` PNG without Pillow; compresses to a few KB."""
+    row = b"\x00" + bytes(rgb) * size
+    raw = zlib.compress(row * size, 6)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", raw) + chunk(b"IEND", b"")
+
+
+def parse_latency(spec):
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    raise argparse.ArgumentTypeError(f"unknown latency spec {spec!r}")
+
+
+class FakeOpenAI:
+    def __init__(self, text_latency="fixed:0.5", image_latency="fixed:1", error_rate=0.0, rate_limit=0.0,
+                 dishes=3, image_size=256, seed=None):
+        self.text_latency = parse_latency(text_latency)
+        self.image_latency = parse_latency(image_latency)
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.dishes = dishes
+        self.png_b64 = base64.b64encode(solid_png(image_size)).decode()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"responses": 0, "images": 0, "errors": 0, "rate_limited": 0}
+
+    def draw(self, latency):
+        with self.lock:
+            roll = self.rng.random()
+            return roll, latency(self.rng)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+
+def response_object(text, request, output_tokens):
+    prompt = json.dumps(request.get("input", "")) + request.get("instructions", "")
+    input_tokens = max(1, len(prompt) // 4)
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": request.get("model", "fake"),
+        "status": "completed",
+        "output": [{
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None  # set by make_server
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, code, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def fail(self, roll):
+        """Send a 429 or 500 for the unlucky ``roll``; True when the request was failed."""
+        fake = self.fake
+        if roll < fake.rate_limit:
+            fake.count("rate_limited")
+            self.send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests",
+                                           "code": "rate_limit_exceeded"}}, [("Retry-After", "1")])
+            return True
+        if roll < fake.rate_limit + fake.error_rate:
+            fake.count("errors")
+            self.send_json(500, {"error": {"message": "Internal error (fake)", "type": "server_error"}})
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/").endswith("/responses"):
+            self.create_response(request)
+        elif self.path.rstrip("/").endswith("/images/generations"):
+            self.generate_image(request)
+        else:
+            self.send_json(404, {"error": {"message": f"{self.path} is not faked"}})
+
+    def create_response(self, request):
+        fake = self.fake
+        roll, latency = fake.draw(fake.text_latency)
+        if self.fail(roll):
+            return
+        fake.count("responses")
+        structured = ((request.get("text") or {}).get("format") or {}).get("type") == "json_schema"
+        text = recipes_json(fake.dishes) if structured else recipes_text(fake.dishes)
+        output_tokens = max(1, len(text) // 4)
+        if not request.get("stream"):
+            time.sleep(latency)
+            self.send_json(200, response_object(text, request, output_tokens))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [text[i:i + 16] for i in range(0, len(text), 16)]
+        time.sleep(latency * 0.2)
+        delay = latency * 0.8 / max(1, len(chunks))
+        sequence = 0
+
+        def event(payload):
+            nonlocal sequence
+            payload["sequence_number"] = sequence
+            sequence += 1
+            data = f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        done = response_object(text, request, output_tokens)
+        event({"type": "response.created", "response": dict(done, status="in_progress", output=[])})
+        for chunk in chunks:
+            time.sleep(delay)
+            event({"type": "response.output_text.delta", "item_id": done["output"][0]["id"], "output_index": 0,
+                   "content_index": 0, "delta": chunk, "logprobs": []})
+        event({"type": "response.completed", "response": done})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def generate_image(self, request):
+        fake = self.fake
+        roll, latency = fake.draw(fake.image_latency)
+        if self.fail(roll):
+            return
+        fake.count("images")
+        time.sleep(latency)
+        self.send_json(200, {"created": int(time.time()), "data": [{"b64_json": fake.png_b64}]})
+
+
+def make_server(fake, host="127.0.0.1", port=0):
+    handler = type("FakeHandler", (Handler,), {"fake": fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(fake, host="127.0.0.1", port=0):
+    """Start a server in a daemon thread; returns ``(server, base_url)``."""
+    server = make_server(fake, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/v1"
+
+
+def add_arguments(parser):
+    parser.add_argument("--text-latency", default="lognormal:2,0.4", help="recipe call latency spec")
+    parser.add_argument("--image-latency", default="lognormal:8,0.3", help="image call latency spec")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument("--dishes", type=int, default=3, help="dishes per canned answer (max 4)")
+    parser.add_argument("--image-size", type=int, default=1024, help="edge of the generated PNG")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def from_args(args):
+    return FakeOpenAI(text_latency=args.text_latency, image_latency=args.image_latency, error_rate=args.error_rate,
+                      rate_limit=args.rate_limit, dishes=args.dishes, image_size=args.image_size, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = make_server(from_args(args), args.host, args.port)
+    print(f"Fake OpenAI on http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
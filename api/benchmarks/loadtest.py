@@ -0,0 +1,290 @@
+"""Load test for /api/get-dishes/ (or /api/get-dishes/batch/) and /api/images/<id>/.
+
+Drives the API at a fixed concurrency and reports per endpoint the
+throughput, p50/p95/p99 latency and status codes, plus the peak and final
+resident memory of every server worker process.
+
+Fully offline, against the fake OpenAI server (see fake_openai.py):
+
+    python api/benchmarks/loadtest.py --fake --spawn "python manage.py runserver --noreload 127.0.0.1:8000" \\
+        --concurrency 16 --requests 200
+
+Against an already running server (pass its master pid for memory numbers):
+
+    python api/benchmarks/loadtest.py --base http://127.0.0.1:8000 --pid 12345 --image api/test.jpg
+
+With --batch N every request sends N pantries to the batch endpoint and
+its latency is the time to the final ``done`` event.
+
+--spawn commands run in api/backend with OPENAI_BASE_URL pointing at the
+fake server when --fake is given. Memory sampling reads /proc (Linux).
+"""
+import argparse
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(HERE, "..", "backend")
+sys.path.insert(0, HERE)
+
+import fake_openai  # noqa: E402
+
+PANTRY = ["Potatoes", "Onions", "Garlic", "Olive oil", "Eggs", "Milk", "Flour", "Tomatoes", "Cheese", "Rice"]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def children(pid):
+    """``pid`` and all its descendants, read from /proc."""
+    parents = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after ')'.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents[ppid].append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        tree.append(p)
+        todo.extend(parents.get(p, []))
+    return tree
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = {}
+        self.last = {}
+        self.stopped = threading.Event()
+
+    def sample(self):
+        for pid in children(self.pid):
+            rss = rss_mb(pid)
+            if rss is not None:
+                self.last[pid] = rss
+                self.peak[pid] = max(rss, self.peak.get(pid, 0))
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.extra = Counter()
+
+    def add(self, endpoint, seconds, status):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+
+    def note(self, key):
+        with self.lock:
+            self.extra[key] += 1
+
+
+def pantry_for(i, distinct):
+    # distinct=0: every request is new, so caches and the corpus miss.
+    n = i if not distinct else i % distinct
+    products = [PANTRY[(n + k) % len(PANTRY)] for k in range(4)]
+    if not distinct or n >= len(PANTRY):
+        products.append(f"Spice blend {n}")
+    return products
+
+
+def one_batch(session, args, i, results):
+    items = [{"id": str(k), "products": pantry_for(i * args.batch + k, args.distinct)} for k in range(args.batch)]
+    data = {"items": items}
+    if args.deadline_ms:
+        data["deadline_ms"] = args.deadline_ms
+    if args.format:
+        data["recipes_format"] = args.format
+    started = time.perf_counter()
+    try:
+        resp = session.post(f"{args.base}/api/get-dishes/batch/", json=data, timeout=args.timeout, stream=True)
+        status = resp.status_code
+        events = [json.loads(line) for line in resp.iter_lines() if line]
+    except requests.RequestException as exc:
+        results.add("batch", time.perf_counter() - started, type(exc).__name__)
+        return
+    results.add("batch", time.perf_counter() - started, status)
+    for event in events:
+        if event["type"] == "dishes":
+            results.note(f"source={event['source']}")
+        elif event["type"] in ("error", "image_failed", "image_pending"):
+            results.note(event["type"])
+
+
+def one_user(session, args, i, results):
+    if args.batch:
+        return one_batch(session, args, i, results)
+    data = {"products": json.dumps(pantry_for(i, args.distinct))}
+    if args.deadline_ms:
+        data["deadline_ms"] = str(args.deadline_ms)
+    if args.format:
+        data["recipes_format"] = args.format
+    files = None
+    if args.image:
+        with open(args.image, "rb") as f:
+            files = {"image": (os.path.basename(args.image), f.read(), "image/jpeg")}
+        data.pop("products")
+
+    started = time.perf_counter()
+    try:
+        resp = session.post(f"{args.base}/api/get-dishes/", data=data, files=files, timeout=args.timeout)
+        status = resp.status_code
+    except requests.RequestException as exc:
+        results.add("get-dishes", time.perf_counter() - started, type(exc).__name__)
+        return
+    results.add("get-dishes", time.perf_counter() - started, status)
+    if status != 200:
+        return
+    body = resp.json()
+    results.note(f"source={body.get('source', 'model')}")
+
+    for dish in (body.get("dishes") or [])[:args.images_per_dish or 0]:
+        started = time.perf_counter()
+        try:
+            resp = session.get(f"{args.base}/api/images/{dish['image_id']}.png/", params=args.image_params,
+                               timeout=args.timeout)
+            resp.content
+            status = resp.status_code
+        except requests.RequestException as exc:
+            status = type(exc).__name__
+        results.add("images", time.perf_counter() - started, status)
+
+
+def wait_for_port(base, timeout=60):
+    url = urlparse(base)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{base}/metrics", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise SystemExit(f"server at {url.netloc} did not come up in {timeout}s")
+
+
+def report(results, elapsed, memory):
+    print(f"\n{'endpoint':<12}{'requests':>9}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for endpoint, latencies in results.latencies.items():
+        statuses = ", ".join(f"{code}: {n}" for code, n in sorted(results.statuses[endpoint].items(), key=str))
+        print(f"{endpoint:<12}{len(latencies):>9}{len(latencies) / elapsed:>9.1f}"
+              f"{percentile(latencies, 0.5) * 1000:>10.0f}{percentile(latencies, 0.95) * 1000:>10.0f}"
+              f"{percentile(latencies, 0.99) * 1000:>10.0f}  {statuses}")
+    if results.extra:
+        print("responses: " + ", ".join(f"{k} {v}" for k, v in sorted(results.extra.items())))
+    if memory is not None:
+        print(f"\n{'pid':>8}{'peak MB':>10}{'final MB':>10}")
+        for pid in sorted(memory.peak):
+            print(f"{pid:>8}{memory.peak[pid]:>10.1f}{memory.last.get(pid, 0):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="get-dishes requests in total")
+    parser.add_argument("--images-per-dish", type=int, default=1, help="image fetches after each get-dishes")
+    parser.add_argument("--image-params", type=json.loads, default={}, help='e.g. \'{"w": 256, "fmt": "webp"}\'')
+    parser.add_argument("--image", help="photo to upload instead of a products list")
+    parser.add_argument("--batch", type=int, default=0, help="pantries per request to the batch endpoint")
+    parser.add_argument("--distinct", type=int, default=0, help="distinct pantries to cycle through (0: all new)")
+    parser.add_argument("--deadline-ms", type=int)
+    parser.add_argument("--format", choices=["text", "json"])
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--fake", action="store_true", help="start the fake OpenAI server in this process")
+    parser.add_argument("--spawn", help="server command to start (in api/backend) and stop afterwards")
+    parser.add_argument("--pid", type=int, help="server pid to sample memory from (with its children)")
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.fake:
+        server, base_url = fake_openai.start_in_thread(fake_openai.from_args(args))
+        env.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY=env.get("OPENAI_API_KEY", "fake"))
+        print(f"fake OpenAI at {base_url}")
+
+    proc = None
+    if args.spawn:
+        proc = subprocess.Popen(shlex.split(args.spawn), cwd=BACKEND, env=env, start_new_session=True,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(args.base)
+    pid = proc.pid if proc else args.pid
+
+    memory = MemorySampler(pid) if pid and os.path.isdir("/proc") else None
+    if memory:
+        memory.start()
+    results = Results()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            sessions = threading.local()
+
+            def task(i):
+                if not hasattr(sessions, "s"):
+                    sessions.s = requests.Session()
+                one_user(sessions.s, args, i, results)
+
+            list(pool.map(task, range(args.requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        if memory:
+            memory.stop()
+        if proc:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(10)
+
+    report(results, elapsed, memory)
+    if args.fake:
+        print("fake OpenAI calls: " + ", ".join(f"{k} {v}" for k, v in server.RequestHandlerClass.fake.counters.items()))
+
+
+if __name__ == "__main__":
+    main()
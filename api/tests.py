@@ -3,10 +3,13 @@ import json
 import requests
 from pathlib import Path
 
-BASE = "http://65.21.9.14:1212"
+# API_BASE=http://127.0.0.1:8000 runs these against a local server, e.g. one
+# started with OPENAI_BASE_URL pointing at benchmarks/fake_openai.py.
+BASE = os.getenv("API_BASE", "http://65.21.9.14:1212").rstrip("/")
 DISHES_URL = f"{BASE}/api/get-dishes/"
 IMAGES_URL = f"{BASE}/api/images"
-TIMEOUT = 120
+TIMEOUT = float(os.getenv("API_TIMEOUT", "120"))
+TEST_IMAGE = os.getenv("API_TEST_IMAGE", str(Path(__file__).with_name("test.jpg")))
 
 
 def _post_dishes(image_path=None, preferences=None, products=None):
@@ -56,7 +59,7 @@ def _print_name_products_link(label, status, body):
 
 
 def test_image_only():
-    status, body = _post_dishes(image_path=r"A:\global-hackathon-v1\api\test.jpg")
+    status, body = _post_dishes(image_path=TEST_IMAGE)
     _print_name_products_link("test_image_only", status, body)
     assert status == 200, f"Expected 200, got {status}"
     assert isinstance(body, dict) and body.get("status") == "ok", f"Bad body: {body}"
@@ -80,7 +83,7 @@ def test_with_preferences_and_image():
         "favourite": ["soup", "pasta"],
         "time": ["10-15 minutes", "30-45 minutes"]
     }
-    status, body = _post_dishes(image_path=r"A:\global-hackathon-v1\api\test.jpg", preferences=prefs)
+    status, body = _post_dishes(image_path=TEST_IMAGE, preferences=prefs)
     _print_name_products_link("test_with_preferences_and_image", status, body)
     assert status == 200, f"Expected 200, got {status}"
     assert isinstance(body, dict) and body.get("status") == "ok"
@@ -156,8 +156,28 @@ class APIService {
     }
     
     func getImage(imageId: String) async throws -> UIImage {
+        return try await fetchImage(imageId: imageId).image
+    }
+
+    /// Calls `onImage` with the quick preview as soon as it exists and again with the full render.
+    /// Pass `width` (points * scale) to get a resized WebP instead of the 1024px PNG.
+    func loadImageProgressively(imageId: String, width: Int? = nil, onImage: @MainActor (UIImage) -> Void) async throws {
+        let first = try await fetchImage(imageId: imageId, width: width)
+        await onImage(first.image)
+        guard first.tier == "preview" else { return }
+        // The preview is good enough to show if the full render never lands
+        if let full = try? await fetchImage(imageId: imageId, tier: "full", width: width) {
+            await onImage(full.image)
+        }
+    }
+
+    private func fetchImage(imageId: String, tier: String? = nil, width: Int? = nil) async throws -> (image: UIImage, tier: String?) {
         // Django often requires trailing slash; add it here
-        guard let url = URL(string: "\(baseURL)/api/images/\(imageId).png") else {
+        var params: [String] = []
+        if let tier = tier { params.append("tier=\(tier)") }
+        if let width = width { params.append("w=\(width)&fmt=webp") }
+        let query = params.isEmpty ? "" : "?" + params.joined(separator: "&")
+        guard let url = URL(string: "\(baseURL)/api/images/\(imageId).png\(query)") else {
             throw APIError.invalidURL
         }
         var request = URLRequest(url: url)
@@ -172,6 +192,15 @@ class APIService {
             (data, response) = try await URLSession.shared.data(for: request)
         }
 
+        // 202 means the photo is still being generated; poll as the server suggests
+        var polls = 0
+        while let http = response as? HTTPURLResponse, http.statusCode == 202, polls < 60 {
+            let retryAfter = Double(http.value(forHTTPHeaderField: "Retry-After") ?? "") ?? 2
+            try await Task.sleep(nanoseconds: UInt64(retryAfter * 1_000_000_000))
+            polls += 1
+            (data, response) = try await URLSession.shared.data(for: request)
+        }
+
         guard let httpResponse = response as? HTTPURLResponse,
               (200...299).contains(httpResponse.statusCode) else {
             #if DEBUG
@@ -195,7 +224,8 @@ class APIService {
             throw APIError.decodingError
         }
 
-        return image
+        let servedTier = (response as? HTTPURLResponse)?.value(forHTTPHeaderField: "X-Image-Tier")
+        return (image, servedTier)
     }
 }
 
@@ -133,8 +133,7 @@ struct CompactDishCardView: View {
                     await MainActor.run { isLoadingImage = false }
                     return
                 }
-                let image = try await APIService.shared.getImage(imageId: imageId)
-                await MainActor.run {
+                try await APIService.shared.loadImageProgressively(imageId: imageId, width: 256) { image in
                     dishImage = image
                     isLoadingImage = false
                 }
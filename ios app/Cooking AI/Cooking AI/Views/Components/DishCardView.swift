@@ -215,8 +215,7 @@ struct DishCardView: View {
                     await MainActor.run { isLoadingImage = false }
                     return
                 }
-                let image = try await APIService.shared.getImage(imageId: imageId)
-                await MainActor.run {
+                try await APIService.shared.loadImageProgressively(imageId: imageId) { image in
                     dishImage = image
                     isLoadingImage = false
                 }